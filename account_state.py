@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pandas as pd
+
+import ti_functional as tif
+
+
+class AccountSnapshot:
+    """
+    Снимок состояния счета: свободные средства и текущие позиции.
+    Загружается один раз за цикл стратегии (refresh) и обновляется на месте после собственных заявок,
+    повторно запрашивается из API только после истечения ttl
+    :param client: TIClient - клиент API (None - общий клиент ti_functional)
+    :param ttl: float - время жизни снимка, сек
+    :param account_id: str - счет (None - main_account_id из lock_info)
+    """
+
+    def __init__(self, client=None, ttl=60.0, account_id=None):
+        self.client = client
+        self.account_id = account_id
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._balance = {}
+        self._positions = pd.DataFrame(columns=['figi', 'quantity', 'avg_price', 'cur_pos_price'])
+        self._updated = None
+
+    @property
+    def is_stale(self):
+        return self._updated is None or time.monotonic() - self._updated > self.ttl
+
+    def refresh(self):
+        """
+        Загружает свободные средства и позиции из API
+        """
+        balance = tif.get_available_balance(client=self.client, account_id=self.account_id)
+        positions = tif.get_current_positions(client=self.client, account_id=self.account_id)
+        with self._lock:
+            self._balance, self._positions = balance, positions
+            self._updated = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self.is_stale:
+            self.refresh()
+
+    @property
+    def balance(self):
+        """
+        Свободные средства: {валюта: сумма}
+        """
+        with self._lock:
+            self._ensure_fresh()
+            return self._balance
+
+    @property
+    def positions(self):
+        """
+        Текущие позиции в формате tif.get_current_positions
+        """
+        with self._lock:
+            self._ensure_fresh()
+            return self._positions
+
+    def available(self, currency='rub'):
+        return self.balance.get(currency, 0.0)
+
+    def positions_cost(self):
+        """
+        Оценочная стоимость открытых позиций
+        """
+        return self.positions.cur_pos_price.values.sum()
+
+    def quantity(self, figi):
+        """
+        Кол-во бумаг (не лотов) в позиции по инструменту, 0 если позиции нет
+        """
+        positions = self.positions
+        if 'quantity' not in positions:
+            return 0
+        return int(positions.loc[positions.figi == figi, 'quantity'].sum())
+
+    def apply_order(self, figi, quantity, price, direction, currency='rub'):
+        """
+        Учитывает выставленную заявку: меняет свободные средства и позицию
+        :param figi: str - индентификатор инстумента
+        :param quantity: int - кол-во бумаг (лоты * лотность)
+        :param price: float - цена заявки
+        :param direction: str - направление заявки (buy/sell)
+        """
+        sign = 1 if direction == 'buy' else -1
+        amount = quantity * price
+
+        with self._lock:
+            self._ensure_fresh()
+            self._balance[currency] = self._balance.get(currency, 0.0) - sign * amount
+
+            positions = self._positions
+            idx = positions.index[positions.figi == figi]
+            if len(idx) == 0:
+                new_position = pd.DataFrame([{'figi': figi, 'quantity': sign * quantity, 'avg_price': price,
+                                              'cur_pos_price': sign * amount, 'currency': currency}])
+                positions = pd.concat((positions, new_position), ignore_index=True)
+            else:
+                positions.loc[idx[0], 'quantity'] += sign * quantity
+                positions.loc[idx[0], 'cur_pos_price'] += sign * amount
+                positions = positions[positions.quantity != 0].reset_index(drop=True)
+            self._positions = positions
@@ -0,0 +1,143 @@
+import json
+import os
+import time
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from tinkoff.invest import CandleInterval
+
+import ti_functional as tif
+from candle_store import CandleStore, NS, datetime_to_ns, ns_to_datetime
+
+# часть периода загрузки, которая загружается одним запросом GetCandles
+Chunk = namedtuple('Chunk', ['figi', 'interval', 'from_ns', 'to_ns'])
+
+BACKFILL_WORKERS = 8  # запросов одновременно (частота ограничивается планировщиком клиента)
+FLUSH_CHUNKS = 20  # загруженные части инструмента записываются в хранилище пачками
+
+
+def make_chunks(figis, from_, to, interval=CandleInterval.CANDLE_INTERVAL_15_MIN, period=None,
+                skip_weekends=False):
+    """
+    Делит период [from_, to) на части не длиннее допустимого периода одного запроса.
+    Границы частей кратны period от начала эпохи, поэтому не меняются между запусками
+    (по ним сверяется контрольная точка)
+    :param period: timedelta - длина части (None - tif.CANDLE_REQUEST_PERIOD)
+    :param skip_weekends: bool - пропускать субботы и воскресенья (для частей не длиннее суток)
+    :return: list of Chunk - по инструментам, внутри инструмента - по времени
+    """
+    interval = CandleInterval(interval)
+    step = int((period or tif.CANDLE_REQUEST_PERIOD[interval]).total_seconds()) * NS
+    from_ns, to_ns = datetime_to_ns(from_), datetime_to_ns(to)
+    starts = np.arange(from_ns // step * step, to_ns, step, dtype=np.int64)
+    if skip_weekends and step <= 86400 * NS:
+        starts = starts[np.is_busday((starts // (86400 * NS)).astype('datetime64[D]'))]
+
+    return [Chunk(figi, interval, int(max(start, from_ns)), int(min(start + step, to_ns)))
+            for figi in figis for start in starts]
+
+
+class Checkpoint:
+    """
+    Загруженные части периода в json-файле: прерванная загрузка продолжается с незагруженных частей.
+    Часть отмечается только после записи ее свечей в хранилище
+    :param path: str - файл контрольной точки
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self._done = set(json.load(f))
+
+    @staticmethod
+    def _key(chunk):
+        return f'{chunk.figi}:{chunk.interval.name}:{chunk.from_ns}:{chunk.to_ns}'
+
+    def __contains__(self, chunk):
+        return self._key(chunk) in self._done
+
+    def mark(self, chunks):
+        self._done.update(self._key(chunk) for chunk in chunks)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(sorted(self._done), f)
+        os.replace(tmp_path, self.path)
+
+
+def backfill(figis, days=365, interval=CandleInterval.CANDLE_INTERVAL_15_MIN, store=None, client=None,
+             workers=BACKFILL_WORKERS, checkpoint=None, period=None, skip_weekends=False, to=None,
+             flush_chunks=FLUSH_CHUNKS):
+    """
+    Загрузка истории в CandleStore: период делится на части (один запрос GetCandles на часть),
+    части всех инструментов загружаются параллельно в пределах квот API (планировщик клиента,
+    приоритет загрузки истории ниже заявок и текущих данных). Загруженные части записываются
+    в хранилище и отмечаются в контрольной точке, при повторном запуске загружаются только
+    оставшиеся. Последняя неполная часть (до текущего момента) не отмечается
+    :param figis: list of str - инструменты
+    :param days: int - глубина истории в днях
+    :param store: CandleStore - хранилище (None - каталог по умолчанию)
+    :param client: TIClient/FakeClient - клиент API (None - общий клиент ti_functional)
+    :param workers: int - кол-во одновременных запросов
+    :param checkpoint: str - файл контрольной точки (None - backfill_checkpoint.json в каталоге хранилища)
+    :param period: timedelta - длина части (None - tif.CANDLE_REQUEST_PERIOD)
+    :param skip_weekends: bool - не запрашивать выходные дни
+    :param to: datetime - конец периода (None - текущий момент)
+    :param flush_chunks: int - сколько загруженных частей инструмента накапливать перед записью
+    :return: dict - кол-во частей, свечей, время загрузки, незагруженные части
+    """
+    store = store or CandleStore(client=client)
+    checkpoint = Checkpoint(checkpoint or os.path.join(store.path, 'backfill_checkpoint.json'))
+    to = to or datetime.now(timezone.utc)
+    chunk_period = int((period or tif.CANDLE_REQUEST_PERIOD[CandleInterval(interval)]).total_seconds()) * NS
+
+    chunks = [chunk for chunk in make_chunks(figis, to - timedelta(days=days), to, interval, period, skip_weekends)
+              if chunk not in checkpoint]
+    remaining = Counter(chunk.figi for chunk in chunks)
+    pending = defaultdict(list)  # figi -> [(chunk, records)], еще не записанные
+    failed = []
+    loaded = 0
+
+    def flush(figi):
+        nonlocal loaded
+        parts = pending.pop(figi, [])
+        records = [records for _, records in parts if len(records)]
+        if records:
+            store.write(figi, interval, np.concatenate(records))
+            loaded += sum(len(r) for r in records)
+        # часть, которая заканчивается текущим моментом, еще может пополниться
+        checkpoint.mark([chunk for chunk, _ in parts if chunk.to_ns - chunk.from_ns == chunk_period])
+
+    def fetch(chunk):
+        return tif.get_candles(chunk.figi, ns_to_datetime(chunk.from_ns), ns_to_datetime(chunk.to_ns),
+                               chunk.interval, client)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch, chunk): chunk for chunk in chunks}
+        for done, future in enumerate(as_completed(futures), 1):
+            chunk = futures[future]
+            try:
+                pending[chunk.figi].append((chunk, future.result()))
+            except Exception as e:
+                failed.append((chunk, e))
+            remaining[chunk.figi] -= 1
+            if remaining[chunk.figi] == 0 or len(pending[chunk.figi]) >= flush_chunks:
+                flush(chunk.figi)
+            if done % 500 == 0:
+                print(f'Backfill: {done}/{len(chunks)} chunks, {loaded} candles, {time.perf_counter() - start:.0f}s')
+
+    elapsed = time.perf_counter() - start
+    print(f'Backfill done: {len(chunks)} chunks, {loaded} candles, failed: {len(failed)}, {elapsed:.1f}s')
+    return {'chunks': len(chunks), 'candles': loaded, 'elapsed': elapsed, 'failed': failed}
+
+
+if __name__ == "__main__":
+    import sys
+
+    from cli import main
+
+    main(['backfill', *sys.argv[1:]])  # те же аргументы, что у python cli.py backfill
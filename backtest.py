@@ -0,0 +1,174 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import ti_functional as tif
+from candle_store import CandleStore, CANDLE_STORE_DIR
+from state_store import get_state
+
+# сетка параметров стратегии
+MIN_MA_RANGE = range(5, 21)
+MAX_MA_RANGE = range(10, 41)
+STOP_LOSS_LEVELS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02)
+
+# правила ma_execute
+BUY_SLIPPAGE = 1.0005  # лимитная заявка на покупку: тек.цена + погрешность
+TAKE_PROFIT = 0.05
+
+
+def moving_averages(close, windows):
+    """
+    Скользящие средние для всех окон из одной кумулятивной суммы
+    :param close: np.ndarray (T,) - цены закрытия
+    :param windows: np.ndarray (W,) - окна
+    :return: np.ndarray (W, T), до заполнения окна - nan
+    """
+    csum = np.concatenate([[0.0], np.cumsum(close)])
+    idx = np.arange(1, len(close) + 1)
+    start = idx[None, :] - windows[:, None]
+    ma = (csum[idx][None, :] - csum[np.maximum(start, 0)]) / windows[:, None]
+    ma[start < 0] = np.nan
+    return ma
+
+
+def param_grid(min_ma_range=MIN_MA_RANGE, max_ma_range=MAX_MA_RANGE, stop_loss_levels=STOP_LOSS_LEVELS):
+    """
+    Все комбинации (min_ma, max_ma, stop_loss) с min_ma < max_ma
+    :return: (np.ndarray, np.ndarray, np.ndarray) - min_ma, max_ma, stop_loss по комбинациям
+    """
+    min_ma, max_ma, stop_loss = np.meshgrid(np.asarray(min_ma_range), np.asarray(max_ma_range),
+                                            np.asarray(stop_loss_levels), indexing='ij')
+    valid = min_ma < max_ma
+    return min_ma[valid], max_ma[valid], stop_loss[valid]
+
+
+def simulate(records, min_ma, max_ma, stop_loss):
+    """
+    Прогон правил ma_trading_strategy сразу по всем комбинациям параметров.
+    На закрытии свечи t считаются to_buy/signal, решения исполняются по открытию свечи t+1
+    (текущая цена в момент запуска стратегии), стоп/тейк проверяются по low/high свечи t+1:
+    - вход при to_buy == 1 и signal == 1 без позиции, stop_loss/take_profit от текущей цены;
+    - пока to_buy == 1, stop_loss подтягивается за ценой;
+    - выход по рынку при to_buy == 0
+    :param records: np.ndarray tif.CANDLE_DTYPE
+    :param min_ma, max_ma, stop_loss: np.ndarray (C,) - комбинации параметров
+    :return: dict of np.ndarray (C,) - cnt_deals, fin_result (сумма доходностей сделок, %), success_deals
+    """
+    close, open_, high, low = records['close'], records['open'], records['high'], records['low']
+    windows = np.union1d(min_ma, max_ma)
+    ma = moving_averages(close, windows)
+    fast, slow = ma[np.searchsorted(windows, min_ma)], ma[np.searchsorted(windows, max_ma)]
+
+    to_buy = tif.ma_above(fast, slow)  # (C, T), nan и равные средние - 0, как в ma_indicator
+    signal = np.ones_like(to_buy)
+    signal[:, 1:] = to_buy[:, 1:] != to_buy[:, :-1]
+    enter = to_buy & signal
+
+    n = len(min_ma)
+    in_pos = np.zeros(n, dtype=bool)
+    entry, stop, take = np.zeros(n), np.zeros(n), np.zeros(n)
+    cnt, wins, fin = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64), np.zeros(n)
+
+    def close_deals(mask, price):
+        ret = (price - entry[mask]) / entry[mask] * 100
+        cnt[mask] += 1
+        wins[mask] += ret > 0
+        fin[mask] += ret
+        in_pos[mask] = False
+
+    for t in range(int(max_ma.min()) - 1, len(close) - 1):
+        cur = open_[t + 1]
+
+        # выход по рынку / подтягивание стопа / вход
+        exit_ = in_pos & ~to_buy[:, t]
+        if exit_.any():
+            close_deals(exit_, cur)
+        trail = in_pos & to_buy[:, t]
+        stop[trail] = np.maximum(stop[trail], cur * (1 - stop_loss[trail]))
+        new = ~in_pos & enter[:, t]
+        if new.any():
+            in_pos[new] = True
+            entry[new] = cur * BUY_SLIPPAGE
+            stop[new] = cur * (1 - stop_loss[new])
+            take[new] = cur * (1 + TAKE_PROFIT)
+
+        # срабатывание стоп-заявок внутри свечи t+1 (стоп проверяется первым)
+        stopped = in_pos & (low[t + 1] <= stop)
+        if stopped.any():
+            close_deals(stopped, stop[stopped])
+        taken = in_pos & (high[t + 1] >= take)
+        if taken.any():
+            close_deals(taken, take[taken])
+
+    success = np.divide(wins, cnt, out=np.zeros(n), where=cnt > 0)
+    return {'cnt_deals': cnt, 'fin_result': fin, 'success_deals': success}
+
+
+def optimize(records, grid=None):
+    """
+    Лучшие по fin_result параметры стратегии на истории
+    :param records: np.ndarray tif.CANDLE_DTYPE
+    :param grid: результат param_grid (None - сетка по умолчанию)
+    :return: dict в формате best_ma_params.yaml или None, если истории не хватает
+    """
+    min_ma, max_ma, stop_loss = grid if grid is not None else param_grid()
+    if len(records) <= max_ma.max():
+        return None
+
+    result = simulate(records, min_ma, max_ma, stop_loss)
+    best = int(np.argmax(result['fin_result']))
+    return {'cnt_deals': int(result['cnt_deals'][best]),
+            'fin_result': round(float(result['fin_result'][best]), 2),
+            'max_ma': int(max_ma[best]),
+            'min_ma': int(min_ma[best]),
+            'stop_loss': float(stop_loss[best]),
+            'success_deals': round(float(result['success_deals'][best]), 3)}
+
+
+def _optimize_figi(args):
+    figi, store_path, days = args
+    records = CandleStore(store_path).get_window(figi, days=days, update=False)
+    return figi, optimize(records)
+
+
+def run_backtest(figis=None, days=160, store_path=CANDLE_STORE_DIR, update=True, processes=None,
+                 file_name='best_ma_params', state=None):
+    """
+    Подбор параметров по всем инструментам, запись в хранилище состояния и в best_ma_params.yaml
+    (параметры инструментов, для которых не хватило истории, не меняются)
+    :param figis: list of str - инструменты (None - все, по которым есть параметры)
+    :param days: int - глубина истории в днях
+    :param store_path: str - каталог CandleStore
+    :param update: bool - догрузить свечи в хранилище перед расчетом
+    :param processes: int - кол-во процессов (None - по числу ядер)
+    :param file_name: str - yaml-файл для выгрузки параметров
+    :param state: StateStore - состояние стратегии (None - общее хранилище state_store)
+    :return: dict - параметры по figi
+    """
+    state = get_state(state)
+    params = state.params
+    figis = list(params) if figis is None else figis
+
+    start = time.perf_counter()
+    if update:
+        store = CandleStore(store_path)
+        for figi in figis:
+            store.update(figi, days=days)
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for figi, best in pool.map(_optimize_figi, [(figi, store_path, days) for figi in figis]):
+            if best is None:
+                print(f'{figi}: недостаточно истории')
+                continue
+            params[figi] = best
+            print(f'{figi}: {best}')
+
+    state.set_params(params)
+    tif.save_yaml(params, file_name)
+    print(f'Backtest time: {time.perf_counter() - start:.1f}s, figis: {len(figis)}')
+    return params
+
+
+if __name__ == "__main__":
+    run_backtest()
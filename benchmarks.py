@@ -0,0 +1,182 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ti_functional as tif
+from account_state import AccountSnapshot
+from candle_store import NS
+from ma_trading import MAX_WORKERS, TradingContext, run_tick, stock_list
+from replay import DEFAULT_PARAMS, ReplayServices, make_share, synthetic_candles
+from ti_client import FakeClient
+
+TICKERS = stock_list  # тикеры стратегии
+HISTORY_DAYS = 170  # торговых дней синтетической истории (хватает на get_historical_info за 160 дней)
+SEED = 0
+BAR_NS = 15 * 60 * NS  # интервал свечей synthetic_candles
+
+
+def make_services(tickers=TICKERS, days=HISTORY_DAYS, until=None):
+    """
+    :param until: int - время (нс, UTC): история сдвигается так, что последняя свеча - незакрытая
+    на этот момент (None - история с 2023-01-09)
+    """
+    shares = [make_share(f'BENCH{i:04}', tick, lot=10) for i, tick in enumerate(tickers)]
+    candles = {share.figi: synthetic_candles(days=days, seed=SEED + i) for i, share in enumerate(shares)}
+    if until is not None:
+        last = max(int(records['time'][-1]) for records in candles.values())
+        for records in candles.values():
+            records['time'] += until // BAR_NS * BAR_NS - last
+    return ReplayServices(candles, shares)
+
+
+def _history(days):
+    def setup():
+        services = make_services(TICKERS[:1])
+        return FakeClient(services), services.shares[0].figi
+
+    def run(args):
+        client, figi = args
+        tif.get_historical_info(figi, days=days, client=client)
+    return setup, run
+
+
+def _indicator(func, *params):
+    def setup():
+        services = make_services(TICKERS[:1])
+        return tif.get_historical_info(services.shares[0].figi, days=160, client=FakeClient(services))
+
+    def run(data):
+        func(data.copy(), *params)
+    return setup, run
+
+
+def _lots(use_snapshot):
+    def setup():
+        client = FakeClient(make_services(TICKERS[:1]))
+        return client, AccountSnapshot(client) if use_snapshot else None
+
+    def run(args):
+        client, snapshot = args
+        tif.calc_num_lots_for_buy(10, 100.0, client=client, snapshot=snapshot)
+    return setup, run
+
+
+class ReplayTick:
+    """
+    Тики ma_trading.run_tick по свечам ReplayServices в установившемся режиме. Хранилище свечей, сканер
+    и запрос текущей свечи отсчитывают время от datetime.now(), поэтому история заканчивается текущей
+    свечей, а часы воспроизведения идут вместе с реальными. Справочник, хранилище свечей, состояние
+    и журнал задержек - во временном каталоге, печать тика не выводится. Первый тик (загрузка истории
+    и прогрев МА) выполняется при создании
+    """
+
+    def __init__(self, tickers, days=30):
+        self.services = make_services(tickers, days, until=time.time_ns())
+        self._tmpdir = tempfile.TemporaryDirectory(prefix='ti_bench_')
+        self.context = TradingContext(tickers, client=FakeClient(self.services), account_id='bench',
+                                      workdir=self._tmpdir.name)
+        self.context.state.set_params({share.figi: dict(DEFAULT_PARAMS) for share in self.services.shares})
+        self.pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        self.step()
+
+    def step(self):
+        self.services.now = time.time_ns()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_tick(self.pool, self.context)
+
+    def close(self):
+        self.pool.shutdown()
+        self.context.close()
+        self._tmpdir.cleanup()
+
+
+def _tick(tickers):
+    def setup():
+        return ReplayTick(tickers)
+
+    def run(replay_tick):
+        replay_tick.step()
+    return setup, run
+
+
+# имя: (подготовка данных, замеряемая функция, кол-во вызовов в одном повторе)
+BENCHMARKS = {
+    'get_historical_info_10d': (*_history(10), 20),
+    'get_historical_info_160d': (*_history(160), 3),
+    'ma_indicator': (*_indicator(tif.ma_indicator, 12, 24), 20),
+    'macd_indicator': (*_indicator(tif.macd_indicator, 12, 26, 9), 20),
+    'calc_num_lots_for_buy_api': (*_lots(False), 50),
+    'calc_num_lots_for_buy_snapshot': (*_lots(True), 50),
+    'tick_16': (*_tick(TICKERS), 10),
+}
+
+
+def run_benchmark(setup, run, number, repeat=5):
+    """
+    Замер времени одного вызова: для каждого повтора данные готовятся заново (не входит в замер,
+    после замера у данных с методом close он вызывается), сборщик мусора на время замера отключается
+    :return: dict - min/median/max по повторам, сек на вызов
+    """
+    timings = []
+    for _ in range(repeat):
+        args = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(number):
+                run(args)
+            timings.append((time.perf_counter() - start) / number)
+        finally:
+            gc.enable()
+            if hasattr(args, 'close'):
+                args.close()
+    return {'min': min(timings), 'median': statistics.median(timings), 'max': max(timings),
+            'number': number, 'repeat': repeat}
+
+
+def run_benchmarks(names=None, repeat=5):
+    """
+    :param names: list of str - бенчмарки (None - все)
+    :return: dict - {имя: результат run_benchmark}
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        setup, run, number = BENCHMARKS[name]
+        results[name] = result = run_benchmark(setup, run, number, repeat)
+        print(f'{name:32} min {result["min"] * 1000:9.3f}ms  median {result["median"] * 1000:9.3f}ms')
+    return results
+
+
+def compare(results, baseline):
+    """
+    Печатает изменение медианы относительно сохраненных результатов
+    """
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['median'] / baseline[name]['median']
+        print(f'{name:32} {baseline[name]["median"] * 1000:9.3f}ms -> {result["median"] * 1000:9.3f}ms  x{ratio:.2f}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Бенчмарки стратегии без сети')
+    parser.add_argument('names', nargs='*', help='бенчмарки (по умолчанию все)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', help='json-файл для сохранения результатов')
+    parser.add_argument('--compare', help='json-файл с результатами для сравнения')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.names, args.repeat)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
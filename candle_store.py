@@ -0,0 +1,196 @@
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from tinkoff.invest import CandleInterval
+
+import ti_functional as tif
+
+CANDLE_STORE_DIR = os.environ.get('TI_CANDLE_STORE_DIR', 'candle_store')
+
+INTERVAL_DURATION = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: timedelta(minutes=1),
+    CandleInterval.CANDLE_INTERVAL_5_MIN: timedelta(minutes=5),
+    CandleInterval.CANDLE_INTERVAL_15_MIN: timedelta(minutes=15),
+    CandleInterval.CANDLE_INTERVAL_HOUR: timedelta(hours=1),
+    CandleInterval.CANDLE_INTERVAL_DAY: timedelta(days=1),
+}
+
+NS = 10 ** 9
+MSK_OFFSET_NS = 3 * 3600 * NS  # для определения торгового дня по московскому времени
+
+
+def ns_to_datetime(ns):
+    return datetime.fromtimestamp(int(ns) / NS, tz=timezone.utc)
+
+
+def datetime_to_ns(dt):
+    return int(dt.timestamp()) * NS
+
+
+class CandleStore:
+    """
+    Локальное хранилище свечей: по файлу на пару (figi, интервал) в каталоге path.
+    Файл - последовательность записей tif.CANDLE_DTYPE, отсортированных по времени,
+    читается через np.memmap, новые свечи дописываются в конец.
+    :param path: str - каталог хранилища
+    :param client: TIClient - клиент API для догрузки свечей (None - общий клиент ti_functional)
+    """
+
+    def __init__(self, path=CANDLE_STORE_DIR, client=None):
+        self.path = path
+        self.client = client
+        self._locks = defaultdict(threading.Lock)
+        # файл -> время, начиная с которого история уже запрашивалась (раньше первой свечи может не быть
+        # торгов: выходные, праздники - такой период не запрашивается на каждом тике заново)
+        self._requested_from = {}
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, figi, interval):
+        return os.path.join(self.path, f'{figi}_{CandleInterval(interval).name}.bin')
+
+    def load(self, figi, interval=CandleInterval.CANDLE_INTERVAL_15_MIN, from_ns=None):
+        """
+        Читает сохраненные свечи (копию), начиная с from_ns
+        :param figi: str - индентификатор инстумента
+        :param interval: CandleInterval - интервал свечей
+        :param from_ns: int - время начала (нс, UTC), None - все свечи
+        :return: np.ndarray CANDLE_DTYPE
+        """
+        file = self._file(figi, interval)
+        if not os.path.exists(file) or os.path.getsize(file) == 0:
+            return np.empty(0, dtype=tif.CANDLE_DTYPE)
+
+        mm = np.memmap(file, dtype=tif.CANDLE_DTYPE, mode='r')
+        start = 0 if from_ns is None else np.searchsorted(mm['time'], from_ns)
+        records = np.array(mm[start:])
+        del mm
+        return records
+
+    def time_range(self, figi, interval=CandleInterval.CANDLE_INTERVAL_15_MIN):
+        """
+        Время первой и последней сохраненной свечи (нс, UTC) или (None, None)
+        """
+        file = self._file(figi, interval)
+        if not os.path.exists(file) or os.path.getsize(file) == 0:
+            return None, None
+
+        mm = np.memmap(file, dtype=tif.CANDLE_DTYPE, mode='r')
+        first, last = int(mm['time'][0]), int(mm['time'][-1])
+        del mm
+        return first, last
+
+    def write(self, figi, interval, records):
+        """
+        Добавляет свечи в хранилище. Свечи не раньше последней сохраненной дописываются в конец
+        (сохраненные свечи с тем же временем заменяются, например незакрытая текущая свеча),
+        остальные объединяются с сохраненными с перезаписью файла
+        :param figi: str - индентификатор инстумента
+        :param interval: CandleInterval - интервал свечей
+        :param records: np.ndarray CANDLE_DTYPE
+        """
+        if len(records) == 0:
+            return
+        records = tif.sort_records(records)
+        file = self._file(figi, interval)
+
+        with self._locks[file]:
+            first, last = self.time_range(figi, interval)
+
+            if last is None or records['time'][0] >= last:
+                # хвост: обрезаем свечи, которые пришли заново, и дописываем новые
+                stored = self.load(figi, interval, from_ns=records['time'][0]) if last is not None else ()
+                with open(file, 'ab') as f:
+                    f.truncate(os.path.getsize(file) - len(stored) * tif.CANDLE_DTYPE.itemsize)
+                    records.tofile(f)
+            else:
+                merged = tif.sort_records(np.concatenate([self.load(figi, interval), records]))
+                tmp_file = file + '.tmp'
+                merged.tofile(tmp_file)
+                os.replace(tmp_file, file)
+
+    def update(self, figi, interval=CandleInterval.CANDLE_INTERVAL_15_MIN, days=10):
+        """
+        Догружает недостающие свечи за последние days дней: до первой сохраненной (если этот период
+        еще не запрашивался) и начиная с последней сохраненной (она могла быть незакрытой)
+        :return: int - кол-во загруженных свечей
+        """
+        now = datetime.now(timezone.utc)
+        from_ = now - timedelta(days=days)
+        file = self._file(figi, interval)
+        first, last = self.time_range(figi, interval)
+        loaded = 0
+
+        if first is None:
+            records = tif.get_candles(figi, from_, now, interval, self.client)
+            self.write(figi, interval, records)
+            self._requested_from[file] = datetime_to_ns(from_)
+            return len(records)
+
+        if datetime_to_ns(from_) < min(first, self._requested_from.get(file, first)):
+            records = tif.get_candles(figi, from_, ns_to_datetime(first), interval, self.client)
+            self.write(figi, interval, records)
+            self._requested_from[file] = datetime_to_ns(from_)
+            loaded += len(records)
+
+        records = tif.get_candles(figi, ns_to_datetime(last), now, interval, self.client)
+        self.write(figi, interval, records)
+        return loaded + len(records)
+
+    def get_window(self, figi, interval=CandleInterval.CANDLE_INTERVAL_15_MIN, days=10, update=True):
+        """
+        Свечи за последние days дней из хранилища (при update=True предварительно догружаются)
+        :return: np.ndarray CANDLE_DTYPE
+        """
+        if update:
+            self.update(figi, interval, days)
+        from_ns = datetime_to_ns(datetime.now(timezone.utc) - timedelta(days=days))
+        return self.load(figi, interval, from_ns=from_ns)
+
+    def get_historical_info(self, figi, candle_interval=CandleInterval.CANDLE_INTERVAL_15_MIN, days=160,
+                            update=True):
+        """
+        Аналог tif.get_historical_info, данные берутся из хранилища
+        :return: pd.DataFrame
+        """
+        return tif.records_to_frame(figi, self.get_window(figi, candle_interval, days, update))
+
+    def find_gaps(self, figi, interval=CandleInterval.CANDLE_INTERVAL_15_MIN, min_gap=4):
+        """
+        Ищет пропуски в сохраненных свечах:
+        - внутри торгового дня - между соседними свечами прошло больше min_gap интервалов
+          (более короткие разрывы считаются отсутствием сделок);
+        - пропущенные сессии - между соседними днями со свечами есть рабочие дни без свечей
+        :param min_gap: int - минимальный пропуск внутри дня в интервалах
+        :return: list of (datetime, datetime) - границы пропусков (свечи на границах есть)
+        """
+        times = self.load(figi, interval)['time']
+        if len(times) < 2:
+            return []
+
+        duration = int(INTERVAL_DURATION[CandleInterval(interval)].total_seconds()) * NS
+        days = ((times + MSK_OFFSET_NS) // (86400 * NS)).astype('datetime64[D]')
+        prev_days, next_days = days[:-1], days[1:]
+
+        intraday = (prev_days == next_days) & (np.diff(times) > duration * min_gap)
+        missed_sessions = np.busday_count(prev_days + 1, next_days) > 0
+
+        idx = np.flatnonzero(intraday | missed_sessions)
+        return [(ns_to_datetime(times[i]), ns_to_datetime(times[i + 1])) for i in idx]
+
+    def repair(self, figi, interval=CandleInterval.CANDLE_INTERVAL_15_MIN, gaps=None):
+        """
+        Загружает заново свечи внутри пропусков (по умолчанию - найденных find_gaps)
+        :return: int - кол-во загруженных свечей
+        """
+        if gaps is None:
+            gaps = self.find_gaps(figi, interval)
+
+        loaded = 0
+        for start, end in gaps:
+            records = tif.get_candles(figi, start, end, interval, self.client)
+            self.write(figi, interval, records)
+            loaded += len(records)
+        return loaded
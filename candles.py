@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+from tinkoff.invest import CandleInterval
+
+import ti_functional as tif
+
+PRICE_FIELDS = ('open', 'close', 'high', 'low')
+FIELDS = ('time',) + PRICE_FIELDS + ('volume',)
+
+# точность хранения: цены float64/float32, объем int64/int32 (время всегда int64, нс UTC)
+PRECISION = {
+    'f8': (np.float64, np.int64),
+    'f4': (np.float32, np.int32),
+}
+
+
+def compact_dtype(precision='f4'):
+    """
+    Структурированный тип свечи для выбранной точности ('f8' совпадает с tif.CANDLE_DTYPE)
+    """
+    price, volume = PRECISION[precision]
+    return np.dtype([('time', 'i8')] + [(name, price) for name in PRICE_FIELDS] + [('volume', volume)])
+
+
+class CandleView:
+    """
+    Свечи одного инструмента внутри CandleSet без копирования: view['close'] - срез колонки хранилища.
+    Поддерживает обращение по полям как массив tif.CANDLE_DTYPE (подходит для backtest.simulate и др.)
+    """
+
+    __slots__ = ('_candles', '_start', '_end')
+
+    def __init__(self, candles, start, end):
+        self._candles = candles
+        self._start = start
+        self._end = end
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, name):
+        return getattr(self._candles, name)[self._start:self._end]
+
+    def to_records(self, precision='f8'):
+        """
+        Копия в виде структурированного массива (precision='f8' - tif.CANDLE_DTYPE для CandleStore)
+        """
+        records = np.empty(len(self), dtype=compact_dtype(precision))
+        for name in FIELDS:
+            records[name] = self[name]
+        return records
+
+
+class CandleSet:
+    """
+    Компактное хранилище свечей по многим инструментам: колонки - отдельные непрерывные массивы
+    (цены float32 или float64, время int64 нс UTC), свечи каждого инструмента идут подряд и
+    отсортированы по времени, figi хранится один раз на инструмент (границы блоков - offsets).
+    Колонки инструмента отдаются срезами без копирования (column(figi) можно сразу передавать в индикаторы)
+    :param figis: list of str - инструменты в порядке блоков
+    :param offsets: np.ndarray (N+1,) - границы блоков инструментов
+    :param columns: dict - {поле: np.ndarray} по FIELDS
+    """
+
+    __slots__ = ('figis', 'offsets', '_index') + FIELDS
+
+    def __init__(self, figis, offsets, columns):
+        self.figis = list(figis)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self._index = {figi: i for i, figi in enumerate(self.figis)}
+        for name in FIELDS:
+            setattr(self, name, columns[name])
+
+    @classmethod
+    def from_records(cls, records, precision='f4'):
+        """
+        :param records: dict - {figi: np.ndarray tif.CANDLE_DTYPE}
+        :param precision: str - 'f4' (float32 цены, int32 объем) или 'f8'
+        """
+        price, volume = PRECISION[precision]
+        figis = list(records)
+        sizes = [len(records[figi]) for figi in figis]
+        offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+        columns = {}
+        for name in FIELDS:
+            dtype = np.int64 if name == 'time' else volume if name == 'volume' else price
+            columns[name] = np.empty(offsets[-1], dtype=dtype)
+            for figi, start, end in zip(figis, offsets[:-1], offsets[1:]):
+                columns[name][start:end] = records[figi][name]
+        return cls(figis, offsets, columns)
+
+    @classmethod
+    def from_store(cls, store, figis, interval=CandleInterval.CANDLE_INTERVAL_15_MIN, from_ns=None, precision='f4'):
+        """
+        Загружает свечи инструментов из CandleStore
+        """
+        return cls.from_records({figi: store.load(figi, interval, from_ns) for figi in figis}, precision)
+
+    @classmethod
+    def from_frame(cls, frame, precision='f4'):
+        """
+        Из DataFrame в формате to_frame / tif.get_historical_info (время берется из колонки time (нс UTC),
+        если ее нет - из begin (московское время))
+        """
+        if 'time' in frame:
+            times = frame['time'].to_numpy(dtype=np.int64)
+        else:
+            begin = pd.DatetimeIndex(frame['begin']).tz_localize('Europe/Moscow').tz_convert('UTC')
+            times = begin.values.astype('datetime64[ns]').astype(np.int64)
+
+        records = {}
+        codes, figis = pd.factorize(frame['figi'], sort=False)
+        for code, figi in enumerate(figis):
+            mask = codes == code
+            part = np.empty(mask.sum(), dtype=tif.CANDLE_DTYPE)
+            part['time'] = times[mask]
+            for name in PRICE_FIELDS + ('volume',):
+                part[name] = frame[name].to_numpy()[mask]
+            records[figi] = tif.sort_records(part)
+        return cls.from_records(records, precision)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __contains__(self, figi):
+        return figi in self._index
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in FIELDS) + self.offsets.nbytes
+
+    @property
+    def codes(self):
+        """
+        Номер инструмента (в figis) для каждой свечи
+        """
+        return np.repeat(np.arange(len(self.figis)), np.diff(self.offsets))
+
+    def view(self, figi):
+        """
+        :return: CandleView - свечи инструмента без копирования
+        """
+        i = self._index[figi]
+        return CandleView(self, int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def column(self, figi, name='close'):
+        """
+        Колонка инструмента без копирования (непрерывный срез)
+        """
+        return self.view(figi)[name]
+
+    def to_frame(self, figis=None):
+        """
+        DataFrame: figi - категория, time - нс UTC, begin - московское время (как в tif.get_historical_info),
+        цены и объем - в точности хранения
+        :param figis: list of str - инструменты (None - все)
+        """
+        figis = self.figis if figis is None else list(figis)
+        views = [self.view(figi) for figi in figis]
+        codes = np.repeat(np.arange(len(views)), [len(v) for v in views])
+        columns = {name: np.concatenate([v[name] for v in views] or [getattr(self, name)[:0]]) for name in FIELDS}
+        begin = pd.to_datetime(columns['time'], utc=True).tz_convert('Europe/Moscow').tz_localize(None)
+        return pd.DataFrame({'figi': pd.Categorical.from_codes(codes, categories=figis), **columns, 'begin': begin})
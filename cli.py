@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import time
+
+START = time.perf_counter()  # до импорта тяжелых модулей: время запуска считается от этой точки
+
+# время от запуска процесса до готовности к первому запросу тика (импорты, кэш справочника, состояние), сек
+STARTUP_BUDGET = float(os.environ.get('TI_STARTUP_BUDGET', '1.0'))
+
+
+def check_startup(stage='startup'):
+    """
+    Замер времени запуска относительно бюджета: печатается и попадает в latency.jsonl этапом startup
+    :return: float - время от запуска, сек
+    """
+    from latency import recorder
+
+    elapsed = time.perf_counter() - START
+    recorder.record(stage, elapsed)
+    status = 'OK' if elapsed <= STARTUP_BUDGET else 'превышен бюджет'
+    print(f'Startup: {elapsed:.3f}s (budget {STARTUP_BUDGET:.3f}s) - {status}')
+    return elapsed
+
+
+def cmd_trade(args):
+    import ma_trading
+
+    context = ma_trading.get_context()  # справочник из кэша на диске, состояние из SQLite, без сети
+    check_startup()
+    if args.stream:
+        ma_trading.start_streaming(context=context)
+    else:
+        ma_trading.start_trading(args.workers, context=context, run_now=args.now)
+
+
+def cmd_backfill(args):
+    from backfill import BACKFILL_WORKERS, backfill
+    from instruments import InstrumentRegistry
+
+    registry = InstrumentRegistry()
+    instruments = [registry.by_ticker(t) for t in args.tickers] if args.tickers else registry.all()
+    backfill([i.figi for i in instruments], days=args.days, workers=args.workers or BACKFILL_WORKERS,
+             skip_weekends=args.skip_weekends)
+
+
+def cmd_backtest(args):
+    from backtest import run_backtest
+
+    run_backtest(args.figis or None, days=args.days, update=not args.no_update, processes=args.processes)
+
+
+def cmd_status(args):
+    from latency import LATENCY_LOG
+    from state_store import StateStore
+
+    state = StateStore()
+    positions = state.positions
+    print(f'Параметры МА: {len(state.params)} инструментов, открытые позиции: {len(positions)}')
+    for tick, info in positions.items():
+        print(f'  {tick}: {info}')
+
+    if os.path.exists(LATENCY_LOG):
+        with open(LATENCY_LOG) as f:
+            last = None
+            for last in f:
+                pass
+        if last:
+            tick = json.loads(last)
+            print(f'Последний тик: {tick["time"]}, {tick.get("tick_time", 0):.0f}ms')
+    check_startup()
+
+    if args.account:
+        from account_state import AccountSnapshot
+
+        account = AccountSnapshot()
+        account.refresh()
+        print(f'Свободные средства: {account.balance}')
+        print(account.positions.to_string(index=False))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Торговля через API Тинькофф Инвестиций')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    trade = commands.add_parser('trade', help='запуск стратегии')
+    trade.add_argument('--stream', action='store_true', help='событийный режим по потоку свечей')
+    trade.add_argument('--workers', type=int, default=8, help='потоков загрузки свечей')
+    trade.add_argument('--now', action='store_true', help='первый запуск сразу (перезапуск посреди сессии)')
+    trade.set_defaults(func=cmd_trade)
+
+    backfill = commands.add_parser('backfill', help='загрузка истории свечей в локальное хранилище')
+    backfill.add_argument('tickers', nargs='*', help='тикеры (по умолчанию - все акции площадки TQBR)')
+    backfill.add_argument('--days', type=int, default=365)
+    backfill.add_argument('--workers', type=int, help='одновременных запросов (по умолчанию BACKFILL_WORKERS)')
+    backfill.add_argument('--skip-weekends', action='store_true')
+    backfill.set_defaults(func=cmd_backfill)
+
+    backtest = commands.add_parser('backtest', help='подбор параметров стратегии по истории')
+    backtest.add_argument('figis', nargs='*', help='инструменты (по умолчанию - все, по которым есть параметры)')
+    backtest.add_argument('--days', type=int, default=160)
+    backtest.add_argument('--processes', type=int)
+    backtest.add_argument('--no-update', action='store_true', help='не догружать свечи перед расчетом')
+    backtest.set_defaults(func=cmd_backtest)
+
+    status = commands.add_parser('status', help='позиции, параметры и последний тик')
+    status.add_argument('--account', action='store_true', help='баланс и позиции счета из API')
+    status.set_defaults(func=cmd_status)
+    return parser
+
+
+def main(argv=None):
+    """
+    :param argv: list of str - аргументы командной строки (None - sys.argv)
+    """
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import math
+
+import numpy as np
+
+import ti_functional as tif
+
+
+class RollingMean:
+    """
+    Скользящее среднее за window последних значений: кольцевой буфер и сумма с компенсацией
+    ошибок округления (Kahan), обновление за O(1). До заполнения окна возвращает nan
+    """
+    __slots__ = ('window', '_buffer', '_pos', '_count', '_sum', '_comp')
+
+    def __init__(self, window):
+        self.window = window
+        self._buffer = [0.0] * window
+        self._pos = 0
+        self._count = 0
+        self._sum = 0.0
+        self._comp = 0.0
+
+    def _add(self, x):
+        y = x - self._comp
+        t = self._sum + y
+        self._comp = (t - self._sum) - y
+        self._sum = t
+
+    def update(self, x):
+        if self._count == self.window:
+            self._add(-self._buffer[self._pos])
+        else:
+            self._count += 1
+        self._add(x)
+        self._buffer[self._pos] = x
+        self._pos = (self._pos + 1) % self.window
+        return self._sum / self.window if self._count == self.window else math.nan
+
+
+class EMA:
+    """
+    Экспоненциальное среднее как в TA-Lib: первое значение - простое среднее первых period значений,
+    дальше ema += k * (x - ema), k = 2 / (period + 1). До заполнения периода возвращает nan
+    """
+    __slots__ = ('period', 'k', 'value', '_count', '_sum')
+
+    def __init__(self, period):
+        self.period = period
+        self.k = 2 / (period + 1)
+        self.value = math.nan
+        self._count = 0
+        self._sum = 0.0
+
+    def update(self, x):
+        if self._count < self.period:
+            self._count += 1
+            self._sum += x
+            if self._count == self.period:
+                self.value = self._sum / self.period
+        else:
+            self.value = (x - self.value) * self.k + self.value
+        return self.value
+
+
+class MASignal:
+    """
+    Инкрементальный аналог tif.ma_indicator: значения последней строки
+    (close_ma_fast, close_ma_long, to_buy, signal) после каждой новой свечи
+    """
+    __slots__ = ('ma_fast', 'ma_long', '_fast', '_long', '_last_direction')
+
+    def __init__(self, ma_fast=12, ma_long=24):
+        self.ma_fast, self.ma_long = ma_fast, ma_long
+        self._fast = RollingMean(ma_fast)
+        self._long = RollingMean(ma_long)
+        self._last_direction = None
+
+    def update(self, close):
+        ma_fast, ma_long = self._fast.update(close), self._long.update(close)
+        to_buy = int(tif.ma_above(ma_fast, ma_long))
+        signal = int(to_buy != self._last_direction)
+        self._last_direction = to_buy
+        return {'close_ma_fast': ma_fast, 'close_ma_long': ma_long, 'to_buy': to_buy, 'signal': signal}
+
+
+class MACDSignal:
+    """
+    Инкрементальный аналог tif.macd_indicator (talib.MACD): значения последней строки
+    (macd, macdsignal, macdhist, macd_buy, macd_signal) после каждой новой свечи.
+    Как в TA-Lib, быстрая EMA стартует так, чтобы первое значение совпало по времени с медленной,
+    а macd выдается только с появлением сигнальной линии
+    """
+    __slots__ = ('macd_min', 'macd_max', 'macd_signal', '_fast', '_slow', '_signal', '_count', '_last_direction')
+
+    def __init__(self, macd_min, macd_max, macd_signal):
+        if macd_max < macd_min:
+            macd_min, macd_max = macd_max, macd_min
+        self.macd_min, self.macd_max, self.macd_signal = macd_min, macd_max, macd_signal
+        self._fast = EMA(macd_min)
+        self._slow = EMA(macd_max)
+        self._signal = EMA(macd_signal)
+        self._count = 0
+        self._last_direction = None
+
+    def update(self, close):
+        self._count += 1
+        slow = self._slow.update(close)
+        fast = self._fast.update(close) if self._count > self.macd_max - self.macd_min else math.nan
+
+        macd = macdsignal = macdhist = math.nan
+        if self._count >= self.macd_max:
+            signal = self._signal.update(fast - slow)
+            if not math.isnan(signal):
+                macd, macdsignal = fast - slow, signal
+                macdhist = macd - macdsignal
+
+        macd_buy = int(macd > macdsignal)
+        macd_signal = int(macd_buy != self._last_direction)
+        self._last_direction = macd_buy
+        return {'macd': macd, 'macdsignal': macdsignal, 'macdhist': macdhist,
+                'macd_buy': macd_buy, 'macd_signal': macd_signal}
+
+
+class FigiIndicators:
+    """
+    Состояние индикаторов по одному инструменту: время последней учтенной свечи и последние значения
+    """
+    __slots__ = ('params', 'ma', 'macd', 'last_time', 'count', 'last')
+
+    def __init__(self, ma_fast, ma_long, macd_params=None):
+        self.params = (ma_fast, ma_long, macd_params)
+        self.ma = MASignal(ma_fast, ma_long)
+        self.macd = MACDSignal(*macd_params) if macd_params else None
+        self.last_time = None
+        self.count = 0
+        self.last = {}
+
+    def update(self, time, close):
+        last = self.ma.update(close)
+        if self.macd is not None:
+            last.update(self.macd.update(close))
+        last['close'] = close
+        self.last, self.last_time = last, time
+        self.count += 1
+        return last
+
+
+class IndicatorEngine:
+    """
+    Индикаторы по всем инструментам: один раз прогреваются историей, дальше получают только
+    новые закрытые свечи, поэтому расчет на тике не зависит от глубины истории
+    """
+
+    def __init__(self):
+        self._states = {}
+
+    def state(self, figi, ma_fast, ma_long, macd_params=None):
+        """
+        Состояние по инструменту, если оно прогрето с такими же параметрами, иначе None
+        """
+        state = self._states.get(figi)
+        if state is None or state.params != (ma_fast, ma_long, macd_params):
+            return None
+        return state
+
+    def resume_from(self, figi, ma_fast, ma_long, macd_params=None):
+        """
+        Время (нс), начиная с которого движку нужны свечи по инструменту, None - нужна вся история
+        """
+        state = self.state(figi, ma_fast, ma_long, macd_params)
+        return None if state is None or state.last_time is None else state.last_time + 1
+
+    def sync(self, figi, times, closes, ma_fast, ma_long, macd_params=None):
+        """
+        Учитывает закрытые свечи: при первом вызове (или смене параметров) прогревает состояние
+        всеми переданными свечами, дальше пропускает уже учтенные
+        :param times: array - время начала свечей (нс), по возрастанию
+        :param closes: array - цены закрытия
+        :param macd_params: (macd_min, macd_max, macd_signal) или None - без MACD
+        :return: FigiIndicators
+        """
+        state = self.state(figi, ma_fast, ma_long, macd_params)
+        if state is None:
+            state = self._states[figi] = FigiIndicators(ma_fast, ma_long, macd_params)
+
+        for time, close in zip(np.asarray(times).tolist(), np.asarray(closes, dtype=float).tolist()):
+            if state.last_time is None or time > state.last_time:
+                state.update(time, close)
+        return state
+
+
+def compare_with_batch(data, ma_fast, ma_long, macd_params=None):
+    """
+    Сверяет инкрементальный расчет с tif.ma_indicator / tif.macd_indicator по каждой строке
+    :param data: pd.DataFrame с колонкой close
+    :return: list of str - колонки, по которым есть расхождения (пустой - совпадают)
+    """
+    batch = tif.ma_indicator(data.copy(), ma_fast=ma_fast, ma_long=ma_long)
+    columns = ['to_buy', 'signal']
+    if macd_params:
+        batch = tif.macd_indicator(batch, *macd_params)
+        columns += ['macd_buy', 'macd_signal']
+
+    state = FigiIndicators(ma_fast, ma_long, macd_params)
+    rows = [state.update(i, close) for i, close in enumerate(data.close.tolist())]
+    return [col for col in columns if [row[col] for row in rows] != batch[col].tolist()]
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import pandas as pd
+from tinkoff.invest import InstrumentStatus
+
+import ti_functional as tif
+
+INSTRUMENTS_CACHE = os.environ.get('TI_INSTRUMENTS_CACHE', 'instruments_cache.json')
+INSTRUMENTS_TTL = 24 * 3600  # справочник инструментов обновляется раз в сутки, сек
+INSTRUMENTS_CACHE_VERSION = 2  # меняется при изменении расчета полей (кэш прежней версии перечитывается из API)
+
+# компактная запись по инструменту: round_features - свойства округления цен (tif.price_features)
+Instrument = namedtuple('Instrument', ['figi', 'ticker', 'name', 'lot', 'currency', 'class_code',
+                                       'short_enabled_flag', 'api_trade_available_flag',
+                                       'min_price_step', 'round_features'])
+
+
+def share_to_instrument(share):
+    """
+    Переводит Share из API в Instrument
+    """
+    step = share.min_price_increment
+    round_features = tif.price_features(step.nano, step.units)
+    return Instrument(figi=share.figi,
+                      ticker=share.ticker,
+                      name=share.name,
+                      lot=share.lot,
+                      currency=share.currency,
+                      class_code=share.class_code,
+                      short_enabled_flag=int(share.short_enabled_flag),
+                      api_trade_available_flag=int(share.api_trade_available_flag),
+                      min_price_step=tif.money_to_val(step),
+                      round_features=round_features)
+
+
+class InstrumentRegistry:
+    """
+    Справочник акций площадки class_code: загружается одним запросом shares,
+    хранится на диске и обновляется не чаще раза в ttl. Поиск по тикеру и figi за O(1).
+    Тикеры и figi, которых не оказалось в загруженном справочнике, запоминаются вместе с ним (и в кэше на диске):
+    повторный поиск сразу дает KeyError, справочник из-за них заново не загружается
+    :param path: str - файл кэша
+    :param ttl: float - время жизни кэша, сек
+    :param client: TIClient - клиент API (None - общий клиент ti_functional)
+    :param class_code: str - режим торгов
+    """
+
+    def __init__(self, path=INSTRUMENTS_CACHE, ttl=INSTRUMENTS_TTL, client=None, class_code='TQBR'):
+        self.path = path
+        self.ttl = ttl
+        self.client = client
+        self.class_code = class_code
+        self._lock = threading.Lock()
+        self._by_ticker = None
+        self._by_figi = None
+        self._missing = set()  # тикеры и figi, которых нет в справочнике
+
+    def _set(self, instruments, missing=()):
+        self._by_ticker = {i.ticker: i for i in instruments}
+        self._by_figi = {i.figi: i for i in instruments}
+        self._missing = set(missing)
+
+    def _known(self, key):
+        return key in self._by_ticker or key in self._by_figi or key in self._missing
+
+    def _read_cache(self):
+        """
+        :return: (list of Instrument, list of str) - справочник и отсутствующие в нем тикеры/figi, None - кэш устарел
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            cache = json.load(f)
+        if (cache.get('version') != INSTRUMENTS_CACHE_VERSION or time.time() - cache['updated'] > self.ttl
+                or cache['class_code'] != self.class_code):
+            return None
+        instruments = [Instrument(**{**i, 'round_features': tuple(i['round_features'])}) for i in cache['instruments']]
+        return instruments, cache.get('missing', [])
+
+    def _write_cache(self, instruments, missing=()):
+        cache = {'version': INSTRUMENTS_CACHE_VERSION, 'updated': time.time(), 'class_code': self.class_code,
+                 'instruments': [i._asdict() for i in instruments], 'missing': sorted(missing)}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self, keys=()):
+        """
+        Загружает справочник из API (один запрос) и сохраняет на диск
+        :param keys: iterable of str - искомые тикеры/figi: те, которых нет в справочнике, запоминаются
+        """
+        shares = tif.get_client(self.client).call(lambda services: services.instruments.shares(
+            instrument_status=InstrumentStatus.INSTRUMENT_STATUS_BASE).instruments, group='instruments')
+        instruments = [share_to_instrument(s) for s in shares if s.class_code == self.class_code]
+        found = {i.ticker for i in instruments} | {i.figi for i in instruments}
+        missing = {key for key in keys if key not in found}
+        self._write_cache(instruments, missing)
+        with self._lock:
+            self._set(instruments, missing)
+
+    def load(self, tickers=()):
+        """
+        Загружает справочник из кэша, при устаревшем кэше или отсутствии в нем тикеров - из API
+        :param tickers: iterable of str - тикеры (или figi), которые должны быть в справочнике
+        """
+        tickers = list(tickers)
+        with self._lock:
+            if self._by_ticker is None:
+                cache = self._read_cache()
+                if cache is not None:
+                    self._set(*cache)
+            loaded = self._by_ticker is not None and all(self._known(t) for t in tickers)
+        if not loaded:
+            self.refresh(tickers)
+        return self
+
+    def by_ticker(self, ticker):
+        """
+        :return: Instrument, KeyError - если тикера нет на площадке
+        """
+        if self._by_ticker is None or ticker not in self._by_ticker:
+            self.load([ticker])
+        return self._by_ticker[ticker]
+
+    def by_figi(self, figi):
+        """
+        :return: Instrument, KeyError - если инструмента нет на площадке
+        """
+        if self._by_figi is None or figi not in self._by_figi:
+            self.load([figi])
+        return self._by_figi[figi]
+
+    def all(self):
+        """
+        Все инструменты площадки class_code
+        :return: list of Instrument
+        """
+        if self._by_ticker is None:
+            self.load()
+        return list(self._by_ticker.values())
+
+    def to_frame(self, tickers):
+        """
+        Информация по тикерам в виде DataFrame (аналог tif.get_main_stock_info)
+        """
+        return pd.DataFrame([self.by_ticker(t)._asdict() for t in tickers])
@@ -0,0 +1,165 @@
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+LATENCY_LOG = os.environ.get('TI_LATENCY_LOG', 'latency.jsonl')
+PROFILE = os.environ.get('TI_PROFILE', '') == '1'  # cProfile на каждом тике
+PROFILE_DIR = os.environ.get('TI_PROFILE_DIR', 'profiles')
+
+# границы корзин гистограммы задержек, сек: 0.1 мс ... 100 с
+HISTOGRAM_BOUNDS = np.logspace(-4, 2, 25)
+
+# тикер, к которому относятся замеры в текущем потоке
+_ticker = contextvars.ContextVar('ticker', default=None)
+
+
+def current_ticker():
+    """
+    Тикер, к которому сейчас относятся замеры (None - общие этапы тика)
+    """
+    return _ticker.get()
+
+
+@contextmanager
+def ticker(tick):
+    """
+    Замеры внутри блока (в том числе вызовы API) относятся к тикеру tick, после блока метка
+    возвращается к прежней, поэтому общие этапы тика и другие задачи потока не получают чужой тикер
+    """
+    token = _ticker.set(tick)
+    try:
+        yield
+    finally:
+        _ticker.reset(token)
+
+
+class LatencyRecorder:
+    """
+    Замеры времени по этапам: выборки текущего тика (для p50/p95/p99 в сводке)
+    и накопленные гистограммы за все время работы. Потокобезопасен
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(list)  # этап -> задержки текущего тика
+        self._ticker_samples = defaultdict(lambda: defaultdict(list))  # тикер -> этап -> задержки текущего тика
+        self._histograms = defaultdict(lambda: np.zeros(len(HISTOGRAM_BOUNDS) + 1, dtype=np.int64))
+
+    def record(self, stage, seconds, ticker=None):
+        ticker = ticker if ticker is not None else _ticker.get()
+        with self._lock:
+            self._samples[stage].append(seconds)
+            if ticker is not None:
+                self._ticker_samples[ticker][stage].append(seconds)
+            self._histograms[stage][np.searchsorted(HISTOGRAM_BOUNDS, seconds)] += 1
+
+    def histograms(self):
+        """
+        Накопленные гистограммы: {этап: (границы корзин, кол-во замеров)}
+        """
+        with self._lock:
+            return {stage: (HISTOGRAM_BOUNDS, counts.copy()) for stage, counts in self._histograms.items()}
+
+    @staticmethod
+    def _stats(samples):
+        ms = np.asarray(samples) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        return {'count': len(ms), 'total': round(float(ms.sum()), 2),
+                'p50': round(float(p50), 2), 'p95': round(float(p95), 2),
+                'p99': round(float(p99), 2), 'max': round(float(ms.max()), 2)}
+
+    def summary(self):
+        """
+        Сводка по текущему тику: по этапам и по этапам каждого тикера - кол-во, сумма, p50/p95/p99, максимум (мс)
+        """
+        with self._lock:
+            stages = {stage: self._stats(samples) for stage, samples in self._samples.items()}
+            tickers = {ticker: {stage: self._stats(samples) for stage, samples in ticker_stages.items()}
+                       for ticker, ticker_stages in self._ticker_samples.items()}
+        return {'stages': stages, 'tickers': tickers}
+
+    def flush_tick(self, tick_time=None, path=LATENCY_LOG):
+        """
+        Дописывает сводку текущего тика строкой JSON в path и начинает новый тик
+        :param tick_time: float - общее время тика, сек
+        :return: dict - сводка
+        """
+        summary = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), **self.summary()}
+        if tick_time is not None:
+            summary['tick_time'] = round(tick_time * 1000, 2)
+        with self._lock:
+            self._samples.clear()
+            self._ticker_samples.clear()
+        if path:
+            with open(path, 'a') as f:
+                f.write(json.dumps(summary, ensure_ascii=False) + '\n')
+        return summary
+
+
+recorder = LatencyRecorder()
+
+
+@contextmanager
+def timer(stage, ticker=None):
+    """
+    Замер времени блока кода
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.record(stage, time.perf_counter() - start, ticker)
+
+
+def timed(stage=None, ticker_of=None):
+    """
+    Декоратор: замер времени каждого вызова функции (этап по умолчанию - имя функции)
+    :param ticker_of: callable(*args, **kwargs) -> str - тикер вызова: замер и все замеры внутри
+                      вызова относятся к нему (None - метка вызывающего)
+    """
+    def decorator(func):
+        name = stage or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with ticker(ticker_of(*args, **kwargs)) if ticker_of is not None else nullcontext():
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    recorder.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile(enabled=PROFILE, path=PROFILE_DIR, top=20):
+    """
+    cProfile блока кода (обычно одного тика): статистика сохраняется в path/tick_<время>.prof,
+    первые top функций по суммарному времени печатаются
+    """
+    if not enabled:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(path, exist_ok=True)
+        profiler.dump_stats(os.path.join(path, f'tick_{time.strftime("%Y%m%d_%H%M%S")}.prof'))
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(top)
+        print(out.getvalue())
@@ -1,39 +1,251 @@
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from tinkoff.invest import CandleInterval
+
 import ti_functional as tif
-from trading_strategies import ma_trading_strategy
-import lock_info
+from trading_strategies import ma_signal, ma_execute
+from candle_store import CANDLE_STORE_DIR, CandleStore
+from instruments import INSTRUMENTS_CACHE, InstrumentRegistry
+from account_state import AccountSnapshot
+from indicators import IndicatorEngine
+from state_store import StateStore
+from order_execution import OrderExecutor, TinkoffSink
+from scanner import scan_universe
+from risk import apply_stop_updates, trailing_stops
+from latency import LATENCY_LOG, recorder, timer, profile
 
-main_account_id = lock_info.main_account_id
 stock_list = ['SBER', 'VTBR', 'SNGS', 'LKOH', 'GAZP', 'YNDX', 'TCSG', 'RUAL',
               'PLZL', 'MAGN', 'POLY', 'MTSS', 'ROSN', 'MOEX', 'RTKM', 'TATN']
 
-stock_info = tif.get_main_stock_info(stock_list)
+INTERVAL = CandleInterval.CANDLE_INTERVAL_15_MIN
+MAX_WORKERS = 8  # кол-во тикеров, для которых данные загружаются одновременно
+
+_context = None
+_context_lock = threading.Lock()
+
+
+class TradingContext:
+    """
+    Объекты торгового цикла. Создаются при первом обращении (get_context), а не при импорте модуля:
+    импорт не требует lock_info и не обращается к сети, подключение к API открывается первым запросом
+    :param tickers: list of str - тикеры стратегии
+    :param client: TIClient/FakeClient - клиент API (None - общий клиент ti_functional)
+    :param account_id: str - счет (None - main_account_id из lock_info)
+    :param workdir: str - каталог для справочника, хранилища свечей, состояния и журнала задержек
+    (None - пути по умолчанию, состояние импортируется из yaml рабочего каталога)
+    """
+
+    def __init__(self, tickers=stock_list, client=None, account_id=None, workdir=None):
+        self.tickers = list(tickers)
+        self.account_id = tif.get_account_id(account_id)
+        self.client = tif.get_client(client)  # одно подключение к API на все запросы
+
+        def path(name, default):
+            return default if workdir is None else os.path.join(workdir, name)
+
+        # справочник из кэша на диске
+        self.instruments = InstrumentRegistry(path('instruments.json', INSTRUMENTS_CACHE),
+                                              client=self.client).load(self.tickers)
+        self.candle_store = CandleStore(path('candle_store', CANDLE_STORE_DIR), client=self.client)
+        self.account = AccountSnapshot(self.client, account_id=self.account_id)  # баланс и позиции раз за цикл
+        # позиции и параметры МА, загружаются один раз при запуске
+        self.state = (StateStore() if workdir is None else
+                      StateStore(os.path.join(workdir, 'trading_state.db'), yaml_files=None))
+        self.latency_log = path('latency.jsonl', LATENCY_LOG)
+        # заявки по разным тикерам выставляются параллельно
+        self.executor = OrderExecutor(TinkoffSink(self.client), snapshot=self.account)
+        self.engine = IndicatorEngine()  # МА прогреваются историей один раз, дальше обновляются по новым свечам
+
+    def figis(self):
+        """
+        Инструменты тикеров стратегии. Тикеры, которых нет в справочнике (например, после делистинга),
+        печатаются и пропускаются, чтобы не прерывать работу по остальным
+        :return: dict - {тикер: figi}
+        """
+        figis = {}
+        for tick in self.tickers:
+            try:
+                figis[tick] = self.instruments.by_ticker(tick).figi
+            except KeyError:
+                print(f'{tick} -> нет в справочнике инструментов, пропущен')
+        return figis
+
+    def close(self):
+        """
+        Останавливает потоки выставления заявок и закрывает базу состояния
+        """
+        self.executor.close()
+        self.state.close()
+
+
+def get_context(context=None):
+    """
+    Возвращает переданный контекст или общий для процесса (создается при первом обращении)
+    :param context: TradingContext или None
+    :return: TradingContext
+    """
+    global _context
+    if context is not None:
+        return context
+    with _context_lock:
+        if _context is None:
+            _context = TradingContext()
+    return _context
+
+
+def run_tick(pool, context=None):
+    """
+    Один запуск стратегии по всем тикерам: свечи догружаются параллельно, сигналы по всем тикерам
+    считаются одним проходом сканера, расчет сигнала и работа с позициями и заявками выполняются
+    только для тикеров, по которым нужны действия (работа с заявками - последовательно, один счет),
+    stop_loss открытых позиций подтягиваются сразу по всему портфелю (risk.trailing_stops)
+    :param pool: ThreadPoolExecutor
+    :param context: TradingContext (None - общий контекст get_context)
+    :return: float - время выполнения, сек
+    """
+    ctx = get_context(context)
+    start = time.perf_counter()
+    with timer('account_refresh'):
+        ctx.account.refresh()
+    with timer('candles_update'):
+        updates = {tick: pool.submit(ctx.candle_store.update, figi, days=10) for tick, figi in ctx.figis().items()}
+        wait(updates.values())
+    loaded = []
+    for tick, update in updates.items():
+        if update.exception() is not None:
+            print(f'{tick} -> Ошибка загрузки свечей: {update.exception()!r}')
+        else:
+            loaded.append(tick)
+    with timer('scan'):
+        actions = scan_universe(loaded, ctx.instruments, ctx.candle_store, state=ctx.state)
+
+    signals = {tick: pool.submit(ma_signal, tick, ctx.instruments, ctx.candle_store, ctx.client, update_store=False,
+                                 engine=ctx.engine, state=ctx.state)
+               for tick in actions}
+    wait(signals.values())
+    signals_time = time.perf_counter() - start
+
+    results = {}
+    for tick, ma_sig in signals.items():
+        print(tick, end=' -> ')
+        try:
+            results[tick] = ma_sig = ma_sig.result()
+        except Exception as e:
+            print(f'Ошибка расчета сигнала: {e!r}')
+            continue
+        ma_execute(ma_sig, ctx.account_id, client=ctx.client, snapshot=ctx.account, state=ctx.state,
+                   executor=ctx.executor, trail=False)
+    with timer('risk'):
+        # stop_loss всех открытых позиций подтягиваются одним проходом, заявки - только при сдвиге на шаг цены
+        updates = trailing_stops(results, ctx.state.positions)
+        apply_stop_updates(updates, ctx.account_id, ctx.state, ctx.executor, ctx.client, ctx.account)
+    with timer('orders_join'):
+        ctx.executor.join()
 
-# tick = 'SBER'
-# ma_trading_strategy(tick, main_account_id, stock_info)
+    tick_time = time.perf_counter() - start
+    print(f'Tick time: {tick_time:.2f}s (signals: {signals_time:.2f}s), tickers: {len(ctx.tickers)}, '
+          f'actions: {len(actions)}')
+    recorder.flush_tick(tick_time, path=ctx.latency_log)  # сводка задержек по этапам и тикерам -> latency.jsonl
+    return tick_time
 
 
-def start_trading():
+def in_trading_period(now=None):
+    """
+    Время работы стратегии: c 10.15 до 18.35
+    """
+    now = now or time.localtime()
+    return 10.15 < now.tm_hour + now.tm_min/100 < 18.35
+
+
+def start_trading(max_workers=MAX_WORKERS, context=None, run_now=False):
     """
     Каждые 15 минут (c 10.15 до 18.35) запускается стратегия, основанная на индикаторе Moving Average
     При сигнале на покупку происходит вход в позицию и проставляются stop_loss / take_profit
+    :param max_workers: int - кол-во потоков для загрузки данных (1 - последовательно)
+    :param context: TradingContext (None - общий контекст get_context)
+    :param run_now: bool - первый запуск сразу, не дожидаясь очередной свечи (перезапуск посреди сессии)
     """
+    ctx = get_context(context)
     now = time.localtime()
-    while 10.15 < now.tm_hour + now.tm_min/100 < 18.35:
-        now = time.localtime()
-        print(f'Current time: {now.tm_hour:02}:{now.tm_min:02}:{now.tm_sec:02}')
+    last_bar = None  # свеча, по которой уже запускался тик: (час, номер 15-минутной свечи со сдвигом на 2 минуты)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        if run_now and in_trading_period(now):
+            with profile():
+                run_tick(pool, ctx)
+            last_bar = (now.tm_hour, (now.tm_min - 2) // 15)
+
+        while in_trading_period(now):
+            now = time.localtime()
+            print(f'Current time: {now.tm_hour:02}:{now.tm_min:02}:{now.tm_sec:02}')
 
-        if now.tm_min in [2, 17, 32, 47]:
-            for tick in stock_list:
-                print(tick, end=' -> ')
-                ma_trading_strategy(tick, main_account_id, stock_info)
+            # запуск с run_now в минуту тика (или два опроса в одну минуту) не повторяет тик по той же свече
+            bar = (now.tm_hour, (now.tm_min - 2) // 15)
+            if now.tm_min in [2, 17, 32, 47] and bar != last_bar:
+                with profile():  # при TI_PROFILE=1 - cProfile тика
+                    run_tick(pool, ctx)
+                last_bar = bar
 
-        time.sleep(59)
+            time.sleep(59)
 
     print(f'Time outside the trading period --> Current time: {now.tm_hour:02}:{now.tm_min:02}:{now.tm_sec:02}')
 
 
-if __name__ == "__main__":
-    start_trading()
 
+def start_streaming(source=None, context=None):
+    """
+    Событийный режим: стратегия по тикеру запускается в момент закрытия его 15-минутной свечи
+    в потоке котировок, без опроса API раз в минуту
+    :param source: iterable of StreamCandle - источник свечей (None - поток котировок API,
+                   для работы без сети - market_stream.ReplayCandleSource)
+    :param context: TradingContext (None - общий контекст get_context)
+    """
+    from market_stream import TinkoffCandleSource, bars_to_records, run_stream
+
+    ctx = get_context(context)
+    tickers = {figi: tick for tick, figi in ctx.figis().items()}
+
+    # история для расчета МА загружается один раз, дальше свечи дописываются из потока
+    for figi in tickers:
+        ctx.candle_store.update(figi)
 
+    if source is None:
+        source = TinkoffCandleSource(list(tickers), client=ctx.client)
+
+    # замеры копятся по закрытию одной свечи (по всем тикерам) и сбрасываются в latency.jsonl одной строкой,
+    # когда начинают закрываться свечи следующего интервала; busy - время обработки закрытий
+    bar = {'time': None, 'busy': 0.0}
+
+    def flush_bar():
+        if bar['time'] is not None:
+            recorder.flush_tick(bar['busy'], path=ctx.latency_log)
+        bar['busy'] = 0.0
+
+    def on_bar_close(closed, current):
+        tick = tickers.get(closed.figi)
+        if tick is None:
+            return
+        if closed.time != bar['time']:
+            flush_bar()
+            bar['time'] = closed.time
+        start = time.perf_counter()
+        ctx.candle_store.write(closed.figi, INTERVAL, bars_to_records([closed, current]))
+
+        print(tick, end=' -> ')
+        ma_sig = ma_signal(tick, ctx.instruments, ctx.candle_store, ctx.client, cur_candle=current._asdict(),
+                           update_store=False, engine=ctx.engine, state=ctx.state)
+        ma_execute(ma_sig, ctx.account_id, client=ctx.client, snapshot=ctx.account, state=ctx.state,
+                   executor=ctx.executor)
+        bar['busy'] += time.perf_counter() - start
+
+    run_stream(source, on_bar_close, INTERVAL, stop=lambda: not in_trading_period())
+    ctx.executor.join()
+    flush_bar()
+    now = time.localtime()
+    print(f'Time outside the trading period --> Current time: {now.tm_hour:02}:{now.tm_min:02}:{now.tm_sec:02}')
+
+
+if __name__ == "__main__":
+    start_trading()
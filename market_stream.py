@@ -0,0 +1,194 @@
+import json
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from grpc import RpcError
+from tinkoff.invest import (CandleInstrument, CandleInterval, MarketDataRequest, SubscribeCandlesRequest,
+                            SubscriptionAction, SubscriptionInterval)
+from tinkoff.invest.exceptions import RequestError
+
+import ti_functional as tif
+from candle_store import INTERVAL_DURATION, NS
+from ti_client import RETRY_CODES, TIClient, error_code
+
+# свеча из потока котировок: время начала (нс, UTC), OHLC, объем
+StreamCandle = namedtuple('StreamCandle', ['figi', 'time', 'open', 'high', 'low', 'close', 'volume'])
+
+RECONNECT_DELAY = 1.0  # пауза перед переподключением к потоку, сек
+
+SUBSCRIPTION_INTERVAL = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
+    CandleInterval.CANDLE_INTERVAL_5_MIN: SubscriptionInterval.SUBSCRIPTION_INTERVAL_FIVE_MINUTES,
+    CandleInterval.CANDLE_INTERVAL_15_MIN: SubscriptionInterval.SUBSCRIPTION_INTERVAL_FIFTEEN_MINUTES,
+}
+
+
+def bars_to_records(bars):
+    """
+    Переводит свечи потока в массив tif.CANDLE_DTYPE (для записи в CandleStore)
+    :param bars: list of StreamCandle
+    :return: np.ndarray CANDLE_DTYPE
+    """
+    records = np.empty(len(bars), dtype=tif.CANDLE_DTYPE)
+    for name in tif.CANDLE_DTYPE.names:
+        records[name] = [getattr(bar, name) for bar in bars]
+    return records
+
+
+class TinkoffCandleSource:
+    """
+    Источник свечей - поток котировок API (MarketDataStream), подписка на свечи по списку figi
+    :param figis: list of str - индентификаторы инстументов
+    :param client: TIClient - клиент API (None - общий клиент ti_functional)
+    :param interval: CandleInterval - интервал свечей
+    """
+
+    def __init__(self, figis, client=None, interval=CandleInterval.CANDLE_INTERVAL_15_MIN):
+        self.figis = list(figis)
+        self.client = client
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _stream_client(self):
+        """
+        Отдельный канал для потока: переподключение потока не закрывает общий канал,
+        через который в это время выставляются заявки
+        :return: (клиент, bool - создан ли канал для потока)
+        """
+        if self.client is None:
+            return TIClient(tif.get_lock_info().token), True
+        if isinstance(self.client, TIClient):
+            return TIClient(self.client.token, **self.client.client_kwargs), True
+        return self.client, False  # подменный клиент без сети
+
+    def _requests(self, done):
+        yield MarketDataRequest(subscribe_candles_request=SubscribeCandlesRequest(
+            subscription_action=SubscriptionAction.SUBSCRIPTION_ACTION_SUBSCRIBE,
+            instruments=[CandleInstrument(figi=figi, interval=SUBSCRIPTION_INTERVAL[self.interval])
+                         for figi in self.figis],
+        ))
+        # поток запросов должен оставаться открытым, пока нужны данные (done - у каждого подключения свое)
+        while not done.wait(1) and not self._stop.is_set():
+            pass
+
+    def __iter__(self):
+        client, own = self._stream_client()
+        try:
+            while not self._stop.is_set():
+                done = threading.Event()
+                stream = client.call(
+                    lambda services: services.market_data_stream.market_data_stream(self._requests(done)))
+                try:
+                    for market_data in stream:
+                        if self._stop.is_set():
+                            return
+                        candle = market_data.candle
+                        if candle is None:
+                            continue
+                        yield StreamCandle(figi=candle.figi,
+                                           time=int(candle.time.timestamp()) * NS,
+                                           open=tif.money_to_val(candle.open),
+                                           high=tif.money_to_val(candle.high),
+                                           low=tif.money_to_val(candle.low),
+                                           close=tif.money_to_val(candle.close),
+                                           volume=candle.volume)
+                except (RequestError, RpcError) as e:
+                    if error_code(e) not in RETRY_CODES:
+                        raise
+                    # обрыв потока: переподключаемся и подписываемся заново
+                    if own:
+                        client.close()
+                    time.sleep(RECONNECT_DELAY)
+                finally:
+                    done.set()  # завершает поток запросов этого подключения
+        finally:
+            if own:
+                client.close()
+
+
+class ReplayCandleSource:
+    """
+    Источник свечей - файл, записанный record_candles (JSON по строке на свечу)
+    :param path: str - путь к файлу
+    :param speed: float - ускорение относительно реального времени (None - без пауз)
+    """
+
+    def __init__(self, path, speed=None):
+        self.path = path
+        self.speed = speed
+
+    def __iter__(self):
+        prev_time = None
+        with open(self.path) as f:
+            for line in f:
+                candle = StreamCandle(**json.loads(line))
+                if self.speed and prev_time is not None and candle.time > prev_time:
+                    time.sleep((candle.time - prev_time) / NS / self.speed)
+                prev_time = candle.time
+                yield candle
+
+
+def record_candles(source, path):
+    """
+    Пропускает свечи источника дальше, записывая их в файл для ReplayCandleSource
+    :param source: iterable of StreamCandle
+    :param path: str - путь к файлу
+    """
+    with open(path, 'a') as f:
+        for candle in source:
+            f.write(json.dumps(candle._asdict()) + '\n')
+            f.flush()
+            yield candle
+
+
+class BarAggregator:
+    """
+    Текущие (незакрытые) свечи по каждому figi. Свеча считается закрытой,
+    когда по инструменту приходит свеча следующего интервала
+    :param interval: CandleInterval - интервал свечей
+    """
+
+    def __init__(self, interval=CandleInterval.CANDLE_INTERVAL_15_MIN):
+        self.duration = int(INTERVAL_DURATION[CandleInterval(interval)].total_seconds()) * NS
+        self.bars = {}
+
+    def update(self, candle):
+        """
+        Обновляет текущую свечу инструмента
+        :param candle: StreamCandle
+        :return: StreamCandle - закрывшаяся свеча или None
+        """
+        candle = candle._replace(time=candle.time - candle.time % self.duration)
+        bar = self.bars.get(candle.figi)
+
+        if bar is not None and candle.time < bar.time:
+            return None  # запоздавшее обновление уже закрытой свечи
+
+        self.bars[candle.figi] = candle
+        if bar is not None and candle.time > bar.time:
+            return bar
+        return None
+
+
+def run_stream(source, on_bar_close, interval=CandleInterval.CANDLE_INTERVAL_15_MIN, stop=None):
+    """
+    Читает свечи из источника и вызывает on_bar_close в момент закрытия свечи
+    :param source: iterable of StreamCandle (TinkoffCandleSource, ReplayCandleSource, ...)
+    :param on_bar_close: callable(closed, current) - закрытая свеча и первая свеча следующего интервала
+    :param interval: CandleInterval - интервал свечей
+    :param stop: callable() -> bool - условие остановки, проверяется на каждой свече
+    :return: BarAggregator - состояние свечей на момент остановки
+    """
+    aggregator = BarAggregator(interval)
+    for candle in source:
+        if stop is not None and stop():
+            break
+        closed = aggregator.update(candle)
+        if closed is not None:
+            on_bar_close(closed, aggregator.bars[closed.figi])
+    return aggregator
@@ -0,0 +1,262 @@
+import queue
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import ti_functional as tif
+from latency import current_ticker, ticker
+
+# часть заявки: kind - order (tif.order) / stop_order (tif.stop_order) /
+# cancel_stop_order (tif.cancel_stop_order, order_id - идентификатор отменяемой стоп-заявки)
+Leg = namedtuple('Leg', ['name', 'kind', 'lots', 'price', 'direction', 'order_type', 'order_id'])
+LegResult = namedtuple('LegResult', ['name', 'order_id', 'response', 'latency'])
+
+
+def new_order_id():
+    """
+    Идентификатор заявки: уникален для каждой заявки и не меняется при повторах запроса,
+    поэтому повтор после обрыва связи не выставит заявку дважды
+    """
+    return str(uuid.uuid4())
+
+
+class OrderJob:
+    """
+    Группа заявок по одному инструменту, выставляемых последовательно как одно целое.
+    Если заявка не выставилась, следующие не выставляются
+    :param figi: str - индентификатор инстумента
+    :param account_id: str - номер счета
+    :param round_features: (int, float) - свойства для округления цен
+    :param legs: list of Leg
+    :param lot: int - лотность инструмента
+    """
+
+    def __init__(self, figi, account_id, round_features, legs, lot=1):
+        self.figi = figi
+        self.account_id = account_id
+        self.round_features = round_features
+        self.legs = legs
+        self.lot = lot
+        self.results = []
+        self.error = None
+        self.latency = None
+        self.ticker = None  # тикер для замеров задержек (latency): задается при постановке в очередь OrderExecutor
+
+    @property
+    def ok(self):
+        return self.error is None and len(self.results) == len(self.legs)
+
+    def __repr__(self):
+        legs = ', '.join(f'{r.name}: {r.latency * 1000:.0f}ms' for r in self.results)
+        status = 'ok' if self.ok else f'error: {self.error!r}'
+        return f'OrderJob({self.figi}, {status}, {legs})'
+
+
+def bracket_order(figi, lots, price, stop_loss, take_profit, account_id, round_features, lot=1, order_type='limit'):
+    """
+    Вход в позицию с заявками stop_loss и take_profit
+    """
+    return OrderJob(figi, account_id, round_features, [
+        Leg('entry', 'order', lots, price, 'buy', order_type, new_order_id()),
+        Leg('stop_loss', 'stop_order', lots, stop_loss, 'sell', 'stop_loss', None),
+        Leg('take_profit', 'stop_order', lots, take_profit, 'sell', 'take_profit', None),
+    ], lot)
+
+
+def cancel_leg(order_type, stop_order_id):
+    return Leg(f'cancel_{order_type}', 'cancel_stop_order', 0, None, None, order_type, stop_order_id)
+
+
+def replace_stop_order(figi, lots, price, stop_order_id, account_id, round_features, order_type='stop_loss', lot=1):
+    """
+    Перестановка стоп-заявки: отмена действующей (если известен ее идентификатор), затем новая.
+    Если отмена не прошла, новая не выставляется - у позиции остается одна стоп-заявка
+    """
+    legs = [cancel_leg(order_type, stop_order_id)] if stop_order_id else []
+    legs.append(Leg(order_type, 'stop_order', lots, price, 'sell', order_type, None))
+    return OrderJob(figi, account_id, round_features, legs, lot)
+
+
+def close_position(figi, lots, price, account_id, round_features, stop_order_ids=None, lot=1):
+    """
+    Отмена стоп-заявок позиции, затем выход по рынку. Если отмена не прошла (стоп-заявка могла уже
+    сработать), продажа не выставляется - иначе вместо закрытия открылась бы короткая позиция
+    :param stop_order_ids: dict - {order_type: идентификатор стоп-заявки} (результат stop_order_ids)
+    """
+    legs = [cancel_leg(order_type, stop_order_id) for order_type, stop_order_id in (stop_order_ids or {}).items()
+            if stop_order_id]
+    legs.append(Leg('market', 'order', lots, price, 'sell', 'market', new_order_id()))
+    return OrderJob(figi, account_id, round_features, legs, lot)
+
+
+def cancel_stop_orders(figi, account_id, round_features, stop_order_ids, lot=1):
+    """
+    Отмена стоп-заявок позиции, которой уже нет на счете: каждая отмена - отдельная группа, поэтому
+    ошибка одной (заявка уже исполнена или не найдена) не мешает остальным и только попадает в job.error
+    :param stop_order_ids: dict - {order_type: идентификатор стоп-заявки}
+    :return: list of OrderJob
+    """
+    return [OrderJob(figi, account_id, round_features, [cancel_leg(order_type, stop_order_id)], lot)
+            for order_type, stop_order_id in (stop_order_ids or {}).items() if stop_order_id]
+
+
+def order_leg(job):
+    """
+    Заявка группы (tif.order), по которой резервируются средства в снимке счета
+    :return: Leg или None, если в группе только стоп-заявки
+    """
+    return next((leg for leg in job.legs if leg.kind == 'order'), None)
+
+
+def stop_order_ids(job):
+    """
+    Идентификаторы выставленных группой стоп-заявок
+    :return: dict - {order_type: stop_order_id}
+    """
+    legs = {leg.name: leg for leg in job.legs}
+    return {legs[r.name].order_type: getattr(r.response, 'stop_order_id', None) for r in job.results
+            if legs[r.name].kind == 'stop_order'}
+
+
+class TinkoffSink:
+    """
+    Выставление заявок через API
+    :param client: TIClient - клиент API (None - общий клиент ti_functional)
+    :param snapshot: AccountSnapshot - снимок счета, обновляется после выставления заявки
+    """
+
+    def __init__(self, client=None, snapshot=None):
+        self.client = client
+        self.snapshot = snapshot
+
+    def submit(self, job, leg):
+        if leg.kind == 'order':
+            return tif.order(job.figi, leg.lots, leg.price, job.account_id, job.round_features, leg.direction,
+                             leg.order_type, client=self.client, snapshot=self.snapshot, lot=job.lot,
+                             order_id=leg.order_id)
+        if leg.kind == 'cancel_stop_order':
+            return tif.cancel_stop_order(leg.order_id, job.account_id, client=self.client)
+        return tif.stop_order(job.figi, leg.lots, leg.price, job.account_id, job.round_features, leg.direction,
+                              leg.order_type, client=self.client)
+
+
+class DryRunSink:
+    """
+    Заявки не выставляются, а сохраняются в orders (для тестов и работы без сети)
+    """
+
+    def __init__(self):
+        self.orders = []
+        self._lock = threading.Lock()
+
+    def submit(self, job, leg):
+        with self._lock:
+            self.orders.append((job.figi, leg))
+        if leg.kind == 'stop_order':
+            return SimpleNamespace(stop_order_id=new_order_id(), dry_run=True)
+        return SimpleNamespace(order_id=leg.order_id, dry_run=True)
+
+
+def execute_job(job, sink):
+    """
+    Выставляет заявки группы по очереди, замеряя задержку каждой
+    :return: OrderJob
+    """
+    start = time.perf_counter()
+    for leg in job.legs:
+        leg_start = time.perf_counter()
+        try:
+            response = sink.submit(job, leg)
+        except Exception as e:
+            job.error = e
+            break
+        job.results.append(LegResult(leg.name, leg.order_id, response, time.perf_counter() - leg_start))
+    job.latency = time.perf_counter() - start
+    return job
+
+
+def submit_job(job, executor=None, client=None, snapshot=None):
+    """
+    Ставит группу заявок в очередь executor, без executor - выставляет сразу в текущем потоке
+    :param client: TIClient - клиент API для выставления без executor
+    :param snapshot: AccountSnapshot - снимок счета для выставления без executor
+    :return: Future с OrderJob
+    """
+    if executor is not None:
+        return executor.submit(job)
+    execute_job(job, TinkoffSink(client, snapshot))
+    print(job)
+    future = Future()
+    future.set_result(job)
+    return future
+
+
+class OrderExecutor:
+    """
+    Очередь заявок с пулом потоков: заявки по разным инструментам выставляются параллельно,
+    по одному инструменту - по очереди в порядке постановки.
+    При постановке в очередь заявка сразу учитывается в снимке счета (чтобы расчет лотов
+    по следующим тикерам видел зарезервированные средства), при ошибке резерв снимается
+    :param sink: TinkoffSink / DryRunSink - куда выставляются заявки
+    :param workers: int - кол-во потоков
+    :param snapshot: AccountSnapshot - снимок счета
+    """
+
+    def __init__(self, sink, workers=4, snapshot=None):
+        self.sink = sink
+        self.snapshot = snapshot
+        # у каждого потока своя очередь, инструмент всегда попадает в одну и ту же - порядок заявок сохраняется
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._threads = [threading.Thread(target=self._worker, args=(q,), daemon=True) for q in self._queues]
+        for thread in self._threads:
+            thread.start()
+
+    def _reserve(self, job, sign):
+        leg = order_leg(job)
+        if self.snapshot is None or leg is None:
+            return
+        direction = leg.direction if sign > 0 else ('sell' if leg.direction == 'buy' else 'buy')
+        self.snapshot.apply_order(job.figi, leg.lots * job.lot, leg.price, direction)
+
+    def submit(self, job):
+        """
+        Ставит группу заявок в очередь
+        :return: Future с OrderJob
+        """
+        self._reserve(job, +1)
+        if job.ticker is None:
+            job.ticker = current_ticker()  # замеры в потоке очереди относятся к тикеру, поставившему заявку
+        future = Future()
+        self._queues[hash(job.figi) % len(self._queues)].put((job, future))
+        return future
+
+    def _worker(self, jobs):
+        while True:
+            item = jobs.get()
+            if item is None:
+                jobs.task_done()
+                return
+            job, future = item
+            with ticker(job.ticker):
+                execute_job(job, self.sink)
+            if job.error is not None and order_leg(job) not in job.legs[:len(job.results)]:
+                self._reserve(job, -1)  # заявка не выставилась
+            print(job)
+            future.set_result(job)
+            jobs.task_done()
+
+    def join(self):
+        """
+        Ждет выставления всех заявок из очереди
+        """
+        for jobs in self._queues:
+            jobs.join()
+
+    def close(self):
+        for jobs in self._queues:
+            jobs.put(None)
+        for thread in self._threads:
+            thread.join()
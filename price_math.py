@@ -0,0 +1,138 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+
+import numpy as np
+from tinkoff.invest import Quotation
+
+NANO = 10 ** 9  # nano в одной единице цены
+# до этой цены float * NANO отличается от десятичной записи цены меньше чем на 0.2 nano и округляется точно,
+# выше точность float меньше nano - цена переводится через десятичную запись (repr)
+EXACT_FLOAT_LIMIT = 2 ** 20
+
+
+def to_nano(units, nano):
+    """
+    Цена в формате (units, nano) одним целым числом nano (точно)
+    """
+    return units * NANO + nano
+
+
+def from_nano(total):
+    """
+    Целое число nano в (units, nano), у units и nano одинаковый знак, как в API
+    """
+    sign = -1 if total < 0 else 1
+    units, nano = divmod(abs(total), NANO)
+    return sign * units, sign * nano
+
+
+def float_to_nano(value):
+    """
+    Цена float в целое число nano с округлением до ближайшего (по десятичной записи цены)
+    """
+    value = float(value)
+    if abs(value) < EXACT_FLOAT_LIMIT:
+        return int(round(value * NANO))
+    return int(Decimal(repr(value)).scaleb(9).to_integral_value(ROUND_HALF_EVEN))
+
+
+def to_float(units, nano):
+    return units + nano / NANO
+
+
+def to_quotation(value):
+    """
+    float -> Quotation
+    """
+    return Quotation(*from_nano(float_to_nano(value)))
+
+
+def price_features(nano, units=0):
+    """
+    Свойства округления по шагу цены (min_price_increment): кол-во знаков после запятой и шаг.
+    Знаки считаются по значащим цифрам nano, поэтому шаги вида 0.0025 разбираются верно
+    :param nano: int - дробная часть шага в nano
+    :param units: int - целая часть шага
+    :return: (int, float) - (n_dec, base)
+    """
+    n_dec = 9
+    while n_dec > 0 and nano % 10 ** (10 - n_dec) == 0:
+        n_dec -= 1
+    return n_dec, to_float(units, nano)
+
+
+def step_nano(base):
+    """
+    Шаг цены из round_features в целых nano
+    """
+    return max(1, float_to_nano(base))
+
+
+def round_to_step(price, base):
+    """
+    Округляет цену до ближайшего кратного шагу base
+    :return: int - цена в nano
+    """
+    step = step_nano(base)
+    q, r = divmod(float_to_nano(price), step)
+    if 2 * r > step or (2 * r == step and q % 2):  # до ближайшего, половина - к четному, как round()
+        q += 1
+    return q * step
+
+
+def round_quotation(price, base):
+    """
+    Цена заявки: округление до шага и перевод в Quotation без промежуточного float
+    """
+    return Quotation(*from_nano(round_to_step(price, base)))
+
+
+# пакетные версии для массивов
+def floats_to_nano(values):
+    """
+    Цены в целые nano (пакетная версия float_to_nano)
+    :param values: np.ndarray - цены
+    :return: np.ndarray int64
+    """
+    values = np.asarray(values, dtype=np.float64)
+    total = np.rint(values * NANO).astype(np.int64)
+    large = np.abs(values) >= EXACT_FLOAT_LIMIT
+    if large.any():
+        total[large] = [float_to_nano(value) for value in values[large]]
+    return total
+
+
+def quotations_to_float(units, nano):
+    """
+    :param units, nano: np.ndarray - части цен
+    :return: np.ndarray float64
+    """
+    return np.asarray(units, dtype=np.int64) + np.asarray(nano, dtype=np.int64) / NANO
+
+
+def floats_to_quotations(values):
+    """
+    :param values: np.ndarray - цены
+    :return: (np.ndarray, np.ndarray) int64 - units, nano (одного знака)
+    """
+    total = floats_to_nano(values)
+    units = np.sign(total) * (np.abs(total) // NANO)
+    return units, total - units * NANO
+
+
+def steps_nano(base):
+    """
+    Шаги цены в целых nano (пакетная версия step_nano)
+    """
+    return np.maximum(1, floats_to_nano(base))
+
+
+def round_to_step_array(prices, base):
+    """
+    Округляет массив цен до шага base
+    :param base: float или np.ndarray - шаг цены (общий или свой для каждой цены)
+    :return: np.ndarray float64
+    """
+    step = steps_nano(base)
+    q, r = np.divmod(floats_to_nano(prices), step)
+    q += (2 * r > step) | ((2 * r == step) & (q % 2 == 1))
+    return q * step / NANO
@@ -0,0 +1,339 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+from tinkoff.invest import CandleInterval, MoneyValue, OrderDirection
+
+import price_math as pm
+import ti_functional as tif
+from account_state import AccountSnapshot
+from candle_store import CandleStore, INTERVAL_DURATION, NS, datetime_to_ns, ns_to_datetime
+from instruments import InstrumentRegistry
+from latency import recorder
+from state_store import StateStore
+from ti_client import FakeClient
+from trading_strategies import ma_trading_strategy
+
+DEFAULT_PARAMS = {'min_ma': 12, 'max_ma': 24, 'stop_loss': 0.01}
+RUN_OFFSET_NS = 2 * 60 * NS  # стратегия запускается через 2 минуты после открытия свечи (как в start_trading)
+
+
+def to_money(value, currency='rub'):
+    units, nano = pm.from_nano(pm.float_to_nano(value))
+    return MoneyValue(currency=currency, units=units, nano=nano)
+
+
+def make_share(figi, ticker, lot=1, min_price_increment=0.01, currency='rub', class_code='TQBR'):
+    """
+    Акция в формате ответа instruments.shares (поля, которые читает instruments.share_to_instrument)
+    """
+    return SimpleNamespace(figi=figi, ticker=ticker, name=ticker, lot=lot, currency=currency, class_code=class_code,
+                           short_enabled_flag=False, api_trade_available_flag=True,
+                           min_price_increment=pm.to_quotation(min_price_increment))
+
+
+def synthetic_candles(days=30, seed=0, price=100.0, start='2023-01-09', volatility=0.002):
+    """
+    Воспроизводимые 15-минутные свечи (случайное блуждание) в торговые часы 10:00-18:45 МСК по будням
+    :param days: int - кол-во торговых дней
+    :param seed: int - зерно генератора
+    :return: np.ndarray tif.CANDLE_DTYPE
+    """
+    rng = np.random.default_rng(seed)
+    business_days = np.busday_offset(np.datetime64(start, 'D'), np.arange(days), roll='forward')
+    bar_offsets = np.arange(7 * 60, 15 * 60 + 46, 15).astype('timedelta64[m]')  # 07:00-15:45 UTC
+    times = (business_days[:, None] + bar_offsets[None, :]).ravel().astype('datetime64[ns]').astype(np.int64)
+
+    close = price * np.exp(np.cumsum(rng.normal(0, volatility, len(times))))
+    open_ = np.concatenate([[price], close[:-1]])
+    spread = np.abs(rng.normal(0, volatility / 2, len(times))) * close
+
+    records = np.empty(len(times), dtype=tif.CANDLE_DTYPE)
+    records['time'] = times
+    records['open'], records['close'] = np.round(open_, 2), np.round(close, 2)
+    records['high'] = np.round(np.maximum(open_, close) + spread, 2)
+    records['low'] = np.round(np.minimum(open_, close) - spread, 2)
+    records['volume'] = rng.integers(100, 10000, len(times))
+    return records
+
+
+class ReplayServices:
+    """
+    Подменяет tinkoff.invest.Services для ti_client.FakeClient: свечи берутся из записанной истории
+    по часам воспроизведения now (нс, UTC), портфель и свободные средства - из снимка счета.
+    Заявки исполняются сразу по цене заявки (рыночные - по текущей цене) и меняют портфель,
+    стоп-заявки только сохраняются
+    :param candles: dict - {figi: np.ndarray tif.CANDLE_DTYPE}
+    :param shares: list - акции в формате make_share
+    :param money: dict - свободные средства {валюта: сумма}
+    :param positions: dict - позиции {figi: (кол-во бумаг, средняя цена)}
+    :param interval: CandleInterval - интервал записанных свечей
+    :param relative: bool - период запроса свечей отсчитывается назад от now (стратегия запрашивает
+                     период до datetime.now()), False - границы запроса берутся как есть (загрузка истории)
+    """
+
+    def __init__(self, candles, shares=(), money=None, positions=None,
+                 interval=CandleInterval.CANDLE_INTERVAL_15_MIN, relative=True):
+        self.candles = candles
+        self.relative = relative
+        self.shares = list(shares)
+        self.money = dict(money or {'rub': 100000.0})
+        self.positions = dict(positions or {})
+        self.duration = int(INTERVAL_DURATION[interval].total_seconds()) * NS
+        self.lots = {share.figi: share.lot for share in self.shares}
+        self._objects = {}
+        self.now = max(int(records['time'][-1]) for records in candles.values()) + self.duration
+        self.posted_orders = []  # исполненные заявки по порядку
+        self.posted_stop_orders = []
+        self.cancelled_stop_orders = []  # идентификаторы отмененных стоп-заявок
+
+        self.operations = SimpleNamespace(get_portfolio=self._get_portfolio, get_positions=self._get_positions)
+        self.orders = SimpleNamespace(post_order=self._post_order)
+        self.stop_orders = SimpleNamespace(post_stop_order=self._post_stop_order,
+                                           cancel_stop_order=self._cancel_stop_order)
+        self.instruments = SimpleNamespace(shares=self._shares)
+
+    @classmethod
+    def from_store(cls, figis, path, interval=CandleInterval.CANDLE_INTERVAL_15_MIN, portfolio=None, shares=(),
+                   relative=True):
+        """
+        Воспроизведение свечей из CandleStore и снимка счета, записанного record_portfolio
+        :param figis: list of str - инструменты
+        :param path: str - каталог CandleStore
+        :param portfolio: str - json-файл снимка счета (None - 100000 руб. без позиций)
+        """
+        store = CandleStore(path)
+        candles = {figi: store.load(figi, interval) for figi in figis}
+        money, positions = load_portfolio(portfolio) if portfolio is not None else (None, None)
+        return cls(candles, shares, money, positions, interval, relative)
+
+    def bar_times(self, warmup_days=10):
+        """
+        Моменты запуска стратегии: через RUN_OFFSET_NS после открытия каждой свечи,
+        начиная с warmup_days дней от начала истории (история для расчета МА)
+        :return: np.ndarray - время (нс, UTC)
+        """
+        times = np.unique(np.concatenate([records['time'] for records in self.candles.values()]))
+        times = times[times >= times[0] + warmup_days * 24 * 3600 * NS]
+        return times + RUN_OFFSET_NS
+
+    def _window(self, figi, start):
+        records = self.candles[figi]
+        times = records['time']
+        return records[np.searchsorted(times, start):np.searchsorted(times, self.now)]
+
+    def _is_forming(self, records):
+        return len(records) > 0 and records['time'][-1] + self.duration > self.now
+
+    def last_price(self, figi):
+        """
+        Текущая цена на момент now: цена открытия незакрытой свечи или закрытия последней
+        """
+        records = self._window(figi, self.now - self.duration)
+        if len(records) == 0:
+            records = self._window(figi, 0)
+        return float(records['open'][-1] if self._is_forming(records) else records['close'][-1])
+
+    def get_all_candles(self, figi, from_, to, interval=None):
+        """
+        Свечи за последние (to - from_) относительно now (при relative=False - за [from_, to)).
+        Свеча, которая еще не закрылась к now, отдается по цене открытия (без заглядывания в будущее)
+        """
+        times = self.candles[figi]['time']
+        if self.relative:
+            start = np.searchsorted(times, self.now - int((to - from_).total_seconds()) * NS)
+        else:
+            start = np.searchsorted(times, datetime_to_ns(from_))
+        end = np.searchsorted(times, self.now if self.relative else min(self.now, datetime_to_ns(to)))
+        candles = self._candle_objects(figi)[start:end]
+        if self._is_forming(self.candles[figi][start:end]):
+            last = candles[-1]
+            candles[-1] = SimpleNamespace(open=last.open, close=last.open, high=last.open, low=last.open,
+                                          volume=last.volume, time=last.time, is_complete=False)
+        return candles
+
+    def _candle_objects(self, figi):
+        # свечи в формате API создаются один раз на инструмент, запросы получают срезы списка
+        objects = self._objects.get(figi)
+        if objects is None:
+            objects = [SimpleNamespace(open=pm.to_quotation(r['open']), close=pm.to_quotation(r['close']),
+                                       high=pm.to_quotation(r['high']), low=pm.to_quotation(r['low']),
+                                       volume=int(r['volume']), time=ns_to_datetime(r['time']), is_complete=True)
+                       for r in self.candles[figi]]
+            self._objects[figi] = objects
+        return objects
+
+    def _get_portfolio(self, account_id):
+        positions = []
+        for figi, (quantity, avg_price) in self.positions.items():
+            expected_yield = (self.last_price(figi) - avg_price) * quantity
+            positions.append(SimpleNamespace(figi=figi, instrument_type='share', quantity=pm.to_quotation(quantity),
+                                             average_position_price=to_money(avg_price),
+                                             expected_yield=pm.to_quotation(expected_yield)))
+        return SimpleNamespace(positions=positions)
+
+    def _get_positions(self, account_id):
+        return SimpleNamespace(money=[to_money(value, currency) for currency, value in self.money.items()])
+
+    def _post_order(self, figi, quantity, price, direction, account_id, order_type, order_id):
+        if order_type == tif.schemas.OrderType.ORDER_TYPE_MARKET:
+            fill_price = self.last_price(figi)
+        else:
+            fill_price = tif.money_to_val(price)
+        shares = quantity * self.lots.get(figi, 1)
+        sign = 1 if direction == OrderDirection.ORDER_DIRECTION_BUY else -1
+
+        held, avg_price = self.positions.get(figi, (0, 0.0))
+        new_held = held + sign * shares
+        if new_held == 0:
+            self.positions.pop(figi, None)
+        else:
+            if sign > 0:
+                avg_price = (held * avg_price + shares * fill_price) / new_held
+            self.positions[figi] = (new_held, avg_price)
+        self.money['rub'] = self.money.get('rub', 0.0) - sign * shares * fill_price
+
+        self.posted_orders.append({'time': self.now, 'figi': figi, 'lots': quantity, 'price': fill_price,
+                                   'direction': 'buy' if sign > 0 else 'sell', 'order_id': order_id})
+        return SimpleNamespace(order_id=order_id, executed_order_price=to_money(fill_price))
+
+    def _post_stop_order(self, **kwargs):
+        stop_order_id = str(uuid.uuid4())
+        self.posted_stop_orders.append({'time': self.now, 'stop_order_id': stop_order_id, **kwargs})
+        return SimpleNamespace(stop_order_id=stop_order_id)
+
+    def _cancel_stop_order(self, account_id, stop_order_id):
+        if stop_order_id in self.cancelled_stop_orders or all(
+                o['stop_order_id'] != stop_order_id for o in self.posted_stop_orders):
+            raise KeyError(f'stop order {stop_order_id} not found')
+        self.cancelled_stop_orders.append(stop_order_id)
+        return SimpleNamespace(time=ns_to_datetime(self.now))
+
+    def _shares(self, instrument_status=None):
+        return SimpleNamespace(instruments=self.shares)
+
+
+def record_portfolio(path, client=None):
+    """
+    Сохраняет снимок счета (свободные средства и позиции) в json-файл для ReplayServices.from_store
+    :param client: TIClient - клиент API (None - общий клиент ti_functional)
+    """
+    positions = tif.get_current_positions(client=client)
+    if 'quantity' not in positions:  # позиций нет
+        positions = positions.assign(quantity=[], avg_price=[])
+    snapshot = {'money': tif.get_available_balance(client=client),
+                'positions': {row.figi: (int(row.quantity), float(row.avg_price)) for row in positions.itertuples()}}
+    with open(path, 'w') as f:
+        json.dump(snapshot, f)
+
+
+def load_portfolio(path):
+    """
+    :return: (dict, dict) - свободные средства {валюта: сумма}, позиции {figi: (кол-во бумаг, средняя цена)}
+    """
+    with open(path) as f:
+        snapshot = json.load(f)
+    return snapshot['money'], {figi: tuple(p) for figi, p in snapshot['positions'].items()}
+
+
+class ReplayHarness:
+    """
+    Прогон неизмененной стратегии (ma_trading_strategy) на записанной истории быстрее реального времени:
+    на каждом шаге часы ReplayServices переводятся на следующую свечу и стратегия запускается
+    по всем тикерам, как в ma_trading.run_tick. Справочник инструментов и состояние стратегии
+    создаются во временном каталоге, рабочие файлы не затрагиваются
+    :param services: ReplayServices
+    :param tickers: list of str - тикеры (должны быть в services.shares)
+    :param params: dict - параметры МА {figi: параметры} (None - DEFAULT_PARAMS для всех)
+    :param account_id: str - номер счета
+    :param workdir: str - каталог для справочника и базы состояния (None - временный)
+    :param quiet: bool - не выводить печать стратегии
+    :param latency_log: str - файл для сводок задержек по шагам (None - сводки не сохраняются)
+    """
+
+    def __init__(self, services, tickers, params=None, account_id='replay', workdir=None, quiet=True,
+                 latency_log=None):
+        self.services = services
+        self.latency_log = latency_log
+        self.client = FakeClient(services)
+        self.tickers = list(tickers)
+        self.account_id = account_id
+        self.quiet = quiet
+        self._tmpdir = tempfile.TemporaryDirectory(prefix='ti_replay_') if workdir is None else None
+        workdir = workdir or self._tmpdir.name
+
+        self.instruments = InstrumentRegistry(os.path.join(workdir, 'instruments.json'), client=self.client)
+        self.instruments.load(self.tickers)
+        figis = [self.instruments.by_ticker(tick).figi for tick in self.tickers]
+
+        # без импорта yaml рабочего каталога: состояние начинается с пустого
+        self.state = StateStore(os.path.join(workdir, 'trading_state.db'), yaml_files=None)
+        self.state.set_params(params or {figi: dict(DEFAULT_PARAMS) for figi in figis})
+
+        self.steps = 0
+        self.errors = []
+
+    def close(self):
+        """
+        Закрывает базу состояния и удаляет временный каталог
+        """
+        self.state.close()
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def step(self, now):
+        """
+        Один запуск стратегии по всем тикерам на момент now
+        :param now: int - время воспроизведения (нс, UTC)
+        """
+        start = time.perf_counter()
+        self.services.now = now
+        snapshot = AccountSnapshot(self.client, account_id=self.account_id)
+        out = io.StringIO() if self.quiet else None
+        with contextlib.redirect_stdout(out) if out is not None else contextlib.nullcontext():
+            for tick in self.tickers:
+                try:
+                    ma_trading_strategy(tick, self.account_id, self.instruments, client=self.client,
+                                        snapshot=snapshot, state=self.state)
+                except Exception as e:
+                    self.errors.append((now, tick, e))
+        self.steps += 1
+        recorder.flush_tick(time.perf_counter() - start, path=self.latency_log)
+
+    def bar_times(self, warmup_days=10):
+        """
+        Моменты запуска стратегии (ReplayServices.bar_times)
+        """
+        return self.services.bar_times(warmup_days)
+
+    def run(self, times=None, steps=None):
+        """
+        Прогон по моментам times (None - bar_times)
+        :param steps: int - ограничение кол-ва шагов
+        :return: dict - кол-во шагов, время прогона и воспроизведенное время (сек), ускорение, заявки, ошибки
+        """
+        times = self.bar_times() if times is None else times
+        times = times[:steps] if steps is not None else times
+
+        start = time.perf_counter()
+        for now in times:
+            self.step(int(now))
+        elapsed = time.perf_counter() - start
+
+        replayed = float(times[-1] - times[0]) / NS if len(times) > 1 else 0.0
+        return {'steps': len(times), 'elapsed': round(elapsed, 3), 'replayed': replayed,
+                'speedup': round(replayed / elapsed, 1) if elapsed else None,
+                'orders': len(self.services.posted_orders), 'stop_orders': len(self.services.posted_stop_orders),
+                'cancelled_stop_orders': len(self.services.cancelled_stop_orders), 'errors': len(self.errors)}
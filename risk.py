@@ -0,0 +1,93 @@
+import functools
+from collections import namedtuple
+
+import numpy as np
+
+import price_math as pm
+from latency import ticker
+from order_execution import replace_stop_order, stop_order_ids, submit_job
+from state_store import get_state
+
+# поля открытой позиции (StateStore) с идентификаторами ее стоп-заявок
+ORDER_ID_FIELDS = {'stop_loss': 'stop_order_id', 'take_profit': 'take_profit_order_id'}
+
+# перестановка stop_loss позиции: old_level - уровень в состоянии, level - новый (кратен шагу цены)
+StopUpdate = namedtuple('StopUpdate', ['tick', 'figi', 'lots', 'lot', 'old_level', 'level', 'stop_order_id',
+                                       'round_features'])
+
+
+def position_order_ids(pos_info):
+    """
+    Идентификаторы стоп-заявок позиции
+    :return: dict - {order_type: stop_order_id}
+    """
+    return {order_type: pos_info.get(field) for order_type, field in ORDER_ID_FIELDS.items()}
+
+
+def trailing_stops(signals, positions):
+    """
+    Подтягивание stop_loss за ценой сразу по всем открытым позициям, для которых сохраняется сигнал
+    на покупку (to_buy == 1): уровень cur_close * (1 - stop_loss_lvl) округляется до шага цены,
+    перестановка нужна только если он вырос хотя бы на один шаг
+    :param signals: dict - {тикер: результат ma_signal}
+    :param positions: dict - открытые позиции (StateStore.positions)
+    :return: list of StopUpdate
+    """
+    ticks = [tick for tick, sig in signals.items()
+             if sig['to_buy'] == 1 and tick in positions and positions[tick]['lots'] >= 1]
+    if not ticks:
+        return []
+
+    sigs = [signals[tick] for tick in ticks]
+    cur_close = np.array([sig['cur_close'] for sig in sigs], dtype=np.float64)
+    stop_loss_lvl = np.array([sig['stop_loss_lvl'] for sig in sigs], dtype=np.float64)
+    steps = np.array([sig['round_features'][1] for sig in sigs], dtype=np.float64)
+    old_level = np.array([positions[tick]['stop_loss'] for tick in ticks], dtype=np.float64)
+
+    level = pm.round_to_step_array(cur_close * (1 - stop_loss_lvl), steps)
+    moved = np.rint((level - pm.round_to_step_array(old_level, steps)) / steps) >= 1
+
+    return [StopUpdate(tick=ticks[i], figi=sigs[i]['figi'], lots=positions[ticks[i]]['lots'], lot=sigs[i]['lot'],
+                       old_level=float(old_level[i]), level=float(level[i]),
+                       stop_order_id=positions[ticks[i]].get(ORDER_ID_FIELDS['stop_loss']),
+                       round_features=sigs[i]['round_features'])
+            for i in np.flatnonzero(moved)]
+
+
+def _stop_replaced(state, update, future):
+    job = future.result()
+    if state.get_position(update.tick) is None:  # позиция уже закрыта
+        return
+    if job.ok:
+        state.update_position(update.tick, stop_order_id=stop_order_ids(job)['stop_loss'])
+    elif job.results:
+        # действующая заявка отменена, новая не выставилась: стопа нет, уровень 0 - выставить на следующем баре
+        state.update_position(update.tick, stop_loss=0.0, stop_order_id=None)
+    else:
+        # действующая заявка не отменена - остается прежний уровень
+        state.update_position(update.tick, stop_loss=update.old_level)
+
+
+def apply_stop_updates(updates, account_id, state=None, executor=None, client=None, snapshot=None):
+    """
+    Перестановка стоп-заявок (отмена действующей + новая), у позиции всегда не больше одной stop_loss.
+    Уровень в состоянии меняется сразу, идентификатор новой заявки - после ее выставления
+    :param updates: list of StopUpdate - результат trailing_stops
+    :param account_id: str - номер счета
+    :param state: StateStore - состояние стратегии (None - общее хранилище state_store)
+    :param executor: OrderExecutor - очередь заявок (None - заявки выставляются сразу)
+    :return: list of Future с OrderJob
+    """
+    state = get_state(state)
+    futures = []
+    for update in updates:
+        job = replace_stop_order(update.figi, update.lots, update.level, update.stop_order_id, account_id,
+                                 update.round_features, lot=update.lot)
+        state.update_position(update.tick, stop_loss=update.level)
+        print(f'{update.tick}: stop_loss changed: {update.old_level} --> {update.level}')
+
+        with ticker(update.tick):  # проход по всему портфелю идет без метки тикера
+            future = submit_job(job, executor, client, snapshot)
+        future.add_done_callback(functools.partial(_stop_replaced, state, update))
+        futures.append(future)
+    return futures
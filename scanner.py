@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import ti_functional as tif
+from candle_store import datetime_to_ns
+from candles import CandleSet
+from state_store import get_state
+
+
+def close_panel(candles, figis, length, drop_last=True):
+    """
+    Цены закрытия последних length свечей по всем инструментам в одном массиве (время x инструмент),
+    свечи выровнены по последней строке, недостающие в начале - nan
+    :param candles: CandleSet
+    :param figis: list of str - инструменты (колонки)
+    :param length: int - кол-во строк
+    :param drop_last: bool - без последней (еще не закрытой) свечи, как в ma_signal
+    :return: np.ndarray (length, N)
+    """
+    panel = np.full((length, len(figis)), np.nan)
+    for j, figi in enumerate(figis):
+        close = candles.column(figi, 'close')
+        close = close[:-1] if drop_last else close
+        close = close[len(close) - min(length, len(close)):]
+        panel[length - len(close):, j] = close
+    return panel
+
+
+def _window_mean(panel, windows, end):
+    """
+    Среднее по окну windows[j] строк, заканчивающемуся перед строкой end, для каждой колонки j
+    (неполное окно или nan в окне - nan)
+    """
+    rows = np.arange(panel.shape[0])[:, None]
+    start = end - windows
+    mask = (rows >= start[None, :]) & (rows < end)
+    ma = np.where(mask, panel, 0.0).sum(axis=0) / windows
+    ma[start < 0] = np.nan
+    return ma
+
+
+def ma_crossover(panel, min_ma, max_ma):
+    """
+    Сигналы ma_indicator на последней свече сразу по всем инструментам, у каждого - свои окна МА
+    :param panel: np.ndarray (T, N) - результат close_panel
+    :param min_ma: np.ndarray (N,) - окно быстрой МА
+    :param max_ma: np.ndarray (N,) - окно медленной МА
+    :return: dict of np.ndarray (N,) - close_ma_fast, close_ma_long, to_buy, signal
+    """
+    min_ma, max_ma = np.asarray(min_ma), np.asarray(max_ma)
+    length = panel.shape[0]
+    with np.errstate(invalid='ignore'):
+        fast, slow = _window_mean(panel, min_ma, length), _window_mean(panel, max_ma, length)
+        to_buy = tif.ma_above(fast, slow)  # nan и равные средние - 0, как в ma_indicator
+        prev_to_buy = tif.ma_above(_window_mean(panel, min_ma, length - 1), _window_mean(panel, max_ma, length - 1))
+
+    # у первой свечи истории нет предыдущего направления - сигнал всегда 1
+    has_prev = np.isfinite(panel[-2]) if length > 1 else np.zeros(panel.shape[1], dtype=bool)
+    signal = ~has_prev | (to_buy != prev_to_buy)
+    return {'close_ma_fast': fast, 'close_ma_long': slow,
+            'to_buy': to_buy.astype(np.int8), 'signal': signal.astype(np.int8)}
+
+
+def scan_universe(tickers, instruments, candle_store, state=None, days=10):
+    """
+    Отбор тикеров, по которым ma_execute может что-то сделать: сигнал на вход (to_buy == 1 и signal == 1)
+    или открытая позиция (подтягивание стопа / выход). Сигналы считаются одним проходом по массиву
+    цен всех инструментов из хранилища свечей (свечи должны быть догружены заранее)
+    :param tickers: list of str - тикеры
+    :param instruments: InstrumentRegistry - справочник инструментов
+    :param candle_store: CandleStore - хранилище свечей
+    :param state: StateStore - состояние стратегии (None - общее хранилище state_store)
+    :param days: int - глубина истории в днях, как в ma_signal
+    :return: list of str - тикеры в исходном порядке
+    """
+    state = get_state(state)
+    params = state.params
+    figis = {tick: instruments.by_ticker(tick).figi for tick in tickers}
+    # тикеры без параметров пропускаются сканером и проверяются ma_signal как раньше
+    scanned = [tick for tick in tickers if figis[tick] in params]
+    if not scanned:
+        return list(tickers)
+
+    from_ns = datetime_to_ns(datetime.now(timezone.utc) - timedelta(days=days))
+    candles = CandleSet.from_store(candle_store, [figis[tick] for tick in scanned], from_ns=from_ns, precision='f8')
+    min_ma = np.array([params[figis[tick]]['min_ma'] for tick in scanned])
+    max_ma = np.array([params[figis[tick]]['max_ma'] for tick in scanned])
+    panel = close_panel(candles, candles.figis, int(max(min_ma.max(), max_ma.max())) + 1)
+    signals = ma_crossover(panel, min_ma, max_ma)
+
+    entry = dict(zip(scanned, (signals['to_buy'] == 1) & (signals['signal'] == 1)))
+    positions = state.positions
+    return [tick for tick in tickers if entry.get(tick, True) or tick in positions]
@@ -0,0 +1,135 @@
+import json
+import os
+import sqlite3
+import threading
+
+import ti_functional as tif
+
+STATE_DB = os.environ.get('TI_STATE_DB', 'trading_state.db')
+
+_state = None
+_state_lock = threading.Lock()
+
+
+class StateStore:
+    """
+    Состояние стратегии (открытые позиции и параметры МА по инструментам) в SQLite (режим WAL).
+    Загружается в память один раз при открытии, каждое изменение - отдельная транзакция,
+    поэтому сбой во время записи не теряет остальные позиции.
+    При первом открытии данные импортируются из deals_params.yaml / best_ma_params.yaml
+    :param path: str - файл базы
+    :param yaml_files: tuple of str - yaml-файлы позиций и параметров (без расширения) для импорта
+    при первом открытии (None - без импорта)
+    """
+
+    def __init__(self, path=STATE_DB, yaml_files=('deals_params', 'best_ma_params')):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS positions (tick TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS ma_params (figi TEXT PRIMARY KEY, data TEXT NOT NULL)')
+
+        self._positions = self._load('positions')
+        self._params = self._load('ma_params')
+        if yaml_files and not self._positions and not self._params:
+            self.import_yaml(*yaml_files)
+
+    def _load(self, table):
+        return {key: json.loads(data) for key, data in self._conn.execute(f'SELECT * FROM {table}')}
+
+    def close(self):
+        self._conn.close()
+
+    # открытые позиции
+    @property
+    def positions(self):
+        """
+        Открытые позиции: {тикер: {'lots', 'price', 'stop_loss', 'take_profit'}} (копия)
+        """
+        with self._lock:
+            return {tick: dict(info) for tick, info in self._positions.items()}
+
+    def get_position(self, tick):
+        with self._lock:
+            info = self._positions.get(tick)
+            return dict(info) if info is not None else None
+
+    def set_position(self, tick, info):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO positions VALUES (?, ?)', (tick, json.dumps(info)))
+            self._positions[tick] = dict(info)
+
+    def update_position(self, tick, **fields):
+        """
+        Меняет отдельные поля открытой позиции
+        """
+        with self._lock:
+            self.set_position(tick, {**self._positions[tick], **fields})
+
+    def delete_position(self, tick):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM positions WHERE tick = ?', (tick,))
+            self._positions.pop(tick, None)
+
+    # параметры стратегии
+    def get_params(self, figi):
+        """
+        Параметры МА по инструменту в формате best_ma_params.yaml
+        """
+        return self._params[figi]
+
+    @property
+    def params(self):
+        with self._lock:
+            return {figi: dict(p) for figi, p in self._params.items()}
+
+    def set_params(self, params):
+        """
+        Записывает параметры по инструментам одной транзакцией
+        :param params: dict - {figi: параметры}
+        """
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO ma_params VALUES (?, ?)',
+                                   [(figi, json.dumps(p)) for figi, p in params.items()])
+            self._params.update({figi: dict(p) for figi, p in params.items()})
+
+    # совместимость с yaml-файлами
+    def import_yaml(self, positions_file='deals_params', params_file='best_ma_params'):
+        """
+        Загружает позиции и параметры из yaml-файлов (если они есть)
+        """
+        with self._lock, self._conn:
+            if os.path.exists(f'{positions_file}.yaml'):
+                positions = tif.load_yaml(positions_file) or {}
+                self._conn.execute('DELETE FROM positions')
+                self._conn.executemany('INSERT INTO positions VALUES (?, ?)',
+                                       [(tick, json.dumps(info)) for tick, info in positions.items()])
+                self._positions = positions
+            if os.path.exists(f'{params_file}.yaml'):
+                params = tif.load_yaml(params_file) or {}
+                self._conn.executemany('INSERT OR REPLACE INTO ma_params VALUES (?, ?)',
+                                       [(figi, json.dumps(p)) for figi, p in params.items()])
+                self._params.update(params)
+
+    def export_yaml(self, positions_file='deals_params', params_file='best_ma_params'):
+        """
+        Сохраняет позиции и параметры в yaml-файлы
+        """
+        tif.save_yaml(self.positions, positions_file)
+        tif.save_yaml(self.params, params_file)
+
+
+def get_state(state=None):
+    """
+    Возвращает переданное хранилище или общее для процесса (открывается при первом обращении)
+    """
+    global _state
+    if state is not None:
+        return state
+    with _state_lock:
+        if _state is None:
+            _state = StateStore()
+    return _state
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tinkoff.invest')
+
+from backfill import backfill  # noqa: E402
+from candle_store import CandleStore, NS, datetime_to_ns, ns_to_datetime  # noqa: E402
+from replay import ReplayServices, synthetic_candles  # noqa: E402
+from ti_client import FakeClient  # noqa: E402
+
+DAY = 86400 * NS
+
+
+@pytest.fixture
+def candles():
+    return {'FIGI0': synthetic_candles(days=10, seed=0), 'FIGI1': synthetic_candles(days=10, seed=1)}
+
+
+@pytest.fixture
+def services(candles):
+    """
+    Записанная история: запросы отдаются за [from_, to), части из fail завершаются ошибкой
+    """
+    services = ReplayServices(candles, relative=False)
+    services.now += 3600 * NS  # конец периода загрузки не кратен суткам - последняя часть неполная
+    get_all_candles = services.get_all_candles
+    services.requests, services.fail = [], set()
+
+    def get_all_candles_with_failures(**kwargs):
+        request = (kwargs['figi'], datetime_to_ns(kwargs['from_']))
+        services.requests.append(request)
+        if request in services.fail:
+            raise ConnectionError(f'{request} failed')
+        return get_all_candles(**kwargs)
+
+    services.get_all_candles = get_all_candles_with_failures
+    return services
+
+
+def test_backfill_resumes_failed_and_edge_chunks(tmp_path, candles, services):
+    to = ns_to_datetime(services.now)
+    store = CandleStore(str(tmp_path), client=FakeClient(services))
+    day_start = services.now // DAY * DAY  # начало последней (неполной) части
+    from_ = services.now - 16 * DAY  # начало первой (неполной) части
+    services.fail = {('FIGI0', day_start - 3 * DAY), ('FIGI0', day_start - 5 * DAY), ('FIGI1', day_start - 4 * DAY)}
+
+    first = backfill(list(candles), days=16, store=store, client=FakeClient(services), workers=4, to=to)
+    assert sorted((chunk.figi, chunk.from_ns) for chunk, _ in first['failed']) == sorted(services.fail)
+    assert first['chunks'] == len(services.requests) == 2 * 17
+
+    services.requests, fail = [], services.fail
+    services.fail = set()
+    second = backfill(list(candles), days=16, store=store, client=FakeClient(services), workers=4, to=to)
+
+    # повторно загружаются только части с ошибкой и неполные части на краях периода
+    edges = {(figi, start) for figi in candles for start in (from_, day_start)}
+    assert sorted(services.requests) == sorted(fail | edges)
+    assert second['failed'] == [] and second['chunks'] == 7
+    for figi, records in candles.items():
+        assert np.array_equal(store.load(figi), records)
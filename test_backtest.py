@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('tinkoff.invest')
+
+import ti_functional as tif  # noqa: E402
+from backtest import BUY_SLIPPAGE, TAKE_PROFIT, param_grid, simulate  # noqa: E402
+
+
+def random_records(seed, size=1500, step=0.01):
+    """
+    Свечи случайного блуждания с ценами, кратными шагу цены
+    """
+    rng = np.random.default_rng(seed)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.002, size)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.002, size))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.002, size))
+    records = np.zeros(size, dtype=tif.CANDLE_DTYPE)
+    for name, values in (('open', open_), ('close', close), ('high', high), ('low', low)):
+        records[name] = np.round(values / step) * step
+    return records
+
+
+def scalar_simulate(records, min_ma, max_ma, stop_loss):
+    """
+    Правила simulate для одной комбинации параметров по сигналам tif.ma_indicator
+    """
+    data = tif.ma_indicator(pd.DataFrame({'close': records['close']}), ma_fast=min_ma, ma_long=max_ma)
+    to_buy, signal = data['to_buy'].to_numpy(), data['signal'].to_numpy()
+    open_, high, low = records['open'], records['high'], records['low']
+    in_pos, entry, stop, take = False, 0.0, 0.0, 0.0
+    returns = []
+
+    for t in range(len(records) - 1):
+        cur = open_[t + 1]
+        if in_pos and not to_buy[t]:
+            returns.append((cur - entry) / entry * 100)
+            in_pos = False
+        elif in_pos:
+            stop = max(stop, cur * (1 - stop_loss))
+        elif to_buy[t] and signal[t]:
+            in_pos, entry = True, cur * BUY_SLIPPAGE
+            stop, take = cur * (1 - stop_loss), cur * (1 + TAKE_PROFIT)
+
+        if in_pos and low[t + 1] <= stop:
+            returns.append((stop - entry) / entry * 100)
+            in_pos = False
+        if in_pos and high[t + 1] >= take:
+            returns.append((take - entry) / entry * 100)
+            in_pos = False
+    return len(returns), sum(returns)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_simulate_matches_ma_indicator(seed):
+    records = random_records(seed)
+    min_ma, max_ma, stop_loss = param_grid(range(5, 13, 3), range(10, 31, 5), (0.001, 0.01))
+    result = simulate(records, min_ma, max_ma, stop_loss)
+
+    for i in range(len(min_ma)):
+        cnt, fin = scalar_simulate(records, int(min_ma[i]), int(max_ma[i]), float(stop_loss[i]))
+        assert result['cnt_deals'][i] == cnt
+        assert result['fin_result'][i] == pytest.approx(fin, abs=1e-9)
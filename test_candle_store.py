@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tinkoff.invest')
+
+from tinkoff.invest import CandleInterval  # noqa: E402
+
+import candle_store  # noqa: E402
+from candle_store import CandleStore, NS, ns_to_datetime  # noqa: E402
+from replay import ReplayServices, synthetic_candles  # noqa: E402
+from ti_client import FakeClient  # noqa: E402
+
+FIGI = 'FIGI0'
+INTERVAL = CandleInterval.CANDLE_INTERVAL_15_MIN
+BARS_PER_DAY = 36  # 07:00-15:45 UTC в synthetic_candles
+
+
+class Clock:
+    """
+    Часы хранилища (datetime.now в candle_store) и воспроизведения (ReplayServices.now)
+    """
+
+    def __init__(self, monkeypatch, services, now):
+        self.services = services
+        self.set(now)
+        clock = self
+
+        class ClockDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return ns_to_datetime(clock.now)
+
+        monkeypatch.setattr(candle_store, 'datetime', ClockDatetime)
+
+    def set(self, now):
+        self.now = self.services.now = int(now)
+
+
+@pytest.fixture
+def candles():
+    return synthetic_candles(days=5)  # пн 2023-01-09 - пт 2023-01-13
+
+
+@pytest.fixture
+def services(candles):
+    services = ReplayServices({FIGI: candles}, relative=False)
+    get_all_candles = services.get_all_candles
+    services.requests = []
+
+    def counting_get_all_candles(**kwargs):
+        services.requests.append((kwargs['from_'], kwargs['to']))
+        return get_all_candles(**kwargs)
+
+    services.get_all_candles = counting_get_all_candles
+    return services
+
+
+def test_update_does_not_request_empty_head_again(tmp_path, monkeypatch, candles, services):
+    # первая свеча хранилища позже now - days (выходные перед началом истории)
+    clock = Clock(monkeypatch, services, candles['time'][-10] + 2 * 60 * NS)
+    store = CandleStore(str(tmp_path), client=FakeClient(services))
+    store.update(FIGI, days=10)
+    for _ in range(3):
+        clock.set(clock.now + 15 * 60 * NS)
+        store.update(FIGI, days=10)
+
+    assert len(services.requests) == 4  # один запрос на обновление: только хвост
+    stored = store.load(FIGI)
+    expected = candles[candles['time'] < clock.now]
+    assert np.array_equal(stored['time'], expected['time'])  # время в нс без потери точности
+    assert np.array_equal(stored[:-1], expected[:-1])  # последняя свеча не закрыта - по цене открытия
+
+
+def test_update_requests_head_when_window_grows(tmp_path, monkeypatch, candles, services):
+    clock = Clock(monkeypatch, services, candles['time'][-1] + 15 * 60 * NS)
+    store = CandleStore(str(tmp_path), client=FakeClient(services))
+    store.update(FIGI, days=2)
+    first = store.time_range(FIGI)[0]
+    store.update(FIGI, days=10)  # окно больше запрошенного ранее - начало догружается
+
+    assert services.requests[1] == (ns_to_datetime(clock.now) - timedelta(days=10), ns_to_datetime(first))
+    assert np.array_equal(store.load(FIGI), candles)
+
+
+def test_write_merges_out_of_order_chunks_and_replaces_tail(tmp_path, candles):
+    store = CandleStore(str(tmp_path))
+    store.write(FIGI, INTERVAL, candles[100:])
+    store.write(FIGI, INTERVAL, candles[::-1][-100:])  # начало, по убыванию
+    store.write(FIGI, INTERVAL, candles[90:110])  # повтор середины
+    assert np.array_equal(store.load(FIGI), candles)
+
+    forming = candles[-1:].copy()
+    forming['close'] += 1.0
+    store.write(FIGI, INTERVAL, forming)  # незакрытая свеча заменяется
+    assert np.array_equal(store.load(FIGI)[-1:], forming)
+    store.write(FIGI, INTERVAL, candles[-1:])
+    assert np.array_equal(store.load(FIGI), candles)
+    assert np.array_equal(store.load(FIGI, from_ns=int(candles['time'][50])), candles[50:])
+
+
+def test_find_gaps(tmp_path, candles):
+    day = BARS_PER_DAY
+    keep = np.ones(len(candles), dtype=bool)
+    keep[day:2 * day] = False  # пропущенная сессия
+    keep[2 * day + 10:2 * day + 20] = False  # пропуск внутри дня
+    keep[3 * day + 5:3 * day + 8] = False  # короткий разрыв (нет сделок) - не пропуск
+
+    store = CandleStore(str(tmp_path))
+    store.write(FIGI, INTERVAL, candles[keep])
+    times = candles['time']
+    assert store.find_gaps(FIGI) == [(ns_to_datetime(times[day - 1]), ns_to_datetime(times[2 * day])),
+                                     (ns_to_datetime(times[2 * day + 9]), ns_to_datetime(times[2 * day + 20]))]
+
+    store.write(FIGI, INTERVAL, candles[~keep])
+    assert store.find_gaps(FIGI) == []
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('tinkoff.invest')
+pytest.importorskip('talib')
+
+from indicators import compare_with_batch  # noqa: E402
+
+
+def random_closes(seed, size=300, step=0.01):
+    """
+    Случайное блуждание цены, округленное до шага цены (совпадения МА на таких ценах часты)
+    """
+    rng = np.random.default_rng(seed)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.002, size)))
+    return pd.DataFrame({'close': np.round(close / step) * step})
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('ma_fast, ma_long', [(5, 10), (12, 24), (20, 40)])
+def test_ma_matches_batch(seed, ma_fast, ma_long):
+    assert compare_with_batch(random_closes(seed), ma_fast, ma_long) == []
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('macd_params', [(12, 26, 9), (5, 35, 5)])
+def test_macd_matches_batch(seed, macd_params):
+    assert compare_with_batch(random_closes(seed), 12, 24, macd_params) == []
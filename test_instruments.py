@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('tinkoff.invest')
+
+from instruments import InstrumentRegistry  # noqa: E402
+from replay import DEFAULT_PARAMS, ReplayServices, make_share, synthetic_candles  # noqa: E402
+from ti_client import FakeClient  # noqa: E402
+
+
+@pytest.fixture
+def services():
+    services = ReplayServices({'FIGI0': synthetic_candles(days=12)}, [make_share('FIGI0', 'SBER')])
+    shares = services.instruments.shares
+    services.shares_calls = 0
+
+    def counting_shares(**kwargs):
+        services.shares_calls += 1
+        return shares(**kwargs)
+
+    services.instruments.shares = counting_shares
+    return services
+
+
+def test_missing_ticker_is_cached(tmp_path, services):
+    path = str(tmp_path / 'instruments.json')
+    registry = InstrumentRegistry(path, client=FakeClient(services)).load(['SBER', 'YNDX'])
+    assert registry.by_ticker('SBER').figi == 'FIGI0'
+    for _ in range(3):
+        with pytest.raises(KeyError):
+            registry.by_ticker('YNDX')
+    assert services.shares_calls == 1
+
+    # следующий запуск берет справочник и отсутствующие тикеры из кэша, без запроса к API
+    registry = InstrumentRegistry(path, client=FakeClient(services)).load(['SBER', 'YNDX'])
+    with pytest.raises(KeyError):
+        registry.by_ticker('YNDX')
+    assert services.shares_calls == 1
+
+    # новый тикер - справочник загружается заново
+    with pytest.raises(KeyError):
+        registry.by_figi('FIGI1')
+    assert services.shares_calls == 2
+
+
+def test_run_tick_skips_unknown_tickers(tmp_path, monkeypatch, capsys, services):
+    monkeypatch.chdir(tmp_path)  # справочник, хранилище свечей и состояние - во временном каталоге
+    import ma_trading
+
+    ctx = ma_trading.TradingContext(['SBER', 'YNDX'], client=FakeClient(services), account_id='acc')
+    ctx.state.set_params({'FIGI0': dict(DEFAULT_PARAMS)})
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        ma_trading.run_tick(pool, ctx)
+        ma_trading.run_tick(pool, ctx)
+
+    out = capsys.readouterr().out
+    assert 'YNDX -> нет в справочнике' in out and 'Tick time' in out
+    assert len(ctx.candle_store.load('FIGI0')) > 0
+    assert services.shares_calls == 1
+    ctx.state.close()
@@ -0,0 +1,95 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import latency
+from latency import LatencyRecorder, ticker, timed, timer
+
+
+def test_ticker_is_reset_after_block(monkeypatch):
+    recorder = LatencyRecorder()
+    monkeypatch.setattr(latency, 'recorder', recorder)
+
+    with ticker('SBER'):
+        with timer('candles'):
+            pass
+    with timer('account_refresh'):
+        pass
+
+    summary = recorder.summary()
+    assert set(summary['stages']) == {'candles', 'account_refresh'}
+    assert summary['tickers'] == {'SBER': {'candles': summary['tickers']['SBER']['candles']}}
+
+
+def test_timed_tags_call_and_nested_samples(monkeypatch):
+    recorder = LatencyRecorder()
+    monkeypatch.setattr(latency, 'recorder', recorder)
+
+    @timed('signal', ticker_of=lambda tick: tick)
+    def signal(tick):
+        with timer('indicators'):
+            pass
+
+    with ThreadPoolExecutor(max_workers=1) as pool:  # один поток выполняет задачи разных тикеров
+        list(pool.map(signal, ['SBER', 'GAZP']))
+        pool.submit(lambda: recorder.record('untagged', 0.001)).result()
+
+    tickers = recorder.summary()['tickers']
+    assert set(tickers) == {'SBER', 'GAZP'}
+    assert all(set(stages) == {'signal', 'indicators'} for stages in tickers.values())
+
+
+def test_order_samples_keep_submitting_ticker(monkeypatch):
+    pytest.importorskip('tinkoff.invest')
+    from order_execution import DryRunSink, OrderExecutor, bracket_order
+
+    recorder = LatencyRecorder()
+    monkeypatch.setattr(latency, 'recorder', recorder)
+
+    class TimedSink(DryRunSink):
+        def submit(self, job, leg):
+            with timer(leg.kind):
+                return super().submit(job, leg)
+
+    executor = OrderExecutor(TimedSink(), workers=1)
+    for tick in ('SBER', 'GAZP'):
+        with ticker(tick):
+            executor.submit(bracket_order(f'FIGI_{tick}', 1, 100.0, 99.0, 105.0, 'acc', (2, 0.01)))
+    executor.join()
+    executor.close()
+
+    tickers = recorder.summary()['tickers']
+    assert set(tickers) == {'SBER', 'GAZP'}
+    assert tickers['SBER']['stop_order']['count'] == 2
+    assert set(tickers['SBER']['order']) == {'count', 'total', 'p50', 'p95', 'p99', 'max'}
+
+
+def test_streaming_flushes_once_per_bar(tmp_path, monkeypatch):
+    pytest.importorskip('tinkoff.invest')
+    import ma_trading
+    from market_stream import StreamCandle
+
+    monkeypatch.chdir(tmp_path)
+    recorder = LatencyRecorder()
+    monkeypatch.setattr(latency, 'recorder', recorder)
+    monkeypatch.setattr(ma_trading, 'recorder', recorder)
+    monkeypatch.setattr(ma_trading, 'in_trading_period', lambda now=None: True)
+    monkeypatch.setattr(ma_trading, 'ma_signal', timed('signal', ticker_of=lambda tick, *args, **kwargs: tick)(
+        lambda tick, *args, **kwargs: {'tick': tick}))
+    monkeypatch.setattr(ma_trading, 'ma_execute', lambda *args, **kwargs: None)
+    context = SimpleNamespace(figis=lambda: {'SBER': 'F1', 'GAZP': 'F2'}, instruments=None, client=None, engine=None,
+                              state=None, account=None, account_id='acc', executor=SimpleNamespace(join=lambda: None),
+                              candle_store=SimpleNamespace(update=lambda figi: None, write=lambda *args: None),
+                              latency_log=latency.LATENCY_LOG)
+
+    bar = 15 * 60 * 10 ** 9
+    source = [StreamCandle(figi, 100 * bar + i * bar, 1.0, 1.0, 1.0, 1.0, 1) for i in range(3) for figi in ('F1', 'F2')]
+    ma_trading.start_streaming(source, context)
+
+    with open(latency.LATENCY_LOG) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 2  # закрытия двух свечей, третья не закрылась
+    assert all(line['stages']['signal']['count'] == 2 and set(line['tickers']) == {'SBER', 'GAZP'}
+               for line in lines)
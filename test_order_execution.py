@@ -0,0 +1,104 @@
+import pytest
+
+pytest.importorskip('tinkoff.invest')
+
+from order_execution import (DryRunSink, OrderExecutor, bracket_order, close_position,  # noqa: E402
+                             stop_order_ids)
+
+ROUND_FEATURES = (2, 0.01)
+
+
+class Snapshot:
+    """
+    Снимок счета: только учет зарезервированных заявками средств и бумаг
+    """
+
+    def __init__(self):
+        self.money = 0.0
+        self.shares = 0
+
+    def apply_order(self, figi, quantity, price, direction):
+        sign = 1 if direction == 'buy' else -1
+        self.money -= sign * quantity * price
+        self.shares += sign * quantity
+
+
+class FailingSink(DryRunSink):
+    """
+    DryRunSink, который отклоняет заявки с именами из fail
+    """
+
+    def __init__(self, *fail):
+        super().__init__()
+        self.fail = set(fail)
+
+    def submit(self, job, leg):
+        if leg.name in self.fail:
+            raise RuntimeError(f'{leg.name} rejected')
+        return super().submit(job, leg)
+
+
+@pytest.fixture
+def snapshot():
+    return Snapshot()
+
+
+def run(sink, job, snapshot):
+    executor = OrderExecutor(sink, workers=2, snapshot=snapshot)
+    try:
+        job = executor.submit(job).result(timeout=5)
+        executor.join()
+    finally:
+        executor.close()
+    return job
+
+
+def test_bracket_order_legs_in_order(snapshot):
+    sink = DryRunSink()
+    job = run(sink, bracket_order('FIGI0', 2, 100.0, 99.0, 105.0, 'acc', ROUND_FEATURES, lot=10), snapshot)
+
+    assert job.ok
+    assert [(leg.name, leg.kind, leg.direction) for _, leg in sink.orders] == [
+        ('entry', 'order', 'buy'), ('stop_loss', 'stop_order', 'sell'), ('take_profit', 'stop_order', 'sell')]
+    assert set(stop_order_ids(job)) == {'stop_loss', 'take_profit'}
+    assert (snapshot.money, snapshot.shares) == (-2000.0, 20)  # резерв по заявке на вход остается
+
+
+def test_failed_entry_refunds_reservation(snapshot):
+    sink = FailingSink('entry')
+    job = run(sink, bracket_order('FIGI0', 2, 100.0, 99.0, 105.0, 'acc', ROUND_FEATURES, lot=10), snapshot)
+
+    assert not job.ok and job.results == []
+    assert sink.orders == []  # стоп-заявки без входа не выставляются
+    assert (snapshot.money, snapshot.shares) == (0.0, 0)
+
+
+def test_failed_stop_keeps_entry_reservation(snapshot):
+    sink = FailingSink('stop_loss')
+    job = run(sink, bracket_order('FIGI0', 1, 100.0, 99.0, 105.0, 'acc', ROUND_FEATURES, lot=10), snapshot)
+
+    assert [r.name for r in job.results] == ['entry']
+    assert (snapshot.money, snapshot.shares) == (-1000.0, 10)  # вход выставлен - резерв не снимается
+
+
+def test_close_position_cancels_stops_before_sell(snapshot):
+    sink = DryRunSink()
+    stops = {'stop_loss': 'SL1', 'take_profit': 'TP1'}
+    job = run(sink, close_position('FIGI0', 1, 100.0, 'acc', ROUND_FEATURES, stops, lot=10), snapshot)
+
+    assert job.ok
+    assert [(leg.kind, leg.order_id if leg.kind != 'order' else None) for _, leg in sink.orders] == [
+        ('cancel_stop_order', 'SL1'), ('cancel_stop_order', 'TP1'), ('order', None)]
+    assert (snapshot.money, snapshot.shares) == (1000.0, -10)
+
+
+@pytest.mark.parametrize('fail, placed', [('cancel_stop_loss', []), ('cancel_take_profit', ['cancel_stop_loss'])])
+def test_close_position_stops_on_failed_cancel(snapshot, fail, placed):
+    sink = FailingSink(fail)
+    stops = {'stop_loss': 'SL1', 'take_profit': 'TP1'}
+    job = run(sink, close_position('FIGI0', 1, 100.0, 'acc', ROUND_FEATURES, stops, lot=10), snapshot)
+
+    assert not job.ok
+    assert [leg.name for _, leg in sink.orders] == placed  # продажа не выставлена
+    assert (snapshot.money, snapshot.shares) == (0.0, 0)  # резерв по продаже снят
+
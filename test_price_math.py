@@ -0,0 +1,162 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tinkoff.invest')
+
+import price_math as pm  # noqa: E402
+
+STEPS = [0.01, 0.05, 0.1, 0.5, 1.0, 0.001, 0.0025, 0.15, 0.2]
+
+
+# эталон на Decimal
+def dec(value):
+    return Decimal(repr(float(value)))
+
+
+def ref_nano(value):
+    """
+    Цена в nano: точное десятичное значение float, округленное до nano (половина - к четному)
+    """
+    return int(dec(value).scaleb(9).quantize(Decimal(1), ROUND_HALF_EVEN))
+
+
+def ref_round(price, base):
+    """
+    Округление до шага base в nano: ближайшее кратное, половина - к четному
+    """
+    step = ref_nano(base)
+    return int((Decimal(ref_nano(price)) / step).quantize(Decimal(1), ROUND_HALF_EVEN)) * step
+
+
+def ref_quotation(value):
+    total = ref_nano(value)
+    units = int(Decimal(total) / pm.NANO)  # с отбрасыванием дробной части, nano того же знака
+    return units, total - units * pm.NANO
+
+
+# функции ti_functional до перехода на price_math
+def legacy_money_to_val_r(value, rnd=10):
+    units, nano = (map(int, str(float(value)).split('.')))
+    nano = int(round((value - units), rnd) * 1e9)
+    return units, nano
+
+
+def legacy_price_features(nano):
+    n_dec = 10 - len(str(nano))
+    base = int(str(nano)[0]) / 10 ** n_dec
+    return (n_dec, base)
+
+
+def legacy_trade_round(price, n_dec=10, base=0.01):
+    return round(base * round(float(price) / base), n_dec)
+
+
+def random_prices(seed, size=2000):
+    """
+    Цены обоих знаков с 0-6 знаками после запятой
+    """
+    rng = np.random.default_rng(seed)
+    digits = rng.integers(0, 7, size)
+    return rng.choice([-1, 1], size) * rng.integers(1, 10 ** 9, size) / 10.0 ** digits
+
+
+def ties(base, count=200):
+    """
+    Цены ровно посередине между соседними кратными шага, обоих знаков
+    """
+    step = dec(base)
+    prices = [float((k + Decimal('0.5')) * step) for k in range(-count, count)]
+    assert all(dec(p) / step % 1 in (Decimal('0.5'), Decimal('-0.5')) for p in prices)
+    return prices
+
+
+@pytest.mark.parametrize('base', STEPS)
+@pytest.mark.parametrize('seed', range(3))
+def test_round_to_step_matches_decimal(seed, base):
+    for price in random_prices(seed):
+        assert pm.round_to_step(price, base) == ref_round(price, base), price
+
+
+@pytest.mark.parametrize('base', STEPS)
+def test_round_to_step_ties_to_even(base):
+    for price in ties(base):
+        assert pm.round_to_step(price, base) == ref_round(price, base), price
+        assert ref_round(price, base) // ref_nano(base) % 2 == 0
+
+
+@pytest.mark.parametrize('base', [0.01, 0.05, 0.1, 0.5, 1.0, 0.001])
+def test_round_to_step_matches_legacy_off_ties(base):
+    n_dec = legacy_price_features(ref_nano(base) % pm.NANO)[0] if base < 1 else 0
+    for price in random_prices(0):
+        frac = dec(price) / dec(base) % 1
+        if abs(abs(frac) - Decimal('0.5')) < Decimal('1e-6'):
+            continue
+        assert round(pm.round_to_step(price, base) / pm.NANO, n_dec) == legacy_trade_round(price, n_dec, base), price
+
+
+def test_round_to_step_fixes_legacy_ties():
+    assert legacy_trade_round(0.235, 2, 0.01) != 0.24
+    assert pm.round_to_step(0.235, 0.01) == 240000000
+    assert pm.round_to_step(-1.005, 0.01) == -1000000000
+    assert pm.round_to_step(0.225, 0.15) == 300000000
+    assert pm.round_to_step(1.00125, 0.0025) == 1000000000
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_to_quotation_matches_decimal(seed):
+    for value in random_prices(seed):
+        quotation = pm.to_quotation(value)
+        assert (quotation.units, quotation.nano) == ref_quotation(value), value
+
+
+def test_to_quotation_matches_legacy():
+    for cents in range(-10000, 10000):
+        value = cents / 100
+        quotation = pm.to_quotation(value)
+        assert (quotation.units, quotation.nano) == legacy_money_to_val_r(value), value
+
+
+def test_to_quotation_fixes_legacy():
+    assert legacy_money_to_val_r(7640549.18) != (7640549, 180000000)
+    quotation = pm.to_quotation(7640549.18)
+    assert (quotation.units, quotation.nano) == (7640549, 180000000)
+    quotation = pm.to_quotation(-0.25)
+    assert (quotation.units, quotation.nano) == (0, -250000000)
+
+
+@pytest.mark.parametrize('units, nano, expected', [
+    (0, 10000000, (2, 0.01)),
+    (0, 500000000, (1, 0.5)),
+    (0, 1000000, (3, 0.001)),
+    (0, 1, (9, 1e-9)),
+    (1, 0, (0, 1.0)),
+    (0, 2500000, (4, 0.0025)),
+    (0, 150000000, (2, 0.15)),
+    (1, 500000000, (1, 1.5)),
+])
+def test_price_features(units, nano, expected):
+    assert pm.price_features(nano, units) == expected
+    step = Decimal(units) + Decimal(nano).scaleb(-9)
+    assert expected == (max(0, -step.normalize().as_tuple().exponent), float(step))
+
+
+@pytest.mark.parametrize('nano', [10 ** k * d for k in range(9) for d in range(1, 10)])
+def test_price_features_matches_legacy_single_digit_steps(nano):
+    assert pm.price_features(nano) == legacy_price_features(nano)
+
+
+@pytest.mark.parametrize('base', STEPS)
+def test_round_to_step_array_matches_scalar(base):
+    prices = np.concatenate([random_prices(1), ties(base)])
+    expected = [pm.round_to_step(price, base) / pm.NANO for price in prices]
+    assert pm.round_to_step_array(prices, base).tolist() == expected
+
+
+def test_round_to_step_array_per_price_steps():
+    rng = np.random.default_rng(0)
+    prices = random_prices(2)
+    bases = rng.choice(STEPS, len(prices))
+    expected = [pm.round_to_step(price, base) / pm.NANO for price, base in zip(prices, bases)]
+    assert pm.round_to_step_array(prices, bases).tolist() == expected
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('tinkoff.invest')
+
+import ti_functional as tif  # noqa: E402
+from candles import CandleSet  # noqa: E402
+from replay import synthetic_candles  # noqa: E402
+from scanner import close_panel, ma_crossover  # noqa: E402
+
+WINDOWS = [(5, 10), (12, 24), (20, 40), (24, 12)]
+
+
+def ma_indicator_last(close, min_ma, max_ma):
+    data = tif.ma_indicator(pd.DataFrame({'close': close}), min_ma, max_ma)
+    last = data.iloc[-1]
+    return int(last['to_buy']), int(last['signal']), last['close_ma_fast'] == last['close_ma_long']
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_ma_crossover_matches_ma_indicator(seed):
+    # цена 1.0 при округлении до 0.01: цены часто повторяются, средние часто совпадают
+    rng = np.random.default_rng(seed)
+    records = {f'FIGI{i}': synthetic_candles(days=3, seed=seed * 100 + i, price=1.0) for i in range(8)}
+    ties = 0
+    for _ in range(10):
+        # у части инструментов истории меньше окна медленной МА
+        candles = CandleSet.from_records({figi: r[:rng.integers(2, len(r))] for figi, r in records.items()},
+                                         precision='f8')
+        windows = np.array([WINDOWS[k] for k in rng.integers(0, len(WINDOWS), len(records))])
+        panel = close_panel(candles, candles.figis, int(windows.max()) + 1)
+        signals = ma_crossover(panel, windows[:, 0], windows[:, 1])
+
+        for j, figi in enumerate(candles.figis):
+            to_buy, signal, tie = ma_indicator_last(candles.column(figi, 'close')[:-1], *windows[j])
+            assert (signals['to_buy'][j], signals['signal'][j]) == (to_buy, signal), (figi, windows[j])
+            ties += tie
+    assert ties > 0  # проверка покрывает совпадение средних
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip('tinkoff.invest')
+
+from grpc import StatusCode  # noqa: E402
+from tinkoff.invest.exceptions import RequestError  # noqa: E402
+
+from ti_client import TIClient  # noqa: E402
+
+
+def make_client():
+    client = TIClient('token', backoff=0.0)
+    client._services = object()  # запросы выполняются без подключения к API
+    return client
+
+
+def failing(code, errors):
+    """
+    Запрос, который errors раз завершается ошибкой code, затем выполняется
+    :return: (fn, list) - запрос и список его вызовов
+    """
+    calls = []
+
+    def fn(services):
+        calls.append(services)
+        if len(calls) <= errors:
+            raise RequestError(code, 'error', None)
+        return 'ok'
+    return fn, calls
+
+
+def test_idempotent_call_is_retried():
+    fn, calls = failing(StatusCode.DEADLINE_EXCEEDED, 2)
+    assert make_client().call(fn, group='orders') == 'ok'
+    assert len(calls) == 3
+
+
+def test_non_idempotent_call_is_not_retried():
+    fn, calls = failing(StatusCode.DEADLINE_EXCEEDED, 2)
+    with pytest.raises(RequestError):
+        make_client().call(fn, group='stop_orders', idempotent=False)
+    assert len(calls) == 1
+
+
+def test_non_idempotent_call_is_retried_after_throttling():
+    fn, calls = failing(StatusCode.RESOURCE_EXHAUSTED, 1)
+    assert make_client().call(fn, group='stop_orders', idempotent=False) == 'ok'
+    assert len(calls) == 2
@@ -0,0 +1,80 @@
+import pytest
+
+pytest.importorskip('tinkoff.invest')
+
+from account_state import AccountSnapshot  # noqa: E402
+from replay import ReplayServices, make_share, synthetic_candles  # noqa: E402
+from risk import trailing_stops  # noqa: E402
+from state_store import StateStore  # noqa: E402
+from ti_client import FakeClient  # noqa: E402
+from trading_strategies import ma_execute  # noqa: E402
+
+FIGI = 'FIGI0'
+
+
+@pytest.fixture
+def services():
+    return ReplayServices({FIGI: synthetic_candles(days=1)}, [make_share(FIGI, 'SBER', lot=10)])
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # без yaml-файлов рабочего каталога
+    state = StateStore(str(tmp_path / 'trading_state.db'))
+    yield state
+    state.close()
+
+
+def make_signal(to_buy, signal=0, cur_close=100.0):
+    return {'tick': 'SBER', 'figi': FIGI, 'lot': 10, 'stop_loss_lvl': 0.01, 'round_features': (2, 0.01),
+            'to_buy': to_buy, 'signal': signal, 'cur_close': cur_close, 'size': 100, 'min_ma': 12, 'max_ma': 24}
+
+
+def execute(ma_sig, services, state):
+    client = FakeClient(services)
+    ma_execute(ma_sig, 'acc', client=client, snapshot=AccountSnapshot(client, account_id='acc'), state=state)
+
+
+def post_stop(services, order_type):
+    return services.stop_orders.post_stop_order(stop_order_type=order_type).stop_order_id
+
+
+def test_stops_cancelled_when_position_is_gone(services, state):
+    ids = {'stop_order_id': post_stop(services, 'stop_loss'),
+           'take_profit_order_id': post_stop(services, 'take_profit')}
+    state.set_position('SBER', {'lots': 1, 'price': 100.0, 'stop_loss': 99.0, 'take_profit': 105.0, **ids})
+
+    execute(make_signal(to_buy=1), services, state)  # бумаг на счете нет - стоп уже сработал
+
+    assert sorted(services.cancelled_stop_orders) == sorted(ids.values())
+    assert state.get_position('SBER') is None
+
+
+def test_missing_stop_does_not_block_other_cancels(services, state):
+    take_profit_id = post_stop(services, 'take_profit')
+    state.set_position('SBER', {'lots': 1, 'price': 100.0, 'stop_loss': 99.0, 'take_profit': 105.0,
+                                'stop_order_id': 'executed', 'take_profit_order_id': take_profit_id})
+
+    execute(make_signal(to_buy=0), services, state)
+
+    assert services.cancelled_stop_orders == [take_profit_id]
+    assert state.get_position('SBER') is None
+
+
+def test_failed_stop_loss_is_reposted_by_next_risk_pass(services, state):
+    post_stop_order = services.stop_orders.post_stop_order
+
+    def reject_stop_loss(**kwargs):
+        if 'STOP_LOSS' in str(kwargs['stop_order_type']):
+            raise RuntimeError('stop order rejected')
+        return post_stop_order(**kwargs)
+
+    services.stop_orders.post_stop_order = reject_stop_loss
+    ma_sig = make_signal(to_buy=1, signal=1)
+    execute(ma_sig, services, state)
+
+    position = state.get_position('SBER')
+    assert len(services.posted_orders) == 1
+    assert position['stop_loss'] == 0.0 and position.get('stop_order_id') is None
+    updates = trailing_stops({'SBER': ma_sig}, state.positions)
+    assert [update.level for update in updates] == [99.0]
@@ -0,0 +1,221 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from grpc import StatusCode
+from tinkoff.invest import Client
+from tinkoff.invest.exceptions import RequestError
+
+from latency import recorder
+
+# ошибки, после которых имеет смысл переподключиться и повторить запрос
+RETRY_CODES = {StatusCode.UNAVAILABLE, StatusCode.DEADLINE_EXCEEDED, StatusCode.INTERNAL}
+
+
+def error_code(error):
+    """
+    Код ошибки gRPC: у RequestError это атрибут, у grpc.RpcError - метод
+    """
+    code = getattr(error, 'code', None)
+    return code() if callable(code) else code
+
+
+# приоритеты запросов: меньше - раньше получает токен в своей группе
+PRIORITY_ORDERS = 0  # выставление заявок
+PRIORITY_DEFAULT = 1  # данные для текущего решения (текущая свеча, портфель)
+PRIORITY_HISTORY = 2  # загрузка истории
+
+# квоты API на запросы в минуту по группам методов (с запасом относительно лимитов)
+API_LIMITS = {
+    'market_data': 500,
+    'operations': 180,
+    'orders': 90,
+    'stop_orders': 45,
+    'instruments': 180,
+}
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов (token bucket): не более rate запросов в секунду,
+    допускается всплеск до burst запросов. Ожидающие запросы получают токены по приоритету,
+    при равном приоритете - в порядке очереди. Потокобезопасен
+    :param rate: float - запросов в секунду
+    :param burst: int - размер всплеска
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters = []  # куча (приоритет, номер)
+        self._seq = itertools.count()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, group=None, priority=PRIORITY_DEFAULT, cost=1):
+        """
+        Ждет, пока не появится свободный токен
+        :param group: не используется (одна группа), для совместимости с RateScheduler
+        :param priority: int - приоритет запроса
+        :param cost: int - кол-во запросов к API (при cost > burst баланс уходит в минус)
+        :return: float - время ожидания, сек
+        """
+        start = time.monotonic()
+        need = min(cost, self.burst)
+        with self._cond:
+            me = (priority, next(self._seq))
+            heapq.heappush(self._waiters, me)
+            while True:
+                self._refill()
+                if self._waiters[0] == me and self._tokens >= need:
+                    heapq.heappop(self._waiters)
+                    self._tokens -= cost
+                    self._cond.notify_all()
+                    return time.monotonic() - start
+                # ждем токен или уход запроса с более высоким приоритетом
+                self._cond.wait(max(need - self._tokens, 0) / self.rate or None)
+
+
+class RateScheduler:
+    """
+    Планировщик запросов к API: отдельный token bucket на каждую группу методов (квоты API считаются
+    по сервисам), внутри группы заявки обслуживаются раньше загрузки истории.
+    Время ожидания в очереди записывается в latency.recorder (этап queue_wait.<группа>)
+    :param limits: dict - {группа: запросов в минуту}
+    :param burst: float - размер всплеска, доля от минутной квоты
+    """
+
+    def __init__(self, limits=API_LIMITS, burst=0.05):
+        self.limiters = {group: RateLimiter(per_minute / 60, max(1, int(per_minute * burst)))
+                         for group, per_minute in limits.items()}
+
+    def acquire(self, group=None, priority=PRIORITY_DEFAULT, cost=1):
+        """
+        :param group: str - группа методов (None или неизвестная группа - без ограничения)
+        :return: float - время ожидания, сек
+        """
+        limiter = self.limiters.get(group)
+        if limiter is None:
+            return 0.0
+        waited = limiter.acquire(priority=priority, cost=cost)
+        recorder.record(f'queue_wait.{group}', waited)
+        return waited
+
+
+class TIClient:
+    """
+    Долгоживущее подключение к API: один gRPC-канал на все вызовы ti_functional.
+    При обрыве связи канал пересоздается, запрос повторяется с экспоненциальной задержкой
+    :param token: str - токен API
+    :param retries: int - кол-во повторов запроса
+    :param backoff: float - начальная задержка перед повтором, сек
+    :param max_backoff: float - максимальная задержка перед повтором, сек
+    :param rate_limiter: RateScheduler / RateLimiter - ограничение частоты запросов (None - без ограничения)
+    :param client_kwargs: параметры tinkoff.invest.Client (target, app_name, ...)
+    """
+
+    def __init__(self, token, retries=3, backoff=0.5, max_backoff=10.0, rate_limiter=None, **client_kwargs):
+        self.token = token
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.client_kwargs = client_kwargs
+        self._lock = threading.Lock()
+        self._client = None
+        self._services = None
+
+    def connect(self):
+        """
+        Открывает канал (если еще не открыт)
+        :return: Services - сервисы API
+        """
+        with self._lock:
+            if self._services is None:
+                self._client = Client(self.token, **self.client_kwargs)
+                self._services = self._client.__enter__()
+            return self._services
+
+    def close(self, services=None):
+        """
+        Закрывает канал. Если передан services, канал закрывается только если он еще текущий
+        (другой поток мог уже переподключиться)
+        """
+        with self._lock:
+            if self._client is None or (services is not None and services is not self._services):
+                return
+            client, self._client, self._services = self._client, None, None
+        client.__exit__(None, None, None)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def call(self, fn, group=None, priority=PRIORITY_DEFAULT, cost=1, idempotent=True):
+        """
+        Выполняет запрос fn(services) с переподключением и повторами при обрыве связи.
+        При превышении квоты (RESOURCE_EXHAUSTED) запрос повторяется после сброса лимита
+        (ratelimit_reset из ответа) со случайным разбросом, чтобы потоки не повторяли запросы одновременно
+        :param fn: callable(Services) - запрос к API
+        :param group: str - группа методов для планировщика (API_LIMITS)
+        :param priority: int - приоритет запроса (PRIORITY_ORDERS / PRIORITY_DEFAULT / PRIORITY_HISTORY)
+        :param cost: int - кол-во запросов к API внутри fn
+        :param idempotent: bool - можно ли повторять запрос после обрыва связи. False - для запросов без ключа
+                           идемпотентности (стоп-заявки): сервер мог уже выполнить запрос, поэтому ошибка
+                           возвращается вызывающему, повторяется только отказ по квоте
+        :return: результат fn
+        """
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            services = self.connect()
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(group=group, priority=priority, cost=cost)
+            try:
+                return fn(services)
+            except RequestError as e:
+                throttled = e.code == StatusCode.RESOURCE_EXHAUSTED
+                if attempt == self.retries or not (throttled or idempotent and e.code in RETRY_CODES):
+                    if e.code in RETRY_CODES:
+                        self.close(services)  # следующий запрос откроет канал заново
+                    raise
+                if throttled:  # канал исправен, переподключаться не нужно
+                    pause = (getattr(e.metadata, 'ratelimit_reset', None) or delay) * random.uniform(1.0, 1.5)
+                    recorder.record(f'resource_exhausted.{group}', pause)
+                    time.sleep(pause)
+                    continue
+            self.close(services)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, self.max_backoff)
+
+
+class FakeClient:
+    """
+    Подменяет TIClient в тестах: запросы выполняются на переданном объекте services без сети
+    :param services: объект с интерфейсом tinkoff.invest.Services (market_data, orders, operations, ...)
+    """
+
+    def __init__(self, services):
+        self.services = services
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def close(self, services=None):
+        pass
+
+    def call(self, fn, group=None, priority=PRIORITY_DEFAULT, cost=1, idempotent=True):
+        return fn(self.services)
@@ -1,17 +1,85 @@
 import pandas as pd
 import numpy as np
-import talib
 from datetime import datetime, timedelta
 
-from tinkoff.invest import Client, CandleInterval, InstrumentIdType, Quotation, schemas, OrderDirection,\
+from tinkoff.invest import CandleInterval, InstrumentIdType, schemas, OrderDirection,\
                             StopOrderDirection, StopOrderExpirationType, StopOrderType
-import yaml
-import pytz
-import lock_info
+import threading
+import uuid
+import price_math as pm
+from ti_client import TIClient, RateScheduler, PRIORITY_ORDERS, PRIORITY_DEFAULT, PRIORITY_HISTORY
+from latency import timed
 
 CONTRACT_PREFIX = "tinkoff.public.invest.api.contract.v1."
-main_account_id = lock_info.main_account_id
-TOKEN = lock_info.token
+
+# свеча: время начала (нс, UTC), OHLC, объем
+CANDLE_DTYPE = np.dtype([('time', 'i8'), ('open', 'f8'), ('close', 'f8'), ('high', 'f8'), ('low', 'f8'),
+                         ('volume', 'i8')])
+
+# максимальный период одного запроса свечей GetCandles: get_all_candles разбивает период на такие запросы
+CANDLE_REQUEST_PERIOD = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: timedelta(days=1),
+    CandleInterval.CANDLE_INTERVAL_5_MIN: timedelta(days=1),
+    CandleInterval.CANDLE_INTERVAL_15_MIN: timedelta(days=1),
+    CandleInterval.CANDLE_INTERVAL_HOUR: timedelta(days=7),
+    CandleInterval.CANDLE_INTERVAL_DAY: timedelta(days=365),
+}
+
+# относительный допуск сравнения скользящих средних: на ценах, кратных шагу цены, средние часто равны и
+# отличаются только ошибкой округления float, а настоящая разница средних на порядки больше допуска
+MA_TIE_TOLERANCE = 1e-9
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_lock_info(required=True):
+    """
+    Токен и счет из lock_info.py. Модуль импортируется при первом обращении к API,
+    поэтому бэктесты, replay и ноутбуки работают без файла с токеном
+    :param required: bool - ImportError при отсутствии lock_info.py (False - None)
+    """
+    try:
+        import lock_info
+    except ImportError:
+        if required:
+            raise
+        return None
+    return lock_info
+
+
+def get_account_id(account_id=None):
+    """
+    Счет для запросов: переданный или main_account_id из lock_info ('' без lock_info - для подменного клиента)
+    """
+    if account_id:
+        return account_id
+    lock_info = get_lock_info(required=False)
+    return lock_info.main_account_id if lock_info is not None else ''
+
+
+def __getattr__(name):
+    # прежние атрибуты модуля tif.main_account_id / tif.TOKEN читаются из lock_info при обращении
+    if name == 'main_account_id':
+        return get_account_id()
+    if name == 'TOKEN':
+        return get_lock_info().token
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def get_client(client=None):
+    """
+    Возвращает переданный клиент или общий для модуля TIClient (создается при первом обращении)
+    :param client: TIClient/FakeClient или None
+    :return: клиент с методом call(fn)
+    """
+    global _client
+    if client is not None:
+        return client
+    with _client_lock:
+        if _client is None:
+            _client = TIClient(get_lock_info().token, rate_limiter=RateScheduler())  # квоты по группам методов API
+    return _client
 
 
 def money_to_val(value):
@@ -20,50 +88,51 @@ def money_to_val(value):
     :param value: Quotation
     :return: float
     """
-    return value.units + value.nano / 1e9
+    return pm.to_float(value.units, value.nano)
 
 
 def money_to_val_r(value, rnd=10):
     """
-    Переводит и возвращает цену из формата float в Quotation
-    :param rnd: int - decimal
+    Переводит и возвращает цену из формата float в Quotation (с точностью до nano)
+    :param rnd: int - не используется, оставлен для совместимости
     :param value: float - price
     :return: Quotation
     """
-    units, nano = (map(int, str(float(value)).split('.')))
-    nano = int(round((value - units), rnd) * 1e9)
-    return Quotation(units, nano)
+    return pm.to_quotation(value)
 
 
-def price_features(nano):
+def price_features(nano, units=0):
     """
-    Возвращает для тикера свойства округления:
-    nano: int - цена после запятой, по ней определяется уровень и база округления
+    Возвращает для тикера свойства округления по шагу цены (units, nano):
     n_dec: кол-во знаков после запятой 
     base: база округления
     """
-    n_dec = 10 - len(str(nano))
-    base = int(str(nano)[0]) / 10 ** n_dec
-    return (n_dec, base)
+    return pm.price_features(nano, units)
 
 
 def trade_round(price, n_dec=10, base=0.01):
     """
     Округляет по полученной базе (base) до n_dec чисел после запятой 
     """
-    return round(base * round(float(price) / base), n_dec)
+    return round(pm.round_to_step(price, base) / pm.NANO, n_dec)
 
 
-def calc_num_lots_for_buy(lot, cur_close, perc=0.2):
+def calc_num_lots_for_buy(lot, cur_close, perc=0.2, client=None, snapshot=None):
     """
     Расчет лота (суммы) под сделку
     :param lot: int - лотность инструмента
     :param cur_close: float - текущая цена инструмента
     :param perc: float - доля от всего портфеля, выделенная под покупку
+    :param client: TIClient - клиент API (None - общий клиент модуля)
+    :param snapshot: AccountSnapshot - снимок счета (None - запрос баланса и позиций из API)
     :return:
     """
-    available_sum = get_available_balance()['rub']  # свободная сумма
-    cur_cost_positions = get_current_positions().cur_pos_price.values.sum()  # текущие позиции
+    if snapshot is not None:
+        available_sum = snapshot.available('rub')  # свободная сумма
+        cur_cost_positions = snapshot.positions_cost()  # текущие позиции
+    else:
+        available_sum = get_available_balance(client=client)['rub']  # свободная сумма
+        cur_cost_positions = get_current_positions(client=client).cur_pos_price.values.sum()  # текущие позиции
     account_cost = available_sum + cur_cost_positions  # оценочная стоимость портфеля
 
     sum_deal = min(account_cost * perc, available_sum)  # выделенная под покупку сумма
@@ -73,7 +142,9 @@ def calc_num_lots_for_buy(lot, cur_close, perc=0.2):
     return int(num_lots_deal)
 
 
-def order(figi, lots, price, account_id, round_features, direction, order_type):
+@timed()
+def order(figi, lots, price, account_id, round_features, direction, order_type, client=None, snapshot=None,
+          lot=1, order_id=None):
     """
     Выставляет ордер на покупку/продажу по лимитной/рыночной ценам
     :param figi: str - индентификатор инстумента
@@ -83,9 +154,13 @@ def order(figi, lots, price, account_id, round_features, direction, order_type):
     :param round_features: (int, float)- свойства для округления цен
     :param direction: str - направление заявки (покупка/продажа)
     :param order_type: str - тип заявки (по рыночной/лимитной цене)
+    :param client: TIClient - клиент API (None - общий клиент модуля)
+    :param snapshot: AccountSnapshot - снимок счета, обновляется после выставления заявки
+    :param lot: int - лотность инструмента (для обновления снимка счета)
+    :param order_id: str - идентификатор заявки (None - новый uuid), при повторах запроса не меняется
     :return: request from client.orders.post_order
     """
-    price_quotation = money_to_val_r(trade_round(price, *round_features))
+    price_quotation = pm.round_quotation(price, round_features[1])
 
     if direction == 'buy':
         direction_order = OrderDirection.ORDER_DIRECTION_BUY
@@ -94,27 +169,31 @@ def order(figi, lots, price, account_id, round_features, direction, order_type):
 
     if order_type == 'market':
         ord_type = schemas.OrderType.ORDER_TYPE_MARKET
-        price = None
     elif order_type == 'limit':
         ord_type = schemas.OrderType.ORDER_TYPE_LIMIT
 
-    order_id = figi + '-' + datetime.utcnow().strftime('%d.%m %H:%M')
+    if order_id is None:
+        order_id = str(uuid.uuid4())
 
-    with Client(TOKEN) as client:
-        r = client.orders.post_order(
-            figi=figi,
-            quantity=lots,
-            price=price_quotation,
-            direction=direction_order,
-            account_id=account_id,
-            order_type=ord_type,
-            order_id=order_id
-        )
+    r = get_client(client).call(lambda services: services.orders.post_order(
+        figi=figi,
+        quantity=lots,
+        price=price_quotation,
+        direction=direction_order,
+        account_id=account_id,
+        order_type=ord_type,
+        order_id=order_id
+    ), group='orders', priority=PRIORITY_ORDERS)
 
     print(r)
 
+    if snapshot is not None:
+        snapshot.apply_order(figi, lots * lot, trade_round(price, *round_features), direction)
+    return r
 
-def stop_order(figi, lots, price, account_id, round_features, direction, order_type):
+
+@timed()
+def stop_order(figi, lots, price, account_id, round_features, direction, order_type, client=None):
     """
     Выставляет ордер на покупку/продажу по stop_loss/take_profit
     :param figi: str - индентификатор инстумента
@@ -124,11 +203,11 @@ def stop_order(figi, lots, price, account_id, round_features, direction, order_t
     :param round_features: (int, float)- свойства для округления цен
     :param direction: str - направление заявки (покупка/продажа)
     :param order_type: order_type: str - тип заявки (stop_loss/take_profit)
-    :return:
+    :param client: TIClient - клиент API (None - общий клиент модуля)
+    :return: request from client.stop_orders.post_stop_order
     """
-    price_stop_acivation_quotation = money_to_val_r(
-        trade_round(price, *round_features))  # Цена активации стоп-заявки
-    price_quotation = money_to_val_r(trade_round(price * 0.97, *round_features))  # продавать по цене ниже стопа
+    price_stop_acivation_quotation = pm.round_quotation(price, round_features[1])  # Цена активации стоп-заявки
+    price_quotation = pm.round_quotation(price * 0.97, round_features[1])  # продавать по цене ниже стопа
 
     if direction == 'buy':
         direction_order = StopOrderDirection.STOP_ORDER_DIRECTION_BUY
@@ -144,19 +223,33 @@ def stop_order(figi, lots, price, account_id, round_features, direction, order_t
 
     print(figi, lots, price_quotation, price_stop_acivation_quotation, direction_order, account_id, exp_type, ord_type)
 
-    with Client(TOKEN) as client:
-
-        r = client.stop_orders.post_stop_order(
-            figi=figi,
-            quantity=lots,
-            price=price_quotation,
-            stop_price=price_stop_acivation_quotation,
-            direction=direction_order,
-            account_id=account_id,
-            expiration_type=exp_type,
-            stop_order_type=ord_type
-        )
+    r = get_client(client).call(lambda services: services.stop_orders.post_stop_order(
+        figi=figi,
+        quantity=lots,
+        price=price_quotation,
+        stop_price=price_stop_acivation_quotation,
+        direction=direction_order,
+        account_id=account_id,
+        expiration_type=exp_type,
+        stop_order_type=ord_type
+    ), group='stop_orders', priority=PRIORITY_ORDERS, idempotent=False)
     print(r)
+    return r
+
+
+@timed()
+def cancel_stop_order(stop_order_id, account_id, client=None):
+    """
+    Отменяет стоп-заявку
+    :param stop_order_id: str - идентификатор стоп-заявки (ответ post_stop_order)
+    :param account_id: str - номер счета
+    :param client: TIClient - клиент API (None - общий клиент модуля)
+    :return: request from client.stop_orders.cancel_stop_order
+    """
+    return get_client(client).call(lambda services: services.stop_orders.cancel_stop_order(
+        account_id=account_id,
+        stop_order_id=stop_order_id
+    ), group='stop_orders', priority=PRIORITY_ORDERS, idempotent=False)
 
 
 def save_yaml(to_yaml, file_name):
@@ -166,6 +259,8 @@ def save_yaml(to_yaml, file_name):
     :param file_name:
     :return:
     """
+    import yaml
+
     with open(f'{file_name}.yaml', 'w') as f:
         yaml.dump(to_yaml, f, default_flow_style=False)
 
@@ -176,105 +271,184 @@ def load_yaml(file_name):
     :param file_name: str
     :return:  загруженный yaml-файл
     """
+    import yaml
+
     with open(f'{file_name}.yaml') as f:
         params = yaml.safe_load(f)
     return params
 
 
-def get_historical_info(figi, candle_interval=CandleInterval.CANDLE_INTERVAL_15_MIN, days=160):
-    timezone = pytz.timezone("Europe/Moscow")
-    hist = pd.DataFrame()
-
-    with Client(TOKEN) as client:
-        for candle in client.get_all_candles(
-                figi=figi,
-                from_=datetime.now() - timedelta(days=days),
-                to=datetime.now(),
-                interval=candle_interval,
-        ):
-            hist_dict = {'figi': [figi],
-                         'open': [money_to_val(candle.open)],
-                         'close': [money_to_val(candle.close)],
-                         'high': [money_to_val(candle.high)],
-                         'low': [money_to_val(candle.low)],
-                         'value': [np.mean([money_to_val(candle.open), money_to_val(candle.close),
-                                            money_to_val(candle.high), money_to_val(candle.low)]) * candle.volume],
-                         'volume': [candle.volume],
-                         'begin': [candle.time.astimezone(timezone).strftime('%Y-%m-%d %H:%M:%S')],
-                         }
-
-            hist = pd.concat((hist, pd.DataFrame.from_dict(hist_dict)), axis=0)
-
-    hist = hist.sort_values(by='begin').drop_duplicates()
-
-    return hist.reset_index(drop=True)
-
-
-def get_main_stock_info(stocks, id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_TICKER, class_code='TQBR'):
-    stock_info = pd.DataFrame()
+def candles_to_records(candles):
+    """
+    Собирает свечи в структурированный массив CANDLE_DTYPE: units/nano всех OHLC складываются
+    в один int64-массив и переводятся в float одной операцией, время - int64 (нс, UTC)
+    :param candles: iterable of HistoricCandle
+    :return: np.ndarray, отсортированный по времени, без повторов
+    """
+    raw, times = [], []
+    for candle in candles:
+        raw.append((candle.open.units, candle.open.nano, candle.close.units, candle.close.nano,
+                    candle.high.units, candle.high.nano, candle.low.units, candle.low.nano,
+                    candle.volume))
+        times.append(candle.time)
 
-    with Client(TOKEN) as client:
-        for stock in stocks:
-            ticker_info = client.instruments.share_by(id_type=id_type,
-                                                      class_code=class_code,
-                                                      id=stock)
-
-            stock_dict = {'figi': [ticker_info.instrument.figi],
-                          'ticker': [ticker_info.instrument.ticker],
-                          'name': [ticker_info.instrument.name],
-                          #                           'last_price': [np.nan],
-                          'lot': [ticker_info.instrument.lot],
-                          'currency': [ticker_info.instrument.currency],
-                          'class_code': [ticker_info.instrument.class_code],
-                          'country_of_risk': [ticker_info.instrument.country_of_risk],
-                          'sector': [ticker_info.instrument.sector],
-                          'exchange': [ticker_info.instrument.exchange],
-                          'min_price_step': [ticker_info.instrument.min_price_increment],
-                          'buy_available_flag': [int(ticker_info.instrument.buy_available_flag)],
-                          'sell_available_flag': [int(ticker_info.instrument.sell_available_flag)],
-                          'short_enabled_flag': [int(ticker_info.instrument.short_enabled_flag)],
-                          'api_trade_available_flag': [int(ticker_info.instrument.api_trade_available_flag)],
-                          }
-
-            stock_info = pd.concat((stock_info, pd.DataFrame.from_dict(stock_dict)), axis=0)
+    raw = np.array(raw, dtype=np.int64).reshape(-1, 9)
+    prices = pm.quotations_to_float(raw[:, 0:8:2], raw[:, 1:8:2])  # open, close, high, low
 
-    return stock_info.reset_index(drop=True)
+    records = np.empty(raw.shape[0], dtype=CANDLE_DTYPE)
+    records['time'] = pd.to_datetime(times, utc=True).values.astype('datetime64[ns]').astype(np.int64)
+    records['open'], records['close'], records['high'], records['low'] = prices.T
+    records['volume'] = raw[:, 8]
+
+    return sort_records(records)
 
 
-def get_current_positions():
+def sort_records(records):
     """
-    Получение информации по открытым позициям
+    Сортирует свечи по времени, из повторяющихся по времени оставляет последнюю
+    :param records: np.ndarray CANDLE_DTYPE
+    :return: np.ndarray CANDLE_DTYPE
+    """
+    if len(records) == 0:
+        return records
+    records = records[np.argsort(records['time'], kind='stable')]
+    keep = np.append(records['time'][1:] != records['time'][:-1], True)
+    return records[keep]
+
+
+def records_to_frame(figi, records):
+    """
+    Переводит массив свечей в DataFrame в формате get_historical_info
+    :param figi: str - индентификатор инстумента
+    :param records: np.ndarray CANDLE_DTYPE
+    :return: pd.DataFrame (figi, open, close, high, low, value, volume, begin),
+             figi - категория, begin - datetime64 (МСК)
+    """
+    prices = np.column_stack([records['open'], records['close'], records['high'], records['low']])
+    begin = pd.to_datetime(records['time'], utc=True).tz_convert('Europe/Moscow').tz_localize(None)
+
+    hist = pd.DataFrame({'figi': pd.Categorical.from_codes(np.zeros(len(records), dtype=np.int8), [figi]),
+                         'open': records['open'],
+                         'close': records['close'],
+                         'high': records['high'],
+                         'low': records['low'],
+                         'value': prices.mean(axis=1) * records['volume'],
+                         'volume': records['volume'],
+                         'begin': begin,
+                         })
+    return hist
+
+
+@timed()
+def get_candles(figi, from_, to, candle_interval=CandleInterval.CANDLE_INTERVAL_15_MIN, client=None,
+                priority=PRIORITY_HISTORY):
+    """
+    Загружает свечи по инструменту за период [from_, to]
+    :param figi: str - индентификатор инстумента
+    :param from_: datetime - начало периода
+    :param to: datetime - конец периода
+    :param candle_interval: CandleInterval - интервал свечей
+    :param client: TIClient - клиент API (None - общий клиент модуля)
+    :param priority: int - приоритет запроса в планировщике (по умолчанию - загрузка истории)
+    :return: np.ndarray CANDLE_DTYPE
+    """
+    cost = max(1, -(-(to - from_) // CANDLE_REQUEST_PERIOD[CandleInterval(candle_interval)]))  # кол-во GetCandles
+    return get_client(client).call(lambda services: candles_to_records(services.get_all_candles(
+        figi=figi,
+        from_=from_,
+        to=to,
+        interval=candle_interval,
+    )), group='market_data', priority=priority, cost=cost)
+
+
+def get_historical_info(figi, candle_interval=CandleInterval.CANDLE_INTERVAL_15_MIN, days=160, client=None):
+    """
+    Загружает исторические свечи по инструменту за последние days дней
+    :param figi: str - индентификатор инстумента
+    :param candle_interval: CandleInterval - интервал свечей
+    :param days: int - глубина истории в днях
+    :param client: TIClient - клиент API (None - общий клиент модуля)
+    :return: pd.DataFrame, begin - datetime64 (московское время)
     """
+    records = get_candles(figi, datetime.now() - timedelta(days=days), datetime.now(), candle_interval, client)
+    return records_to_frame(figi, records)
+
+
+@timed()
+def get_main_stock_info(stocks, id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_TICKER, class_code='TQBR',
+                        client=None):
+    stock_info = pd.DataFrame()
+    client = get_client(client)
+
+    for stock in stocks:
+        ticker_info = client.call(lambda services: services.instruments.share_by(id_type=id_type,
+                                                                                  class_code=class_code,
+                                                                                  id=stock),
+                                  group='instruments')
+
+        stock_dict = {'figi': [ticker_info.instrument.figi],
+                      'ticker': [ticker_info.instrument.ticker],
+                      'name': [ticker_info.instrument.name],
+                      #                           'last_price': [np.nan],
+                      'lot': [ticker_info.instrument.lot],
+                      'currency': [ticker_info.instrument.currency],
+                      'class_code': [ticker_info.instrument.class_code],
+                      'country_of_risk': [ticker_info.instrument.country_of_risk],
+                      'sector': [ticker_info.instrument.sector],
+                      'exchange': [ticker_info.instrument.exchange],
+                      'min_price_step': [ticker_info.instrument.min_price_increment],
+                      'buy_available_flag': [int(ticker_info.instrument.buy_available_flag)],
+                      'sell_available_flag': [int(ticker_info.instrument.sell_available_flag)],
+                      'short_enabled_flag': [int(ticker_info.instrument.short_enabled_flag)],
+                      'api_trade_available_flag': [int(ticker_info.instrument.api_trade_available_flag)],
+                      }
+
+        stock_info = pd.concat((stock_info, pd.DataFrame.from_dict(stock_dict)), axis=0)
 
-    with Client(TOKEN) as client:
-        portfolio = client.operations.get_portfolio(account_id=main_account_id)
+    return stock_info.reset_index(drop=True)
 
-        curr_positions = pd.DataFrame([{
-            'figi': p.figi,
-            'instrument_type': p.instrument_type,
-            'quantity': int(money_to_val(p.quantity)),
-            'avg_price': money_to_val(p.average_position_price),
-            'cur_pos_price': money_to_val(p.quantity) * money_to_val(p.average_position_price) + money_to_val(
-                p.expected_yield),
-            'expected_yield': money_to_val(p.expected_yield),
-            'currency': p.average_position_price.currency,
-        } for p in portfolio.positions])
 
-        if curr_positions.shape[0] > 0:
-            curr_positions['position_direction'] = curr_positions.quantity.apply(lambda x: 'long' if x > 0 else 'short')
-        else:
-            curr_positions = pd.DataFrame(columns=['figi', 'cur_pos_price'])
+@timed()
+def get_current_positions(client=None, account_id=None):
+    """
+    Получение информации по открытым позициям
+    :param client: TIClient - клиент API (None - общий клиент модуля)
+    :param account_id: str - счет (None - main_account_id из lock_info)
+    """
+    account_id = get_account_id(account_id)
+    portfolio = get_client(client).call(lambda services: services.operations.get_portfolio(account_id=account_id),
+                                        group='operations')
+
+    curr_positions = pd.DataFrame([{
+        'figi': p.figi,
+        'instrument_type': p.instrument_type,
+        'quantity': int(money_to_val(p.quantity)),
+        'avg_price': money_to_val(p.average_position_price),
+        'cur_pos_price': money_to_val(p.quantity) * money_to_val(p.average_position_price) + money_to_val(
+            p.expected_yield),
+        'expected_yield': money_to_val(p.expected_yield),
+        'currency': p.average_position_price.currency,
+    } for p in portfolio.positions])
+
+    if curr_positions.shape[0] > 0:
+        curr_positions['position_direction'] = curr_positions.quantity.apply(lambda x: 'long' if x > 0 else 'short')
+    else:
+        curr_positions = pd.DataFrame(columns=['figi', 'cur_pos_price'])
 
     return curr_positions
 
 
-def get_available_balance():
+@timed()
+def get_available_balance(client=None, account_id=None):
     """
     Возвращает информацию по доступным денежным средствам
     Наименование валюты: сумма (Например {'rub': 11770.18})
+    :param client: TIClient - клиент API (None - общий клиент модуля)
+    :param account_id: str - счет (None - main_account_id из lock_info)
     """
-    with Client(TOKEN) as client:
-        cur_bal = client.operations.get_positions(account_id=main_account_id).money
+    account_id = get_account_id(account_id)
+    cur_bal = get_client(client).call(
+        lambda services: services.operations.get_positions(account_id=account_id).money, group='operations')
 
     balance = {}
 
@@ -283,32 +457,36 @@ def get_available_balance():
     return balance
 
 
-def get_current_candle_1h(figi, candle_interval=CandleInterval.CANDLE_INTERVAL_HOUR):
+@timed()
+def get_current_candle_1h(figi, candle_interval=CandleInterval.CANDLE_INTERVAL_HOUR, client=None):
     """
     Берем информацию по текущей свече для конкретной бумаги, 
     для принятия окончательного решения на открытие /закрытие позиции 
     или установки новых take_profit / stop_loss
     """
     curr_candle = None
+    import pytz
+
     timezone = pytz.timezone("Europe/Moscow")
 
-    with Client(TOKEN) as client:
-        for candle in client.get_all_candles(
-                figi=figi,
-                from_=datetime.now() - timedelta(hours=1),
-                to=datetime.now(),
-                interval=candle_interval,
-        ):
-            curr_candle = {'figi': figi,
-                           'open': money_to_val(candle.open),
-                           'close': money_to_val(candle.close),
-                           'high': money_to_val(candle.high),
-                           'low': money_to_val(candle.low),
-                           'begin': candle.time.astimezone(timezone).strftime('%Y-%m-%d %H:%M:%S')
-                           }
-            # проверка на соответствие данных последнему часу
-            # cur_hour = datetime.now().replace(minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S')
-            # assert curr_candle['begin'] == cur_hour, 'The last time of the candle is different from the current value'
+    candles = get_client(client).call(lambda services: list(services.get_all_candles(
+        figi=figi,
+        from_=datetime.now() - timedelta(hours=1),
+        to=datetime.now(),
+        interval=candle_interval,
+    )), group='market_data', priority=PRIORITY_DEFAULT)
+
+    for candle in candles:
+        curr_candle = {'figi': figi,
+                       'open': money_to_val(candle.open),
+                       'close': money_to_val(candle.close),
+                       'high': money_to_val(candle.high),
+                       'low': money_to_val(candle.low),
+                       'begin': candle.time.astimezone(timezone).strftime('%Y-%m-%d %H:%M:%S')
+                       }
+        # проверка на соответствие данных последнему часу
+        # cur_hour = datetime.now().replace(minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S')
+        # assert curr_candle['begin'] == cur_hour, 'The last time of the candle is different from the current value'
 
     if not curr_candle:
         raise RuntimeError('func: get_current_candle_1h - Current candle does not exist!')
@@ -316,35 +494,48 @@ def get_current_candle_1h(figi, candle_interval=CandleInterval.CANDLE_INTERVAL_H
     return curr_candle
 
 
-def get_current_candle_15m(figi, candle_interval=CandleInterval.CANDLE_INTERVAL_15_MIN):
+@timed()
+def get_current_candle_15m(figi, candle_interval=CandleInterval.CANDLE_INTERVAL_15_MIN, client=None):
     """
     Берем информацию по текущей свече для конкретной бумаги, 
     для принятия окончательного решения на открытие /закрытие позиции 
     или установки новых take_profit / stop_loss
     """
     curr_candle = None
+    import pytz
+
     timezone = pytz.timezone("Europe/Moscow")
 
-    with Client(TOKEN) as client:
-        for candle in client.get_all_candles(
-                figi=figi,
-                from_=datetime.now() - timedelta(minutes=15),
-                to=datetime.now(),
-                interval=candle_interval,
-        ):
-            curr_candle = {'figi': figi,
-                           'open': money_to_val(candle.open),
-                           'close': money_to_val(candle.close),
-                           'high': money_to_val(candle.high),
-                           'low': money_to_val(candle.low),
-                           'begin': candle.time.astimezone(timezone).strftime('%Y-%m-%d %H:%M:%S')
-                           }
+    candles = get_client(client).call(lambda services: list(services.get_all_candles(
+        figi=figi,
+        from_=datetime.now() - timedelta(minutes=15),
+        to=datetime.now(),
+        interval=candle_interval,
+    )), group='market_data', priority=PRIORITY_DEFAULT)
+
+    for candle in candles:
+        curr_candle = {'figi': figi,
+                       'open': money_to_val(candle.open),
+                       'close': money_to_val(candle.close),
+                       'high': money_to_val(candle.high),
+                       'low': money_to_val(candle.low),
+                       'begin': candle.time.astimezone(timezone).strftime('%Y-%m-%d %H:%M:%S')
+                       }
     if not curr_candle:
         raise RuntimeError('func: get_current_candle_15m - Current candle does not exist!')
 
     return curr_candle
 
 
+def ma_above(fast, slow):
+    """
+    fast > slow с относительным допуском MA_TIE_TOLERANCE: равные средние дают False при любом порядке
+    суммирования (rolling pandas, инкрементальный расчет, кумулятивные суммы бэктеста)
+    :param fast, slow: float или np.ndarray
+    """
+    return fast - slow > MA_TIE_TOLERANCE * np.abs(slow)
+
+
 def ma_indicator(data, ma_fast=12, ma_long=24):
     """
     Add Moving Average indicators
@@ -355,9 +546,9 @@ def ma_indicator(data, ma_fast=12, ma_long=24):
     """
     data[f'close_ma_fast'] = data['close'].rolling(window=ma_fast).mean()
     data[f'close_ma_long'] = data['close'].rolling(window=ma_long).mean()
-    data['to_buy'] = np.where(data.close_ma_fast > data.close_ma_long, 1, 0)
+    data['to_buy'] = np.where(ma_above(data.close_ma_fast, data.close_ma_long), 1, 0).astype(np.int8)
     data['last_direction'] = data['to_buy'].shift(+1)
-    data['signal'] = np.where(data.to_buy != data.last_direction, 1, 0)
+    data['signal'] = np.where(data.to_buy != data.last_direction, 1, 0).astype(np.int8)
     return data
 
 
@@ -370,12 +561,14 @@ def macd_indicator(data, macd_min, macd_max, macd_signal):
     :param macd_signal: signal MACD interval
     :return: pd.DataFrame
     """
+    import talib  # нужен только для MACD, не загружается при импорте модуля
+
     data['macd'], data['macdsignal'], data['macdhist'] = talib.MACD(data.close,
                                                                     fastperiod=macd_min,
                                                                     slowperiod=macd_max,
                                                                     signalperiod=macd_signal)
-    data['macd_buy'] = np.where(data.macd > data.macdsignal, 1, 0)
+    data['macd_buy'] = np.where(data.macd > data.macdsignal, 1, 0).astype(np.int8)
     data['macd_last_direction'] = data['macd_buy'].shift(+1)
-    data['macd_signal'] = np.where(data.macd_buy != data.macd_last_direction, 1, 0)
+    data['macd_signal'] = np.where(data.macd_buy != data.macd_last_direction, 1, 0).astype(np.int8)
 
     return data
@@ -1,92 +1,175 @@
 import ti_functional as tif
-
-def ma_trading_strategy(tick, account_id, stock_info, tf='15m'):
-    # берем по тикеру информацию: фиги, лотность, доступность шортов
-    figi, lot, short, quotation_round = stock_info[stock_info.ticker == tick][['figi', 'lot',
-                                                                               'short_enabled_flag',
-                                                                               'min_price_step']].values[0]
+from account_state import AccountSnapshot
+from state_store import get_state
+from order_execution import bracket_order, cancel_stop_orders, close_position, stop_order_ids, submit_job
+from risk import ORDER_ID_FIELDS, apply_stop_updates, position_order_ids, trailing_stops
+from latency import timed, timer
+
+
+@timed('signal', ticker_of=lambda tick, *args, **kwargs: tick)
+def ma_signal(tick, instruments, candle_store=None, client=None, cur_candle=None, update_store=True, engine=None,
+              state=None):
+    """
+    Расчет сигнала стратегии на пересечении Moving Average по тикеру.
+    Не работает с позициями и заявками, поэтому может выполняться параллельно для разных тикеров
+    :param instruments: InstrumentRegistry - справочник инструментов
+    :param candle_store: CandleStore - локальное хранилище свечей (None - загрузка всей истории через API)
+    :param client: TIClient - клиент API (None - общий клиент ti_functional)
+    :param cur_candle: dict - текущая свеча (None - запрос через API)
+    :param update_store: bool - догружать ли свечи в candle_store перед расчетом
+    :param engine: IndicatorEngine - инкрементальный расчет МА (только вместе с candle_store),
+                   None - пересчет ma_indicator по всей истории
+    :param state: StateStore - состояние стратегии (None - общее хранилище state_store)
+    :return: dict - параметры инструмента, сигнал и текущая цена
+    """
+    # берем по тикеру информацию: фиги, лотность, свойства для округление цен
+    instrument = instruments.by_ticker(tick)
+    figi, lot = instrument.figi, instrument.lot
 
     # лучшие параметры для данного тикера
-    params = tif.load_yaml('best_ma_params')
-    min_ma, max_ma, stop_loss_lvl = params[figi]['min_ma'], params[figi]['max_ma'], params[figi]['stop_loss']
+    params = get_state(state).get_params(figi)
+    min_ma, max_ma, stop_loss_lvl = params['min_ma'], params['max_ma'], params['stop_loss']
 
     # для 15м парсим свечи за последние 10 дней (только для возможности построения МА), убирая последнюю строку
-    data = tif.get_historical_info(figi, days=10)[:-1]
-    data = tif.ma_indicator(data, ma_fast=min_ma, ma_long=max_ma)  # добавляем МА
-
-    print(f'size: {data.shape[0]}', end=' -> ')
-    print(f'min/max MA:{min_ma}/{max_ma}, stop_loss: {stop_loss_lvl}', end=' -> ')
+    if candle_store is not None and engine is not None:
+        with timer('candles'):
+            if update_store:
+                candle_store.update(figi, days=10)
+            # движку нужны только свечи после последней учтенной
+            from_ns = engine.resume_from(figi, min_ma, max_ma)
+            if from_ns is None:
+                records = candle_store.get_window(figi, days=10, update=False)[:-1]
+            else:
+                records = candle_store.load(figi, from_ns=from_ns)[:-1]
+        with timer('indicators'):
+            indicators = engine.sync(figi, records['time'], records['close'], min_ma, max_ma)
+        size, last_candle = indicators.count, indicators.last
+    else:
+        with timer('candles'):
+            if candle_store is not None:
+                data = candle_store.get_historical_info(figi, days=10, update=update_store)[:-1]
+            else:
+                data = tif.get_historical_info(figi, days=10, client=client)[:-1]
+        with timer('indicators'):
+            data = tif.ma_indicator(data, ma_fast=min_ma, ma_long=max_ma)  # добавляем МА
+        size, last_candle = data.shape[0], data.iloc[-1]
 
-    # открытые позиции
-    open_positions = tif.load_yaml('deals_params')
-    cur_pos = tif.get_current_positions()
+    # текушая свеча
+    if cur_candle is None:
+        cur_candle = tif.get_current_candle_15m(figi, client=client)
+
+    return {'tick': tick, 'figi': figi, 'lot': lot,
+            'min_ma': min_ma, 'max_ma': max_ma, 'stop_loss_lvl': stop_loss_lvl,
+            'size': size, 'close': last_candle['close'],
+            'to_buy': last_candle['to_buy'], 'signal': last_candle['signal'],
+            'cur_close': cur_candle['close'],
+            'round_features': instrument.round_features}
+
+
+@timed('execute', ticker_of=lambda ma_sig, *args, **kwargs: ma_sig['tick'])
+def ma_execute(ma_sig, account_id, client=None, snapshot=None, state=None, executor=None, trail=True):
+    """
+    Работа с позициями и заявками по рассчитанному ma_signal сигналу.
+    Вызовы для одного счета выполняются последовательно (общее состояние открытых позиций)
+    :param ma_sig: dict - результат ma_signal
+    :param account_id: str - номер счета
+    :param client: TIClient - клиент API (None - общий клиент ti_functional)
+    :param snapshot: AccountSnapshot - снимок счета на текущий цикл (None - создается для одного вызова)
+    :param state: StateStore - состояние стратегии (None - общее хранилище state_store)
+    :param executor: OrderExecutor - очередь заявок (None - заявки выставляются сразу)
+    :param trail: bool - подтягивать stop_loss открытой позиции (False - вызывающий подтягивает стопы
+                  сразу по всем позициям через risk.trailing_stops)
+    """
+    if snapshot is None:
+        snapshot = AccountSnapshot(client)
+    state = get_state(state)
+
+    tick, figi, lot = ma_sig['tick'], ma_sig['figi'], ma_sig['lot']
+    stop_loss_lvl, round_features = ma_sig['stop_loss_lvl'], ma_sig['round_features']
+    to_buy, signal, cur_close = ma_sig['to_buy'], ma_sig['signal'], ma_sig['cur_close']
+
+    print(f'size: {ma_sig["size"]}', end=' -> ')
+    print(f'min/max MA:{ma_sig["min_ma"]}/{ma_sig["max_ma"]}, stop_loss: {stop_loss_lvl}', end=' -> ')
+
+    # открытая позиция
+    pos_info = state.get_position(tick)
 
     # если позиция была открыта и до сих пор открыта, то берем по ней информацию
-    if tick in open_positions and tick in cur_pos.figi.values:
-        pos_info = open_positions[tick]
-        cnt_lot, buy_price, _stop_loss_ = pos_info['lot'], pos_info['buy_price'], pos_info['stop_loss']
-    elif tick in open_positions:
-        del open_positions[tick]
+    if pos_info is not None and snapshot.quantity(figi) > 0:
+        cnt_lot, buy_price, _stop_loss_ = pos_info['lots'], pos_info['price'], pos_info['stop_loss']
+    elif pos_info is not None:
+        # бумаг на счете нет (сработала стоп-заявка или не исполнилась заявка на вход): оставшиеся стоп-заявки
+        # отменяются, иначе они продадут бумаги, которых нет, и накопятся со стопами следующего входа
+        for job in cancel_stop_orders(figi, account_id, round_features, position_order_ids(pos_info), lot=lot):
+            submit_job(job, executor, client, snapshot)
+        state.delete_position(tick)
         cnt_lot, buy_price, _stop_loss_ = 0, 0, 0
         # можно сюда добавить функцию с поиском цены закрытия и добавление данных в историю сделок
     else:
         cnt_lot, buy_price, _stop_loss_ = 0, 0, 0
 
-    # информация последней свечки
-    last_candle = data.iloc[-1]
-    close, to_buy, signal = last_candle.close, last_candle.to_buy, last_candle.signal
-
-    # текушая свеча
-    cur_candle = tif.get_current_candle_15m(figi)
-    cur_close = cur_candle['close']
-
-    # свойства для округление цен
-    round_features = tif.price_features(quotation_round.nano)
-
     #################################################################################################
     print(f'to_buy: {to_buy}, signal: {signal}, cnt_lot: {cnt_lot}')
 
     if to_buy == 1 and signal == 1 and cnt_lot == 0:
 
-        lots_for_buy = tif.calc_num_lots_for_buy(lot, cur_close)
+        lots_for_buy = tif.calc_num_lots_for_buy(lot, cur_close, client=client, snapshot=snapshot)
 
         buy_price = cur_close * 1.0005
         stop_loss = cur_close * (1 - stop_loss_lvl)
         take_profit = cur_close * (1 + 0.05)
 
         if lots_for_buy > 0:
-            # лимитная заявка с уровнем покупки не выше тек.цена+погрешность
-            tif.order(figi, lots_for_buy, buy_price, account_id, round_features,
-                            direction='buy', order_type='limit')
-            #         tif.order(figi, lots_for_buy, buy_price, account_id, round_features,
-            #             direction='buy', order_type='market')
-            tif.stop_order(figi, lots_for_buy, stop_loss, account_id, round_features,
-                          direction='sell', order_type='stop_loss')
-            tif.stop_order(figi, lots_for_buy, take_profit, account_id, round_features,
-                          direction='sell', order_type='take_profit')
-
-            open_positions[tick] = {'lots': lots_for_buy, 'price': buy_price,
-                                    'stop_loss': stop_loss, 'take_profit': take_profit}
-            print(f'Position is open: {open_positions[tick]}')
+            # лимитная заявка с уровнем покупки не выше тек.цена+погрешность, затем stop_loss / take_profit
+            job = bracket_order(figi, lots_for_buy, buy_price, stop_loss, take_profit, account_id, round_features,
+                                lot=lot, order_type='limit')
+
+            pos_info = {'lots': lots_for_buy, 'price': buy_price, 'stop_loss': stop_loss, 'take_profit': take_profit,
+                        'order_id': job.legs[0].order_id}
+            state.set_position(tick, pos_info)
+            print(f'Position is open: {pos_info}')
+
+            def entry_done(future):
+                job = future.result()
+                if not job.results:  # заявка на покупку не выставилась
+                    state.delete_position(tick)
+                elif state.get_position(tick) is not None:
+                    ids = stop_order_ids(job)
+                    fields = {ORDER_ID_FIELDS[order_type]: stop_order_id for order_type, stop_order_id in ids.items()}
+                    if 'stop_loss' not in ids:
+                        # stop_loss не выставился: уровень 0 - следующий проход risk выставит его сразу
+                        fields['stop_loss'] = 0.0
+                    state.update_position(tick, **fields)
+
+            submit_job(job, executor, client, snapshot).add_done_callback(entry_done)
         else:
             print(f'Недостаточно средств для открытия позиции')
 
-    elif to_buy == 1 and cnt_lot >= 1:
-        new_stop_loss = cur_close * (1 - stop_loss_lvl)
-        new_take_profit = cur_close * (1 + 0.03)
-
-        if _stop_loss_ < new_stop_loss:
-            tif.stop_order(figi, cnt_lot, new_stop_loss, account_id, round_features, direction='sell',
-                       order_type='stop_loss')
-            open_positions[tick]['stop_loss'] = new_stop_loss
-            #             tif.stop_order(figi, cnt_lot, new_take_profit, account_id, round_features, direction='sell', order_type='take_profit')
-            #             tif.open_positions[tick]['taset_take_profitke_profit'] = new_take_profit
-
-            print(f'Cur.price: {cur_close}, stop_loss changed: {old_stop_loss} --> {new_stop_loss}')
+    elif to_buy == 1 and cnt_lot >= 1 and trail:
+        # stop_loss переставляется (отмена + новая заявка), только если уровень вырос хотя бы на шаг цены
+        apply_stop_updates(trailing_stops({tick: ma_sig}, {tick: pos_info}), account_id, state, executor, client,
+                           snapshot)
 
     elif to_buy == 0 and cnt_lot > 0:
-        tif.order(figi, cnt_lot, buy_price, account_id, round_features, direction='sell', order_type='market')
-        del open_positions[tick]
+        # отмена стоп-заявок позиции и продажа по рынку
+        job = close_position(figi, cnt_lot, cur_close, account_id, round_features, position_order_ids(pos_info),
+                             lot=lot)
+
+        def exit_done(future):
+            job = future.result()
+            if job.ok:
+                state.delete_position(tick)
+            elif state.get_position(tick) is not None:
+                # позиция остается, выход повторится на следующем баре (или она удалится, если сработал стоп);
+                # уже отмененные стоп-заявки повторно не отменяются, без stop_loss уровень 0 - как в risk
+                cancelled = [leg.order_type for leg in job.legs[:len(job.results)] if leg.kind == 'cancel_stop_order']
+                fields = {ORDER_ID_FIELDS[order_type]: None for order_type in cancelled}
+                if 'stop_loss' in cancelled:
+                    fields['stop_loss'] = 0.0
+                if fields:
+                    state.update_position(tick, **fields)
+
+        submit_job(job, executor, client, snapshot).add_done_callback(exit_done)
         print(
             f'Closed position: buy: {buy_price}, sell: {cur_close}, profit: {round((cur_close - buy_price) / buy_price, 2)}%')
 
@@ -96,6 +179,14 @@ def ma_trading_strategy(tick, account_id, stock_info, tf='15m'):
     #     else:
     #         break
 
-    # сохраняем изменения активным по сделкам
-    tif.save_yaml(open_positions, 'deals_params')
 
+def ma_trading_strategy(tick, account_id, instruments, tf='15m', candle_store=None, client=None, snapshot=None,
+                        state=None):
+    """
+    Стратегия на пересечении Moving Average: расчет сигнала и работа с позициями по тикеру
+    :param candle_store: CandleStore - локальное хранилище свечей (None - загрузка всей истории через API)
+    :param client: TIClient - клиент API (None - общий клиент ti_functional)
+    :param snapshot: AccountSnapshot - снимок счета на текущий цикл
+    :param state: StateStore - состояние стратегии (None - общее хранилище state_store)
+    """
+    ma_execute(ma_signal(tick, instruments, candle_store, client, state=state), account_id, client, snapshot, state)